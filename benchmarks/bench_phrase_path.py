@@ -0,0 +1,270 @@
+"""
+Replays a stream of phrases through wax's `pre:phrase` and `post:phrase`
+hooks outside of Talon, using the stand-in Talon API in `tests/stubs`, and
+reports throughput, per-phrase hook latency and allocations.
+
+The phrases are synthesized from the example recording in `examples/`.  Run
+from anywhere with eg
+
+    python benchmarks/bench_phrase_path.py --phrases 5000
+    python benchmarks/bench_phrase_path.py --setting wax_log_durability='"stop"'
+
+NB: Talon loads every Python file in the user directory, so nothing here may
+run at import time.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCHMARKS_DIR.parent
+EXAMPLE_LOG = REPO_DIR / "examples" / "2022-09-06T13-36-46" / "talon-log.jsonl"
+PACKAGE_NAME = "wax_talon"
+WAX_MODULES = [
+    "wax",
+    "parse_sim",
+    "screenshots",
+    "notify",
+    "recorders.git_recorder",
+    "recorders.cursorless_recorder",
+    "recorders.quicktime_recorder",
+    "recorders.obs_recorder_mac",
+]
+
+
+class Word(str):
+    """A recognized word, as found in the `text` of a phrase"""
+
+    def __new__(cls, text: str, start, end):
+        word = super().__new__(cls, text)
+        word.start = start
+        word.end = end
+        return word
+
+
+def load_example_phrases() -> list[dict]:
+    with open(EXAMPLE_LOG) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    return [
+        record
+        for record in records
+        if record.get("type") in ("talonCommandPhrase", "talonIgnoredPhrase")
+    ]
+
+
+def write_talon_files(talon_home: Path, phrases: list[dict]):
+    """Creates `.talon` files containing the rules referenced by the example
+    phrases at the lines they were found on, padded with filler rules"""
+    files: dict[str, dict[int, str]] = {}
+
+    for phrase in phrases:
+        for command in phrase.get("commands") or []:
+            rule = command.get("user_rule")
+            if rule is not None:
+                files.setdefault(command["file"], {})[rule["line"]] = rule["rule"]
+
+    for file, rules in files.items():
+        lines = [
+            rules.get(line, f"filler rule number {line}: skip()")
+            for line in range(1, max(rules) + 200)
+        ]
+        path = talon_home / file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\n".join(lines) + "\n")
+
+
+def setup(settings: list[str], modules: list[str] = WAX_MODULES):
+    """Installs the stand-in Talon API and imports wax as a package"""
+    import importlib
+    import types
+
+    root = Path(tempfile.mkdtemp(prefix="wax-bench-"))
+    talon_home = root / ".talon"
+    (talon_home / "user").mkdir(parents=True)
+
+    # Recordings are written to `~/talon-recording-logs`
+    os.environ["HOME"] = str(root)
+    os.environ["WAX_TALON_HOME"] = str(talon_home)
+    sys.path.insert(0, str(REPO_DIR / "tests" / "stubs"))
+
+    import talon
+
+    talon.talon_user_dir = talon_home / "user"
+
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [str(REPO_DIR)]
+    sys.modules[PACKAGE_NAME] = package
+
+    for module in modules:
+        importlib.import_module(f"{PACKAGE_NAME}.{module}")
+
+    class HistoryActions:
+        def history_transform_phrase_text(words):
+            # Normally provided by the community user files
+            return " ".join(str(word) for word in words) or None
+
+    talon.Module().action_class(HistoryActions)
+
+    for assignment in settings:
+        name, _, value = assignment.partition("=")
+        talon.settings.values[f"user.{name}"] = json.loads(value)
+
+    return talon, talon_home
+
+
+def make_phrase_events(talon, phrases: list[dict]) -> list[dict]:
+    """Builds the objects Talon passes to the phrase hooks"""
+    events = []
+
+    for phrase in phrases:
+        if phrase["type"] == "talonCommandPhrase":
+            talon.speech_system.sims[phrase["phrase"]] = phrase["rawSim"]
+            parsed = [command["captures"] for command in phrase["commands"]]
+            words = [word["text"] for word in phrase["raw_words"]]
+        else:
+            parsed = []
+            # Ignored phrases have no text after transformation
+            words = []
+
+        events.append({"words": words, "parsed": parsed})
+
+    return events
+
+
+def emit_phrase(talon, event: dict) -> tuple[float, float]:
+    now = time.perf_counter()
+    words = [
+        Word(text, now - 0.5 + 0.1 * idx, now - 0.45 + 0.1 * idx)
+        for idx, text in enumerate(event["words"])
+    ]
+    j = {"text": words, "_ts": now - 0.5, "parsed": event["parsed"]}
+
+    start = time.perf_counter()
+    talon.speech_system.emit("pre:phrase", j)
+    pre_end = time.perf_counter()
+    talon.speech_system.emit("post:phrase", j)
+    post_end = time.perf_counter()
+
+    return pre_end - start, post_end - pre_end
+
+
+def percentile(values: list[float], p: int) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+def format_latencies(name: str, values: list[float]) -> str:
+    micros = [value * 1e6 for value in values]
+    return (
+        f"{name:>12}: p50 {percentile(micros, 50):9.1f}us  "
+        f"p95 {percentile(micros, 95):9.1f}us  "
+        f"p99 {percentile(micros, 99):9.1f}us  "
+        f"max {max(micros):9.1f}us"
+    )
+
+
+def run(phrase_count: int, allocation_phrase_count: int, settings: list[str]):
+    talon, talon_home = setup(settings)
+    phrases = load_example_phrases()
+    write_talon_files(talon_home, phrases)
+    events = make_phrase_events(talon, phrases)
+    actions = talon.actions
+
+    actions.user.wax_start_recording()
+
+    pre_latencies = []
+    post_latencies = []
+    start = time.perf_counter()
+    for idx in range(phrase_count):
+        pre, post = emit_phrase(talon, events[idx % len(events)])
+        pre_latencies.append(pre)
+        post_latencies.append(post)
+    hooks_end = time.perf_counter()
+
+    tracemalloc.start()
+    peaks = []
+    before = tracemalloc.get_traced_memory()[0]
+    for idx in range(allocation_phrase_count):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        emit_phrase(talon, events[idx % len(events)])
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    stop_start = time.perf_counter()
+    actions.user.wax_stop_recording()
+    end = time.perf_counter()
+
+    total_phrases = phrase_count + allocation_phrase_count
+    results = {
+        "phrases": phrase_count,
+        "hookThroughput": phrase_count / (hooks_end - start),
+        "drainSeconds": end - stop_start,
+        "endToEndThroughput": total_phrases / (end - start),
+        "prePhraseLatency": pre_latencies,
+        "postPhraseLatency": post_latencies,
+        "meanPeakAllocationBytes": statistics.mean(peaks) if peaks else None,
+        "retainedBytesPerPhrase": (
+            retained / allocation_phrase_count if allocation_phrase_count else None
+        ),
+        "notifications": talon.notifications,
+    }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--phrases", type=int, default=2000, help="Number of phrases to time"
+    )
+    parser.add_argument(
+        "--allocation-phrases",
+        type=int,
+        default=200,
+        help="Number of additional phrases to run while tracing allocations",
+    )
+    parser.add_argument(
+        "--setting",
+        action="append",
+        default=[],
+        metavar="NAME=JSON_VALUE",
+        help="Override a wax setting, eg wax_log_durability='\"stop\"'",
+    )
+    parser.add_argument("--json", type=Path, help="Also write the results here")
+    args = parser.parse_args()
+
+    results = run(args.phrases, args.allocation_phrases, args.setting)
+
+    print(f"Phrases: {results['phrases']}")
+    print(f"Hook throughput: {results['hookThroughput']:.0f} phrases/s")
+    print(
+        f"End-to-end throughput (including draining the log): "
+        f"{results['endToEndThroughput']:.0f} phrases/s"
+    )
+    print(f"Drain at stop: {results['drainSeconds'] * 1000:.1f}ms")
+    print(format_latencies("pre:phrase", results["prePhraseLatency"]))
+    print(format_latencies("post:phrase", results["postPhraseLatency"]))
+    if results["meanPeakAllocationBytes"] is not None:
+        print(
+            f"Mean peak allocation per phrase: "
+            f"{results['meanPeakAllocationBytes']:.0f} bytes"
+        )
+        print(f"Retained per phrase: {results['retainedBytesPerPhrase']:.0f} bytes")
+    for notification in results["notifications"]:
+        print(f"Notification: {notification}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
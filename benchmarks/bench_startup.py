@@ -0,0 +1,118 @@
+"""
+Measures what wax costs when it isn't recording: the time to import every
+Python file in the repo, as Talon does when it loads the user directory, the
+modules outside of wax and Talon that get imported along the way, and the
+time spent in wax's phrase hooks per phrase while idle.  Run from anywhere
+with eg
+
+    python benchmarks/bench_startup.py --phrases 5000
+
+Each run imports wax into a fresh interpreter, so run it a few times and
+compare the medians.
+
+NB: Talon loads every Python file in the user directory, so nothing here may
+run at import time.
+"""
+
+import argparse
+import importlib
+import json
+import sys
+import time
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCHMARKS_DIR.parent
+# Modules that are part of Talon's own runtime, whose import cost isn't wax's
+TALON_PROVIDED_MODULES = {"talon", "talon_init"}
+# Number of slowest files to report
+SLOWEST_COUNT = 5
+
+
+def talon_loaded_modules() -> list[str]:
+    """Returns the module name of every Python file that Talon would load"""
+    return sorted(
+        ".".join(path.relative_to(REPO_DIR).with_suffix("").parts)
+        for path in REPO_DIR.rglob("*.py")
+        if BENCHMARKS_DIR not in path.parents and path.name != "__init__.py"
+    )
+
+
+def run(phrase_count: int) -> dict:
+    sys.path.insert(0, str(BENCHMARKS_DIR))
+    import bench_phrase_path
+
+    talon, talon_home = bench_phrase_path.setup([], [])
+    modules_before = set(sys.modules)
+
+    # NB: A file's time includes anything it imports that no earlier file did
+    import_seconds = {}
+    for module in talon_loaded_modules():
+        start = time.perf_counter()
+        importlib.import_module(f"{bench_phrase_path.PACKAGE_NAME}.{module}")
+        import_seconds[module] = time.perf_counter() - start
+
+    imported = sorted(
+        {
+            name.partition(".")[0]
+            for name in set(sys.modules) - modules_before
+            if not name.startswith(bench_phrase_path.PACKAGE_NAME)
+        }
+        - TALON_PROVIDED_MODULES
+        - set(sys.builtin_module_names)
+    )
+
+    phrases = bench_phrase_path.load_example_phrases()
+    bench_phrase_path.write_talon_files(talon_home, phrases)
+    events = bench_phrase_path.make_phrase_events(talon, phrases)
+
+    hook_seconds = 0.0
+    for idx in range(phrase_count):
+        pre, post = bench_phrase_path.emit_phrase(talon, events[idx % len(events)])
+        hook_seconds += pre + post
+
+    return {
+        "importSeconds": sum(import_seconds.values()),
+        "slowestImports": sorted(
+            import_seconds.items(), key=lambda item: item[1], reverse=True
+        )[:SLOWEST_COUNT],
+        "importedModules": imported,
+        "phraseHandlers": sum(
+            len(talon.speech_system.handlers.get(topic, []))
+            for topic in ["pre:phrase", "post:phrase"]
+        ),
+        "phrases": phrase_count,
+        "idleHookSecondsPerPhrase": hook_seconds / phrase_count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--phrases",
+        type=int,
+        default=5000,
+        help="Number of phrases to emit while not recording",
+    )
+    parser.add_argument("--json", type=Path, help="Also write the results here")
+    args = parser.parse_args()
+
+    results = run(args.phrases)
+
+    print(f"Import of all wax files: {results['importSeconds'] * 1000:.1f}ms")
+    for module, seconds in results["slowestImports"]:
+        print(f"{module:>40}: {seconds * 1000:.1f}ms")
+    print(f"Modules imported from outside wax: {', '.join(results['importedModules'])}")
+    print(f"Phrase handlers registered while idle: {results['phraseHandlers']}")
+    print(
+        f"Idle hook time per phrase: "
+        f"{results['idleHookSecondsPerPhrase'] * 1e6:.2f}us"
+    )
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import threading
+from pathlib import Path
+
+from talon import Module
+
+from .notify import notify_from_thread
+from .waxlog.catalog import CATALOG_FILENAME, Catalog
+
+mod = Module()
+
+catalog_enabled = mod.setting(
+    "wax_catalog",
+    type=bool,
+    default=False,
+    desc="If `True`, index each recording in `~/talon-recording-logs/catalog.sqlite` in the background when it stops, so that phrases can be searched across sessions with `waxlog catalog`",
+)
+
+# Held while the catalog is being updated, so that only one thread writes it
+update_lock = threading.Lock()
+
+
+def update_catalog_in_background(root: Path):
+    """Indexes the new or changed recordings in `root`, including the one that
+    just stopped, on a background thread"""
+    if not catalog_enabled.get():
+        return
+
+    threading.Thread(
+        target=update_catalog, args=(root,), name="wax-catalog", daemon=True
+    ).start()
+
+
+def update_catalog(root: Path):
+    with update_lock:
+        try:
+            catalog = Catalog(root / CATALOG_FILENAME)
+            try:
+                catalog.update(root)
+            finally:
+                catalog.close()
+        except Exception as e:
+            notify_from_thread("ERROR: Couldn't update wax catalog", f"{e}")
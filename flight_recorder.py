@@ -0,0 +1,156 @@
+import shutil
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+
+from talon import Module
+
+from .log_writer import log_json_backend
+from .serializer import get_dumps
+
+mod = Module()
+
+flight_recorder_enabled = mod.setting(
+    "wax_flight_recorder",
+    type=bool,
+    default=False,
+    desc="If `True`, continuously keep the most recent phrases in memory whenever wax isn't recording, so that they can be saved after the fact with `user.wax_save_flight_recording()`",
+)
+flight_max_phrases = mod.setting(
+    "wax_flight_max_phrases",
+    type=int,
+    default=500,
+    desc="Maximum number of phrases kept by the flight recorder",
+)
+flight_max_minutes = mod.setting(
+    "wax_flight_max_minutes",
+    type=float,
+    default=10.0,
+    desc="Maximum age in minutes of the phrases kept by the flight recorder",
+)
+flight_max_bytes = mod.setting(
+    "wax_flight_max_bytes",
+    type=int,
+    default=16_000_000,
+    desc="Maximum size in bytes of the log records kept in memory by the flight recorder",
+)
+flight_screenshots = mod.setting(
+    "wax_flight_screenshots",
+    type=bool,
+    default=False,
+    desc="If `True`, the flight recorder also keeps screenshots of the phrases it keeps, in a spool directory on disk",
+)
+
+# Records that describe the whole session, which are never discarded
+HEADER_RECORD_TYPES = ["initialInfo", "initialTiming"]
+PHRASE_RECORD_TYPES = ["talonCommandPhrase", "talonIgnoredPhrase"]
+
+
+@dataclass
+class FlightEntry:
+    # Time the record was written, as returned by `time.perf_counter`
+    written_at: float
+    data: bytes
+    is_header: bool
+    is_phrase: bool
+    # Screenshots referred to by the record
+    filenames: list[str]
+
+
+class FlightBuffer:
+    """
+    A log sink that keeps the most recent records in memory, discarding the
+    oldest once there are too many phrases, they are too old, or they take up
+    too much memory.  Screenshots referred to by discarded records are
+    deleted from `screenshots_directory` once no buffered record refers to
+    them, as a full screenshot can be the `baseFilename` of later deltas.
+    """
+
+    def __init__(self, screenshots_directory: Path):
+        self.screenshots_directory = screenshots_directory
+        self.max_phrases = flight_max_phrases.get()
+        self.max_seconds = flight_max_minutes.get() * 60
+        self.max_bytes = flight_max_bytes.get()
+        self.dumps = get_dumps(log_json_backend.get())
+
+        self.lock = threading.Lock()
+        self.header: list[FlightEntry] = []
+        self.entries: deque[FlightEntry] = deque()
+        self.byte_count = 0
+        self.phrase_count = 0
+        # Number of buffered entries that refer to each screenshot
+        self.file_references: dict[str, int] = {}
+
+    def encode(self, record: dict) -> FlightEntry:
+        filenames = [
+            info[key]
+            for info in (record.get("screenshots") or {}).values()
+            for key in ["filename", "baseFilename"]
+            if info.get(key) is not None
+        ]
+
+        return FlightEntry(
+            written_at=time.perf_counter(),
+            data=(self.dumps(record) + "\n").encode(),
+            is_header=record.get("type") in HEADER_RECORD_TYPES,
+            is_phrase=record.get("type") in PHRASE_RECORD_TYPES,
+            filenames=filenames,
+        )
+
+    def write_encoded(self, entry: FlightEntry):
+        with self.lock:
+            if entry.is_header:
+                self.header.append(entry)
+                return
+
+            self.entries.append(entry)
+            self.byte_count += len(entry.data)
+            self.phrase_count += entry.is_phrase
+            for filename in entry.filenames:
+                self.file_references[filename] = (
+                    self.file_references.get(filename, 0) + 1
+                )
+            self.evict(entry.written_at)
+
+    def evict(self, now: float):
+        while self.entries and (
+            self.phrase_count > self.max_phrases
+            or self.byte_count > self.max_bytes
+            or now - self.entries[0].written_at > self.max_seconds
+        ):
+            entry = self.entries.popleft()
+            self.byte_count -= len(entry.data)
+            self.phrase_count -= entry.is_phrase
+            for filename in entry.filenames:
+                references = self.file_references.pop(filename) - 1
+                if references > 0:
+                    self.file_references[filename] = references
+                else:
+                    (self.screenshots_directory / filename).unlink(missing_ok=True)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def save(self, directory: Path):
+        """Writes the buffered records and their screenshots to a recording
+        directory"""
+        with self.lock:
+            self.evict(time.perf_counter())
+            entries = self.header + list(self.entries)
+
+        with open(directory / "talon-log.jsonl", "wb") as out:
+            for entry in entries:
+                out.write(entry.data)
+
+        screenshots_directory = directory / "screenshots"
+        screenshots_directory.mkdir()
+        for entry in entries:
+            for filename in entry.filenames:
+                path = self.screenshots_directory / filename
+                if path.exists():
+                    shutil.copy2(path, screenshots_directory / filename)
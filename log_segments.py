@@ -0,0 +1,217 @@
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+
+from .notify import notify_from_thread
+from .waxlog.lazy import lazy_import
+from .waxlog.scope import ScopeTracker
+from .waxlog.segments import (
+    COMPRESSION_SUFFIXES,
+    MANIFEST_FILENAME,
+    MANIFEST_VERSION,
+    save_manifest,
+    segment_filename,
+    zstandard,
+)
+
+gzip = lazy_import("gzip")
+
+COMPRESSIONS = ["none", "gzip", "zstd"]
+# Segments are only started before a phrase, so that a phrase and its
+# completion usually end up in the same segment
+SEGMENT_START_RECORD_TYPES = ["talonCommandPhrase", "talonIgnoredPhrase"]
+
+
+class SegmentedJsonlSink:
+    """
+    Writes records to a series of `talon-log.NNN.jsonl` segments, starting a
+    new segment once the current one reaches `max_bytes` or `max_seconds`,
+    and lists the segments in `talon-log.manifest.json`.  Closed segments are
+    compressed on a background thread if requested.  See
+    `waxlog/segments.py` for the format.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        dumps: Callable[[Any], str],
+        max_bytes: int,
+        max_seconds: float,
+        compression: str,
+    ):
+        if compression not in COMPRESSIONS:
+            raise ValueError(
+                f"Unknown wax log compression '{compression}'; expected one of {COMPRESSIONS}"
+            )
+        if compression == "zstd" and zstandard is None:
+            # Like orjson, zstandard is only used if installed
+            compression = "gzip"
+
+        self.directory = directory
+        self.dumps = dumps
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compression = compression
+
+        self.scope_tracker = ScopeTracker()
+        # Guards `segments` and the manifest, which compression threads update
+        self.lock = threading.Lock()
+        self.segments: list[dict[str, Any]] = []
+        self.compressors: list[threading.Thread] = []
+        self.file = None
+        self.total_bytes = 0
+        self.segment_bytes = 0
+        self.segment_started_at = 0.0
+
+        self.start_segment()
+
+    def encode(self, record: dict) -> tuple[dict, str]:
+        return record, self.dumps(record) + "\n"
+
+    def write_encoded(self, data: tuple[dict, str]):
+        record, line = data
+
+        if record.get("type") in SEGMENT_START_RECORD_TYPES and (
+            (self.max_bytes > 0 and self.segment_bytes >= self.max_bytes)
+            or (
+                self.max_seconds > 0
+                and time.perf_counter() - self.segment_started_at >= self.max_seconds
+            )
+        ):
+            self.finish_segment()
+            self.start_segment()
+
+        self.write_line(line)
+        self.update_segment(record)
+
+        if record.get("type") == "talonCommandPhrase":
+            self.scope_tracker.update(record)
+
+    def write_line(self, line: str):
+        data = line.encode()
+        self.file.write(data)
+        self.segment_bytes += len(data)
+        self.total_bytes += len(data)
+
+    def update_segment(self, record: dict):
+        time_offsets = [
+            value
+            for value in (record.get("timeOffsets") or {}).values()
+            if isinstance(value, (int, float))
+        ]
+        if not time_offsets:
+            return
+
+        with self.lock:
+            segment = self.segments[-1]
+            start = min(time_offsets)
+            end = max(time_offsets)
+            if segment["startTimeOffset"] is None or start < segment["startTimeOffset"]:
+                segment["startTimeOffset"] = start
+            if segment["endTimeOffset"] is None or end > segment["endTimeOffset"]:
+                segment["endTimeOffset"] = end
+
+    def start_segment(self):
+        index = len(self.segments)
+        filename = segment_filename(index)
+
+        self.file = open(self.directory / filename, "wb")
+        self.segment_bytes = 0
+        self.segment_started_at = time.perf_counter()
+
+        with self.lock:
+            self.segments.append(
+                {
+                    "index": index,
+                    "filename": filename,
+                    "startOffset": self.total_bytes,
+                    "startTimeOffset": None,
+                    "endTimeOffset": None,
+                    "closed": False,
+                }
+            )
+            self.save_manifest()
+
+        self.write_line(
+            self.dumps(
+                {
+                    "type": "segmentHeader",
+                    "index": index,
+                    "startOffset": self.total_bytes,
+                    "scope": self.scope_tracker.scope,
+                }
+            )
+            + "\n"
+        )
+
+    def finish_segment(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+        with self.lock:
+            segment = self.segments[-1]
+            segment["closed"] = True
+            segment["bytes"] = self.segment_bytes
+            self.save_manifest()
+
+        if self.compression != "none":
+            compressor = threading.Thread(
+                target=self.compress_segment,
+                args=(segment,),
+                name="wax-log-compressor",
+                daemon=True,
+            )
+            compressor.start()
+            self.compressors.append(compressor)
+
+    def compress_segment(self, segment: dict[str, Any]):
+        path = self.directory / segment["filename"]
+        compressed_path = path.with_name(
+            path.name + COMPRESSION_SUFFIXES[self.compression]
+        )
+
+        try:
+            with open(path, "rb") as source, open_compressed(
+                compressed_path, self.compression
+            ) as destination:
+                shutil.copyfileobj(source, destination)
+
+            with open(compressed_path, "rb") as f:
+                os.fsync(f.fileno())
+
+            with self.lock:
+                segment["filename"] = compressed_path.name
+                self.save_manifest()
+
+            path.unlink()
+        except Exception as e:
+            notify_from_thread(
+                f"ERROR: Couldn't compress log segment {path.name}", f"{e}"
+            )
+
+    def save_manifest(self):
+        save_manifest(
+            self.directory / MANIFEST_FILENAME,
+            {"version": MANIFEST_VERSION, "segments": self.segments},
+        )
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.finish_segment()
+
+        for compressor in self.compressors:
+            compressor.join()
+
+
+def open_compressed(path: Path, compression: str):
+    if compression == "gzip":
+        return gzip.open(path, "wb")
+
+    return zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
@@ -0,0 +1,243 @@
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from talon import Module
+
+from .log_segments import SegmentedJsonlSink
+from .notify import notify_from_thread
+from .overhead import profiler
+from .serializer import default, get_dumps
+from .waxlog.binary import BinaryLogWriter
+from .waxlog.stats import SessionStats
+
+mod = Module()
+
+log_durability = mod.setting(
+    "wax_log_durability",
+    type=str,
+    default="phrase",
+    desc="When to flush the wax recording log to disk. One of `phrase` (after every phrase), `records` (every `user.wax_log_flush_records` records) or `stop` (only when recording stops)",
+)
+log_flush_records = mod.setting(
+    "wax_log_flush_records",
+    type=int,
+    default=50,
+    desc="Number of records to buffer before flushing when `user.wax_log_durability` is `records`",
+)
+log_flush_interval = mod.setting(
+    "wax_log_flush_interval",
+    type=float,
+    default=1.0,
+    desc="Maximum number of seconds that written records may sit unflushed, unless `user.wax_log_durability` is `stop`. Set to 0 to disable",
+)
+log_queue_size = mod.setting(
+    "wax_log_queue_size",
+    type=int,
+    default=1024,
+    desc="Maximum number of records waiting to be written before logging blocks",
+)
+log_json_backend = mod.setting(
+    "wax_log_json_backend",
+    type=str,
+    default="json",
+    desc="Library used to serialize log records. `json` writes exactly what earlier versions of wax did; `orjson` is faster but writes compact JSON, and is only used if installed",
+)
+log_format = mod.setting(
+    "wax_log_format",
+    type=str,
+    default="jsonl",
+    desc="Format of the wax recording log. One of `jsonl` (`talon-log.jsonl`) or `binary` (`talon-log.wax` plus timing columns; see `waxlog/binary.py`)",
+)
+log_segment_bytes = mod.setting(
+    "wax_log_segment_bytes",
+    type=int,
+    default=0,
+    desc="If positive, start a new segment of a `jsonl` log once the current one reaches this many bytes. Set to 0 to write a single `talon-log.jsonl`",
+)
+log_segment_minutes = mod.setting(
+    "wax_log_segment_minutes",
+    type=float,
+    default=0.0,
+    desc="If positive, start a new segment of a `jsonl` log once the current one has been written to for this many minutes. Set to 0 to disable",
+)
+log_segment_compression = mod.setting(
+    "wax_log_segment_compression",
+    type=str,
+    default="none",
+    desc="Compression applied to each log segment once it is closed. One of `none`, `gzip` or `zstd` (only used if installed; otherwise `gzip`)",
+)
+
+DURABILITY_LEVELS = ["phrase", "records", "stop"]
+LOG_FORMATS = ["jsonl", "binary"]
+
+# Sentinels placed on the queue alongside the records themselves
+FLUSH = object()
+STOP = object()
+
+
+class JsonlSink:
+    """Writes records to `talon-log.jsonl`, one JSON object per line"""
+
+    def __init__(self, directory: Path):
+        self.dumps = get_dumps(log_json_backend.get())
+        self.file = open(directory / "talon-log.jsonl", "a")
+
+    def encode(self, record: dict) -> Any:
+        return self.dumps(record) + "\n"
+
+    def write_encoded(self, data: Any):
+        self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+def make_sink(directory: Path):
+    name = log_format.get()
+
+    if name == "jsonl":
+        max_bytes = log_segment_bytes.get()
+        max_seconds = log_segment_minutes.get() * 60
+        if max_bytes > 0 or max_seconds > 0:
+            return SegmentedJsonlSink(
+                directory,
+                get_dumps(log_json_backend.get()),
+                max_bytes,
+                max_seconds,
+                log_segment_compression.get(),
+            )
+        return JsonlSink(directory)
+    if name == "binary":
+        return BinaryLogWriter(directory, default)
+
+    raise ValueError(f"Unknown wax log format '{name}'; expected one of {LOG_FORMATS}")
+
+
+class LogWriter:
+    """
+    Writes records to the recording log in `directory` from a background
+    thread, so that the phrase callbacks never wait on the file system.  The
+    log file stays open for the whole recording.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        sink: Optional[Any] = None,
+        stats: Optional[SessionStats] = None,
+    ):
+        durability = log_durability.get()
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(
+                f"Unknown wax log durability '{durability}'; expected one of {DURABILITY_LEVELS}"
+            )
+
+        self.durability = durability
+        self.flush_records = log_flush_records.get()
+        self.flush_interval = log_flush_interval.get()
+
+        self.sink = sink if sink is not None else make_sink(directory)
+        self.stats = stats
+        self.queue = queue.Queue(maxsize=log_queue_size.get())
+        self.thread = threading.Thread(
+            target=self.run, name="wax-log-writer", daemon=True
+        )
+        self.thread.start()
+
+    def write(self, output_object: dict):
+        """Queue an object to be written to the log"""
+        self.queue.put(output_object)
+
+    def write_deferred(self, build_object: Callable[[], dict]):
+        """
+        Queue a function that builds an object to be written to the log.  The
+        function is called on the writer thread, so expensive work can be kept
+        out of the phrase callbacks without reordering the log.
+        """
+        self.queue.put(build_object)
+
+    def end_phrase(self):
+        """Indicates that all records for the current phrase have been written"""
+        if self.durability == "phrase":
+            self.queue.put(FLUSH)
+
+    def wait_until_written(self):
+        """Blocks until every record queued so far has been written"""
+        written = threading.Event()
+        self.queue.put(written)
+        written.wait()
+
+    def close(self):
+        """Writes all queued records, syncs the log to disk and closes it"""
+        self.queue.put(STOP)
+        self.thread.join()
+
+    def run(self):
+        unflushed_count = 0
+        last_flush_time = time.perf_counter()
+        timed_flush = self.durability != "stop" and self.flush_interval > 0
+
+        while True:
+            try:
+                item = self.queue.get(
+                    timeout=self.flush_interval if timed_flush else None
+                )
+            except queue.Empty:
+                item = FLUSH
+
+            if item is STOP:
+                break
+
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+
+            if item is not FLUSH:
+                try:
+                    if callable(item):
+                        item = item()
+                    if self.stats is not None:
+                        with profiler.stage("stats"):
+                            self.stats.add(item)
+                    with profiler.stage("serialize"):
+                        data = self.sink.encode(item)
+                    with profiler.stage("logWrite"):
+                        self.sink.write_encoded(data)
+                    unflushed_count += 1
+                except Exception as e:
+                    notify_from_thread("ERROR: Couldn't write wax log record", f"{e}")
+
+            now = time.perf_counter()
+            should_flush = (
+                item is FLUSH
+                or (
+                    self.durability == "records"
+                    and unflushed_count >= self.flush_records
+                )
+                or (timed_flush and now - last_flush_time >= self.flush_interval)
+            )
+
+            if should_flush and unflushed_count:
+                # NB: Keep draining the queue after a failure, as the phrase
+                # callbacks block once it's full
+                try:
+                    with profiler.stage("logFlush"):
+                        self.sink.flush()
+                except Exception as e:
+                    notify_from_thread("ERROR: Couldn't flush wax log", f"{e}")
+                unflushed_count = 0
+                last_flush_time = now
+
+        try:
+            self.sink.close()
+        except Exception as e:
+            notify_from_thread("ERROR: Couldn't close wax log", f"{e}")
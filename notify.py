@@ -1,7 +1,7 @@
 # Mostly taken from https://github.com/AndreasArvidsson/andreas-talon/blob/a75f09ab67a979fca8032a2ab3304fac36220608/misc/screen.py
 from typing import Optional
 
-from talon import Module, ui
+from talon import Module, app, cron, ui
 from talon.canvas import Canvas
 from talon.skia import Paint as Paint
 from talon.skia.imagefilter import ImageFilter as ImageFilter
@@ -38,6 +38,12 @@ class Actions:
             canvas = None
 
 
+def notify_from_thread(title: str, body: str = ""):
+    """Shows a notification from any thread, by handing it to Talon's main
+    thread"""
+    cron.after("0ms", lambda: app.notify(title, body))
+
+
 def set_text_size_and_get_rect(c, height: int, text: str):
     height_div = 14
     while True:
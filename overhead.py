@@ -0,0 +1,128 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from talon import Module
+
+from .types import Recorder
+from .waxlog.stats import nearest_rank
+
+mod = Module()
+
+record_overhead = mod.setting(
+    "wax_record_overhead",
+    type=bool,
+    default=False,
+    desc="If `True`, add an `overhead` section to each phrase record with the time in seconds spent in each stage of capturing the phrase",
+)
+
+PERCENTILES = [50, 95, 99]
+
+
+class Profiler:
+    """
+    Times the stages of capturing each phrase.  Stages are attributed to the
+    phrase being measured on the current thread, so that a phrase's stages can
+    be timed across the speech thread and the log writer thread.  Stages run
+    outside of any phrase, such as writing records, are only included in the
+    summary.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.samples: dict[tuple[str, ...], list[float]] = {}
+        self.keep_samples = True
+        self.include_in_records = False
+
+    def start(self, keep_samples: bool = True):
+        """Discards any previous measurements; called when recording starts.
+        Unless `keep_samples`, nothing is kept for the summary, eg for the
+        flight recorder, which runs indefinitely and is never summarized"""
+        with self.lock:
+            self.samples = {}
+            self.keep_samples = keep_samples
+        self.include_in_records = record_overhead.get()
+
+    @contextmanager
+    def measuring(self, overhead: dict):
+        """Attributes stages run on this thread to the phrase whose timings
+        are collected in `overhead`"""
+        previous = getattr(self.local, "overhead", None)
+        self.local.overhead = overhead
+        try:
+            yield
+        finally:
+            self.local.overhead = previous
+
+    @contextmanager
+    def stage(self, *path: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(path, time.perf_counter() - start)
+
+    def recorder_stage(self, recorder: Recorder, name: str):
+        return self.stage("recorders", type(recorder).__name__, name)
+
+    def add(self, path: tuple[str, ...], elapsed: float):
+        overhead: Optional[dict] = getattr(self.local, "overhead", None)
+
+        if overhead is None:
+            self.add_sample(path, elapsed)
+            return
+
+        for key in path[:-1]:
+            overhead = overhead.setdefault(key, {})
+        overhead[path[-1]] = overhead.get(path[-1], 0) + elapsed
+
+    def add_sample(self, path: tuple[str, ...], elapsed: float):
+        if not self.keep_samples:
+            return
+
+        with self.lock:
+            self.samples.setdefault(path, []).append(elapsed)
+
+    def finish_phrase(self, record: dict, overhead: dict):
+        """Adds the totals for a phrase to the summary, and to its record if
+        the user asked for them"""
+        self.add_overhead_samples((), overhead)
+
+        if self.include_in_records:
+            record["overhead"] = overhead
+
+    def add_overhead_samples(self, prefix: tuple[str, ...], overhead: dict):
+        for key, value in overhead.items():
+            if isinstance(value, dict):
+                self.add_overhead_samples((*prefix, key), value)
+            else:
+                self.add_sample((*prefix, key), value)
+
+    def summary(self) -> dict:
+        """Returns a log record with percentiles of the time taken by each stage"""
+        with self.lock:
+            samples = {path: sorted(values) for path, values in self.samples.items()}
+
+        stages = {}
+        for path, values in sorted(samples.items()):
+            target = stages
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = {
+                "count": len(values),
+                **{
+                    f"p{percentile}": values[
+                        nearest_rank(len(values), percentile / 100)
+                    ]
+                    for percentile in PERCENTILES
+                },
+                "max": values[-1],
+                "total": sum(values),
+            }
+
+        return {"type": "overheadSummary", "stages": stages}
+
+
+profiler = Profiler()
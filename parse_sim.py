@@ -1,9 +1,16 @@
 # Based on https://github.com/phillco/knausj_talon/blob/7b1703ba293b3eb4c3976d16946d28f363034488/phil/history_file.py
+import os
 import re
+import threading
+from pathlib import Path
+from typing import Optional
 
 from talon import Module, app
 from talon_init import TALON_HOME
 
+from .overhead import profiler
+from .waxlog.rules import index_rules, lookup_rule
+
 # ==============================================================================
 # NOTE(pcohen): Parsing the output of sim() is almost certainly to break in a
 # future version of Talon, per aegis, and is recommended against.
@@ -12,6 +19,13 @@ from talon_init import TALON_HOME
 
 mod = Module()
 
+match_rules_live = mod.setting(
+    "wax_match_rules_live",
+    type=bool,
+    default=True,
+    desc="If `True`, link each command to the rule it matched in its `.talon` file while recording. If `False`, rules can be linked afterwards with `waxlog annotate`",
+)
+
 
 @mod.action_class
 class Actions:
@@ -19,24 +33,11 @@ class Actions:
         """Attempts to parse {sim} (the output of `sim()`) into a richer object with the phrase, grammar, file,
         and possibly the matched rule(s).
         """
-        results = SIM_RE.findall(sim)
-        if not results:
-            return None
-
-        commands = []
-        for str, num, phrase, file, grammar in results:
-            cmd = {
-                "num": int(num),
-                "phrase": phrase,
-                "file": file,
-                "grammar": grammar,
-            }
-            match = attempt_match_rule(file, grammar)
-            if match:
-                cmd["user_rule"] = match
-            else:
-                app.notify(f"No rules found for grammar", f"{grammar} in {file}")
-            commands.append(cmd)
+        commands = parse_sim_commands(sim)
+
+        if commands is not None and match_rules_live.get():
+            for cmd in match_rules(commands):
+                notify_no_rule(cmd)
 
         return commands
 
@@ -44,25 +45,98 @@ class Actions:
 SIM_RE = re.compile(r"""(\[(\d+)] "([^"]+)"\s+path: ([^\n]+)\s+rule: "([^"]+))+""")
 
 
+def parse_sim_commands(sim: str) -> Optional[list[dict]]:
+    """Parses the output of `sim()` into its commands, without linking them to
+    their rules"""
+    results = SIM_RE.findall(sim)
+    if not results:
+        return None
+
+    return [
+        {
+            "num": int(num),
+            "phrase": phrase,
+            "file": file,
+            "grammar": grammar,
+        }
+        for str, num, phrase, file, grammar in results
+    ]
+
+
+def match_rules(commands: list[dict]) -> list[dict]:
+    """Links each command to the rule it matched, returning the commands whose
+    rule couldn't be found.  Only reads `.talon` files, so can be called off
+    the main thread"""
+    unmatched = []
+
+    for cmd in commands:
+        with profiler.stage("ruleMatch"):
+            match = attempt_match_rule(cmd["file"], cmd["grammar"])
+        if match:
+            cmd["user_rule"] = match
+        else:
+            unmatched.append(cmd)
+
+    return unmatched
+
+
+def notify_no_rule(cmd: dict):
+    app.notify(f"No rules found for grammar", f"{cmd['grammar']} in {cmd['file']}")
+
+
+class RuleIndex:
+    """
+    Caches the rules of each `.talon` file, keyed by path.  A file is only
+    re-read when its modification time changes, so after the first lookup in
+    a file, finding a rule is a `stat` and a dictionary lookup.
+    """
+
+    def __init__(self):
+        # Maps path to (mtime, lines, rules by normalized grammar)
+        self.files: dict[Path, tuple[int, list[str], dict[str, Optional[dict]]]] = {}
+
+    def lookup(self, path: Path, grammar: str) -> Optional[dict]:
+        # Answers found by scanning are remembered until the file changes
+        lines, rules = self.get_file(path)
+        return lookup_rule(lines, rules, grammar)
+
+    def get_file(self, path: Path):
+        mtime = path.stat().st_mtime_ns
+        entry = self.files.get(path)
+
+        if entry is None or entry[0] != mtime:
+            with open(path) as f:
+                lines = f.readlines()
+            entry = (mtime, lines, index_rules(lines))
+            self.files[path] = entry
+
+        return entry[1], entry[2]
+
+    def warm(self, directory: Path):
+        """Index every `.talon` file under `directory`"""
+        for root, _, filenames in os.walk(directory, followlinks=True):
+            for filename in filenames:
+                if not filename.endswith(".talon"):
+                    continue
+
+                try:
+                    self.get_file(Path(root) / filename)
+                except (OSError, UnicodeDecodeError):
+                    continue
+
+    def warm_in_background(self, directory: Path):
+        threading.Thread(
+            target=self.warm, args=(directory,), name="wax-rule-index", daemon=True
+        ).start()
+
+
+rule_index = RuleIndex()
+
+
 def attempt_match_rule(file_path: str, grammar: str):
     """sim() returns a filepath and the grammar that was run; this attempts to
     match it to the specific rule in that file.
     Returns the match, if we found it, with a line number and the line contents
     from the .talon file.
     """
-    path = TALON_HOME / file_path
-    with open(path) as f:
-        lines = f.readlines()
-
-    # The grammar from sim() has most of it; we need to match the optional white space,
-    # anchoring characters, and the :.
-    regex = re.compile(rf"\s*\^?\s*{re.escape(grammar)}\s*\$?\s*:")
-    for i in range(len(lines)):
-        line = lines[i]
-
-        if not regex.match(line):
-            continue
-
-        return {"line": i + 1, "rule": line.strip()}
-
-    return None
+    return rule_index.lookup(TALON_HOME / file_path, grammar)
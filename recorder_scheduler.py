@@ -0,0 +1,231 @@
+import time
+from typing import Any, Callable
+
+from talon import actions
+
+from .types import Recorder, RecordingContext
+from .waxlog.lazy import lazy_import
+
+concurrent_futures = lazy_import("concurrent.futures")
+
+MAX_BACKGROUND_RECORDERS = 4
+# Seconds between polls of `is_ready`
+READY_POLL_SECONDS = 0.05
+# Time given to one UI recorder's key presses or focus changes to land before
+# the next UI recorder runs
+UI_SETTLE_TIME = "250ms"
+
+
+class RecorderScheduler:
+    """
+    Starts and stops recorders in dependency order.  A recorder starts once
+    every recorder providing a role in its `start_after` is ready, and
+    recorders with a calibration display start after all the others, so that
+    they show up in any screen recording.  Recorders that use the UI run one
+    at a time on the calling thread, while the rest run concurrently in the
+    background.  The time each recorder takes is logged.
+    """
+
+    def __init__(self, recorders: list[Recorder]):
+        self.recorders = recorders
+        # Maps the index of each recorder to the indices of the recorders that
+        # must start before it
+        self.dependencies: dict[int, set[int]] = {}
+        # Indices of the recorders that have been started and not yet stopped
+        self.started: list[int] = []
+
+        for idx, recorder in enumerate(recorders):
+            self.dependencies[idx] = {
+                other_idx
+                for other_idx, other in enumerate(recorders)
+                if other_idx != idx
+                and (
+                    set(other.provides) & set(recorder.start_after)
+                    or (
+                        recorder.has_calibration_display
+                        and not other.has_calibration_display
+                    )
+                )
+            }
+
+        check_acyclic(self.dependencies, recorders)
+
+    def start(self, context: RecordingContext):
+        """Starts all recorders.  If any fails, the ones that started are left
+        running for the caller to `rollback`, along with anything else it
+        started"""
+        timings, errors = self.run(
+            self.dependencies,
+            lambda recorder: start_recorder(recorder, context),
+            self.started,
+            continue_on_error=False,
+        )
+
+        if errors:
+            raise errors[0]
+
+        log_timings("start", timings)
+
+    def stop(self, operation_name: str = "stop"):
+        """Stops all started recorders, raising the first error once all have
+        been attempted"""
+        timings, errors = self.run(
+            reverse_dependencies(self.dependencies, self.started),
+            stop_recorder,
+            [],
+            continue_on_error=True,
+        )
+        self.started = []
+
+        log_timings(operation_name, timings)
+
+        if errors:
+            raise errors[0]
+
+    def rollback(self):
+        """Stops all started recorders, ignoring errors"""
+        if not self.started:
+            return
+
+        try:
+            self.stop("rollback")
+        except Exception:
+            pass
+
+    def run(
+        self,
+        dependencies: dict[int, set[int]],
+        operation: Callable[[Recorder], dict[str, Any]],
+        completed: list[int],
+        continue_on_error: bool,
+    ) -> tuple[list[dict[str, Any]], list[Exception]]:
+        """
+        Runs `operation` on each recorder in `dependencies` once its
+        dependencies are done, appending the index of each recorder it
+        succeeds on to `completed`.  Returns the timings of the operations
+        that succeeded and the errors raised by the rest.  Unless
+        `continue_on_error`, no more operations are started after an error.
+        """
+        pending = set(dependencies)
+        done: set[int] = set()
+        running: dict["concurrent_futures.Future", int] = {}
+        timings = []
+        errors = []
+        did_run_ui_recorder = False
+
+        def finish(idx: int, run: Callable[[], dict[str, Any]]):
+            try:
+                timings.append(run())
+                completed.append(idx)
+            except Exception as e:
+                errors.append(e)
+                if not continue_on_error:
+                    return
+            done.add(idx)
+
+        with concurrent_futures.ThreadPoolExecutor(
+            max_workers=MAX_BACKGROUND_RECORDERS, thread_name_prefix="wax-recorder"
+        ) as executor:
+            while running or (pending and (continue_on_error or not errors)):
+                runnable = sorted(idx for idx in pending if dependencies[idx] <= done)
+                if errors and not continue_on_error:
+                    runnable = []
+
+                for idx in runnable:
+                    if not self.recorders[idx].uses_ui:
+                        pending.remove(idx)
+                        running[executor.submit(operation, self.recorders[idx])] = idx
+
+                ui_runnable = [idx for idx in runnable if self.recorders[idx].uses_ui]
+
+                if ui_runnable:
+                    idx = ui_runnable[0]
+                    pending.remove(idx)
+                    if did_run_ui_recorder:
+                        actions.sleep(UI_SETTLE_TIME)
+                    did_run_ui_recorder = True
+                    finish(idx, lambda: operation(self.recorders[idx]))
+                elif running:
+                    finished, _ = concurrent_futures.wait(
+                        running, return_when=concurrent_futures.FIRST_COMPLETED
+                    )
+                    for future in finished:
+                        finish(running.pop(future), future.result)
+                else:
+                    # Only reachable once a dependency has failed
+                    break
+
+        return timings, errors
+
+
+def check_acyclic(dependencies: dict[int, set[int]], recorders: list[Recorder]):
+    remaining = dict(dependencies)
+
+    while remaining:
+        ready = [idx for idx, deps in remaining.items() if not deps & remaining.keys()]
+        if not ready:
+            names = ", ".join(type(recorders[idx]).__name__ for idx in remaining)
+            raise ValueError(f"Recorders have circular dependencies: {names}")
+        for idx in ready:
+            del remaining[idx]
+
+
+def reverse_dependencies(
+    dependencies: dict[int, set[int]], indices: list[int]
+) -> dict[int, set[int]]:
+    """Returns dependencies among `indices` for stopping, so that each recorder
+    stops before the recorders it started after"""
+    return {
+        idx: {other for other in indices if idx in dependencies[other]}
+        for idx in indices
+    }
+
+
+def start_recorder(recorder: Recorder, context: RecordingContext) -> dict[str, Any]:
+    start = time.perf_counter()
+    recorder.start_recording(context)
+    started = time.perf_counter()
+
+    try:
+        wait_until_ready(recorder)
+    except Exception:
+        # The recorder did start, so it won't be rolled back with the others
+        try:
+            recorder.stop_recording()
+        except Exception:
+            pass
+        raise
+
+    return {
+        "recorder": type(recorder).__name__,
+        "seconds": started - start,
+        "readySeconds": time.perf_counter() - started,
+    }
+
+
+def stop_recorder(recorder: Recorder) -> dict[str, Any]:
+    start = time.perf_counter()
+    recorder.stop_recording()
+
+    return {
+        "recorder": type(recorder).__name__,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def wait_until_ready(recorder: Recorder):
+    deadline = time.perf_counter() + recorder.ready_timeout
+
+    while not recorder.is_ready():
+        if time.perf_counter() >= deadline:
+            raise TimeoutError(
+                f"{type(recorder).__name__} wasn't ready after {recorder.ready_timeout}s"
+            )
+        # NB: Not `actions.sleep`, as this usually runs on a pool thread
+        time.sleep(READY_POLL_SECONDS)
+
+
+def log_timings(operation: str, timings: list[dict[str, Any]]):
+    actions.user.wax_log_object(
+        {"type": "recorderTimings", "operation": operation, "recorders": timings}
+    )
@@ -1,16 +1,30 @@
 import json
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Iterable, Optional
 
 from talon import Context, Module, actions, ui
 from talon.ui import UIErr
 
+from ..snapshot_compactor import SnapshotCompactor
 from ..types import PhraseInfo, Recorder, RecordingContext
 
 mod = Module()
 ctx = Context()
 
+snapshot_compaction = mod.setting(
+    "wax_cursorless_snapshot_compaction",
+    type=bool,
+    default=False,
+    desc="If `True`, store the document contents of Cursorless snapshots in a deduplicated blob store, as diffs between consecutive snapshots. Use `waxlog rehydrate-snapshots` to restore the original snapshots",
+)
+highlight_delay = mod.setting(
+    "wax_cursorless_highlight_delay",
+    type=float,
+    default=0.05,
+    desc="Seconds to wait for VSCode to draw the highlighted marks of a phrase before taking the `decoratedMarks.all` screenshot",
+)
+
 recording_screen_vscode_ctx = Context()
 recording_screen_vscode_ctx.matches = r"""
 tag: user.wax_is_recording
@@ -19,6 +33,14 @@ app: vscode
 
 snapshots_directory: Path
 recording_context: RecordingContext
+snapshot_compactor: Optional[SnapshotCompactor] = None
+
+# Capture values that can never be Cursorless targets, such as the words and
+# numbers captured by most rules
+NON_TARGET_TYPES = (str, int, float, bool, type(None))
+# Types of capture value that Cursorless has rejected, which are then skipped
+# without asking it again
+non_target_types: set[type] = set()
 
 
 @mod.action_class
@@ -56,6 +78,8 @@ class UserActions:
 
 class CursorlessRecorder(Recorder):
     has_calibration_display = True
+    start_after = ["screenCapture"]
+    uses_ui = True
 
     def __init__(self, should_take_mark_screenshots):
         self.should_take_mark_screenshots = should_take_mark_screenshots
@@ -71,6 +95,7 @@ class CursorlessRecorder(Recorder):
     def start_recording(self, context: RecordingContext):
         global snapshots_directory
         global recording_context
+        global snapshot_compactor
 
         # Need VSCode in front
         actions.user.switcher_focus_app(get_vscode_app())
@@ -81,6 +106,15 @@ class CursorlessRecorder(Recorder):
         snapshots_directory = context.recording_log_directory / "snapshots"
         snapshots_directory.mkdir(parents=True)
 
+        snapshot_compactor = (
+            SnapshotCompactor(snapshots_directory)
+            if snapshot_compaction.get()
+            else None
+        )
+
+        # Cursorless may have been reloaded with new target types
+        non_target_types.clear()
+
         # Start cursorless recording
         command_payload = actions.user.vscode_get(
             "cursorless.recordTestCase",
@@ -99,8 +133,9 @@ class CursorlessRecorder(Recorder):
     def capture_pre_phrase(self, phrase: PhraseInfo):
         decorated_marks = list(extract_decorated_marks(phrase.parsed))
 
-        actions.user.private_wax_cursorless_snapshot(
-            str(snapshots_directory / f"{phrase.phrase_id}-prePhrase"),
+        # The command mustn't run until its pre-phrase snapshot has been taken
+        take_snapshot(
+            snapshots_directory / f"{phrase.phrase_id}-prePhrase",
             {"phraseId": phrase.phrase_id, "type": "prePhrase"},
             decorated_marks,
         )
@@ -109,19 +144,37 @@ class CursorlessRecorder(Recorder):
             take_mark_screenshots(decorated_marks)
 
     def capture_post_phrase(self, phrase: PhraseInfo):
-        actions.user.private_wax_cursorless_snapshot(
-            str(snapshots_directory / f"{phrase.phrase_id}-postPhrase"),
+        # NB: Taken before the hook returns, so that it can't see anything done
+        # by the next phrase, and while the recording tags are still set
+        take_snapshot(
+            snapshots_directory / f"{phrase.phrase_id}-postPhrase",
             {"phraseId": phrase.phrase_id, "type": "postPhrase"},
             [],
         )
 
     def stop_recording(self):
+        global snapshot_compactor
+
         # Need VSCode in front
         actions.user.switcher_focus_app(get_vscode_app())
 
         # Stop cursorless recording
         actions.user.vscode("cursorless.recordTestCase")
 
+        if snapshot_compactor is not None:
+            snapshot_compactor.close()
+            snapshot_compactor = None
+
+
+def take_snapshot(path: Path, metadata: Any, decorated_marks: list[dict]):
+    """Takes a snapshot on the calling thread, which must be Talon's main
+    thread, then queues it for compaction, if enabled"""
+    # NB: The snapshot action writes its own errors to `{path}.json`
+    actions.user.private_wax_cursorless_snapshot(str(path), metadata, decorated_marks)
+
+    if snapshot_compactor is not None:
+        snapshot_compactor.submit(path.with_name(f"{path.name}.yaml"))
+
 
 def take_mark_screenshots(decorated_marks: list[dict]):
     if not decorated_marks:
@@ -139,7 +192,7 @@ def take_mark_screenshots(decorated_marks: list[dict]):
             all_decorated_marks_target, "highlight1"
         )
 
-        actions.sleep("50ms")
+        actions.sleep(highlight_delay.get())
 
         actions.user.wax_take_screenshot("decoratedMarks.all")
 
@@ -153,12 +206,22 @@ def extract_decorated_marks(parsed: Iterable[list[Any]]):
         for capture in capture_list:
             items = capture if isinstance(capture, list) else [capture]
             for item in items:
+                if isinstance(item, NON_TARGET_TYPES):
+                    continue
+
+                item_type = type(item)
+                if item_type in non_target_types:
+                    continue
+
                 try:
                     yield from actions.user.cursorless_private_extract_decorated_marks(
                         item
                     )
                 except TypeError:
-                    continue
+                    # NB: Dicts are how Cursorless represents targets, so only
+                    # other types are skipped from then on
+                    if item_type is not dict:
+                        non_target_types.add(item_type)
 
 
 @contextmanager
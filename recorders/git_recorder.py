@@ -1,14 +1,30 @@
+import re
 import subprocess
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
 from talon import Module, actions, app, ui
 
 from ..types import Recorder, RecordingContext
+from ..waxlog.lazy import lazy_import
+
+concurrent_futures = lazy_import("concurrent.futures")
 
 GIT = "git"
 
+# Maximum number of directories to inspect at the same time
+MAX_SCAN_WORKERS = 8
+
 mod = Module()
 
+read_git_files = mod.setting(
+    "wax_git_read_files",
+    type=bool,
+    default=True,
+    desc="If `True`, read commit shas and remote urls directly from `.git` directories where possible rather than running `git`",
+)
+
 
 @mod.action_class
 class Actions:
@@ -29,50 +45,248 @@ def git(*args: str, cwd: Path):
     ).stdout.strip()
 
 
-class GitRecorder(Recorder):
-    def check_can_start(self):
-        # Fails if any directories have uncommitted changes
-        for directory in Path(actions.path.talon_user()).iterdir():
-            if not directory.is_dir():
-                continue
+@dataclass
+class DirectoryInfo:
+    directory: Path
+    repo_remote_url: str
+    repo_prefix: str
+    commit_sha: str
+    has_uncommitted_changes: bool
+
 
-            repo_remote_url = git("config", "--get", "remote.origin.url", cwd=directory)
+@dataclass
+class GitRepo:
+    # The directory containing `HEAD`
+    git_dir: Path
+    # The directory containing `config` and shared refs; differs from
+    # `git_dir` for worktrees
+    common_dir: Path
+    # Path of the inspected directory within the repo, in the format of
+    # `git rev-parse --show-prefix`
+    prefix: str
 
-            if not repo_remote_url:
-                continue
 
-            if git("status", "--porcelain", cwd=directory):
-                relative = directory.relative_to(actions.path.talon_user())
+class GitRecorder(Recorder):
+    def __init__(self):
+        self.directory_infos: Optional[list[DirectoryInfo]] = None
+
+    def check_can_start(self):
+        # Scans the user directory here, on Talon's main thread, as it needs
+        # Talon, and warns if any directories have uncommitted changes
+        user_dir = Path(actions.path.talon_user())
+        self.directory_infos = scan_user_directory(user_dir)
+
+        for info in self.directory_infos:
+            if info.has_uncommitted_changes:
+                relative = info.directory.relative_to(user_dir)
                 app.notify(
                     f"WARNING: Uncommitted changes to Talon user dir in {relative}"
                 )
 
     def start_recording(self, context: RecordingContext):
-        # Capture shas of all subdirectories of `.talon/user` that are `git` directories
-        for directory in Path(actions.path.talon_user()).iterdir():
-            if not directory.is_dir():
-                continue
-
-            repo_remote_url = git("config", "--get", "remote.origin.url", cwd=directory)
-
-            if not repo_remote_url:
-                continue
+        # Log the shas of all subdirectories of `.talon/user` that are `git`
+        # directories, as found by `check_can_start`.  NB: This runs on a
+        # background thread, so it only touches the filesystem and the log
+        if self.directory_infos is None:
+            raise RuntimeError("GitRecorder.check_can_start wasn't called")
 
-            commit_sha = git("rev-parse", "HEAD", cwd=directory)
-
-            # Represents the path of the given folder within the git repo in
-            # which it is contained. This occurs when we sim link a subdirectory
-            # of a repository into our talon user directory such as we do with
-            # cursorless talon.
-            repo_prefix = git("rev-parse", "--show-prefix", cwd=directory)
-
-            actions.user.wax_log_object(
+        for info in self.directory_infos:
+            context.log(
                 {
                     "type": "directoryInfo",
-                    "localPath": str(directory),
-                    "localRealPath": str(directory.resolve(strict=True)),
-                    "repoRemoteUrl": repo_remote_url,
-                    "repoPrefix": repo_prefix,
-                    "commitSha": commit_sha,
+                    "localPath": str(info.directory),
+                    "localRealPath": str(info.directory.resolve(strict=True)),
+                    "repoRemoteUrl": info.repo_remote_url,
+                    "repoPrefix": info.repo_prefix,
+                    "commitSha": info.commit_sha,
                 }
             )
+
+
+def scan_user_directory(user_dir: Path) -> list[DirectoryInfo]:
+    """
+    Inspects every subdirectory of the Talon user directory concurrently,
+    returning info about the ones that are git repositories with a remote.
+    Must be called on Talon's main thread
+    """
+    directories = [directory for directory in user_dir.iterdir() if directory.is_dir()]
+
+    if not directories:
+        return []
+
+    should_read_git_files = read_git_files.get()
+
+    with concurrent_futures.ThreadPoolExecutor(
+        max_workers=min(MAX_SCAN_WORKERS, len(directories))
+    ) as executor:
+        futures = [
+            executor.submit(get_directory_info, directory, should_read_git_files)
+            for directory in directories
+        ]
+
+    infos = []
+
+    for directory, future in zip(directories, futures):
+        try:
+            info = future.result()
+        except (OSError, UnicodeDecodeError) as e:
+            # Skip the directory rather than aborting the whole scan
+            app.notify(f"WARNING: Couldn't inspect {directory.name}: {e}")
+            continue
+
+        if info is not None:
+            infos.append(info)
+
+    return infos
+
+
+def get_directory_info(
+    directory: Path, should_read_git_files: bool
+) -> Optional[DirectoryInfo]:
+    repo_remote_url = None
+    commit_sha = None
+    repo_prefix = None
+
+    if should_read_git_files:
+        repo = find_git_repo(directory)
+
+        if repo is None:
+            # Not within a git repository at all
+            return None
+
+        repo_remote_url = read_remote_url(repo.common_dir / "config")
+        commit_sha = read_head_sha(repo)
+        repo_prefix = repo.prefix
+
+    if repo_remote_url is None:
+        repo_remote_url = git("config", "--get", "remote.origin.url", cwd=directory)
+
+        if not repo_remote_url:
+            return None
+
+    if commit_sha is None:
+        commit_sha = git("rev-parse", "HEAD", cwd=directory)
+
+    if repo_prefix is None:
+        # Represents the path of the given folder within the git repo in
+        # which it is contained. This occurs when we sim link a subdirectory
+        # of a repository into our talon user directory such as we do with
+        # cursorless talon.
+        repo_prefix = git("rev-parse", "--show-prefix", cwd=directory)
+
+    return DirectoryInfo(
+        directory=directory,
+        repo_remote_url=repo_remote_url,
+        repo_prefix=repo_prefix,
+        commit_sha=commit_sha,
+        has_uncommitted_changes=bool(git("status", "--porcelain", cwd=directory)),
+    )
+
+
+def find_git_repo(directory: Path) -> Optional[GitRepo]:
+    """Finds the git repository containing `directory` without running `git`"""
+    real_directory = directory.resolve()
+
+    for candidate in [real_directory, *real_directory.parents]:
+        dot_git = candidate / ".git"
+
+        if dot_git.is_dir():
+            git_dir = dot_git
+        elif dot_git.is_file():
+            # Worktrees and submodules have a `.git` file pointing to the
+            # actual git directory
+            contents = dot_git.read_text().strip()
+            if not contents.startswith("gitdir:"):
+                return None
+            git_dir = (candidate / contents[len("gitdir:") :].strip()).resolve()
+        else:
+            continue
+
+        common_dir_file = git_dir / "commondir"
+        common_dir = (
+            (git_dir / common_dir_file.read_text().strip()).resolve()
+            if common_dir_file.is_file()
+            else git_dir
+        )
+
+        relative = real_directory.relative_to(candidate).as_posix()
+
+        return GitRepo(
+            git_dir=git_dir,
+            common_dir=common_dir,
+            prefix="" if relative == "." else f"{relative}/",
+        )
+
+    return None
+
+
+SHA_RE = re.compile(r"[0-9a-f]{40}([0-9a-f]{24})?")
+REMOTE_ORIGIN_SECTION_RE = re.compile(r'\[\s*remote\s+"origin"\s*\]')
+SECTION_RE = re.compile(r"\[[^\]]*\]")
+
+
+def read_head_sha(repo: GitRepo) -> Optional[str]:
+    """Resolves `HEAD` to a commit sha, or returns `None` if we can't do so
+    without `git`"""
+    try:
+        head = (repo.git_dir / "HEAD").read_text().strip()
+
+        if not head.startswith("ref:"):
+            return head if SHA_RE.fullmatch(head) else None
+
+        ref = head[len("ref:") :].strip()
+
+        for ref_dir in [repo.git_dir, repo.common_dir]:
+            ref_file = ref_dir / ref
+            if ref_file.is_file():
+                sha = ref_file.read_text().strip()
+                return sha if SHA_RE.fullmatch(sha) else None
+
+        packed_refs = repo.common_dir / "packed-refs"
+        if packed_refs.is_file():
+            for line in packed_refs.read_text().splitlines():
+                sha, _, name = line.partition(" ")
+                if name == ref and SHA_RE.fullmatch(sha):
+                    return sha
+    except (OSError, UnicodeDecodeError):
+        pass
+
+    return None
+
+
+def read_remote_url(config_path: Path) -> Optional[str]:
+    """Reads `remote.origin.url` from a git config file, or returns `None` if
+    we can't do so without `git`"""
+    try:
+        lines = config_path.read_text().splitlines()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    url = None
+    in_origin_section = False
+
+    for line in lines:
+        line = line.strip()
+
+        if line.startswith("["):
+            if line.startswith("[include"):
+                # Included config could override the url
+                return None
+            section = SECTION_RE.match(line)
+            if section is None:
+                return None
+            in_origin_section = bool(REMOTE_ORIGIN_SECTION_RE.match(line))
+            line = line[section.end() :].strip()
+
+        if not in_origin_section:
+            continue
+
+        key, equals, value = line.partition("=")
+        if equals and key.strip().lower() == "url":
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            # As with `git config --get`, the last value wins
+            url = value
+
+    return url
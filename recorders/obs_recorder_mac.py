@@ -40,6 +40,9 @@ def show_obs_menu():
 
 
 class ObsRecorder(Recorder):
+    provides = ["faceCapture"]
+    uses_ui = True
+
     def check_can_start(self):
         # Ensure that OBS is running
         try:
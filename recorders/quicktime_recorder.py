@@ -24,6 +24,9 @@ class UserActions:
 
 
 class QuicktimeRecorder(Recorder):
+    provides = ["screenCapture"]
+    uses_ui = True
+
     def start_recording(self, context: RecordingContext):
         # Start quicktime screen recording
         actions.key("cmd-shift-5")
@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from talon.skia import Image
+
+from .notify import notify_from_thread
+from .waxlog.lazy import lazy_import
+from .waxlog.screenshot_deltas import compute_delta, save_delta
+
+# NB: numpy is only needed for delta and downscaled screenshots
+np = lazy_import("numpy")
+
+# Screenshots written more than this many seconds after they were captured are
+# reported in the log as late
+LATE_SCREENSHOT_SECONDS = 1.0
+
+QUEUE_POLICIES = ["drop", "coalesce"]
+
+
+@dataclass
+class EncodeJob:
+    image: Any
+    path: Path
+    # Time the screenshot was captured, as returned by `time.perf_counter`
+    captured_at: float
+    # Offset of the capture from the start of the recording
+    time_offset: float
+    # If given, `image` is stored as the tiles that differ from this image
+    base_image: Optional[Any] = None
+    # Factor by which to shrink each side of the image before writing it
+    downscale: int = 1
+    # Set by the worker once the file has been written, so that only
+    # screenshots that made it to disk are used as delta bases
+    written: bool = False
+
+
+class ScreenshotEncoder:
+    """
+    Encodes and writes screenshots on a pool of worker threads, keeping
+    image encoding off Talon's main thread.  When more than `queue_size`
+    screenshots are waiting, the `drop` policy discards the new screenshot
+    and the `coalesce` policy discards the oldest waiting one.  Discarded and
+    late screenshots are reported in the log with `log`, which is called from
+    the worker threads, so mustn't call Talon.
+    """
+
+    def __init__(
+        self,
+        worker_count: int,
+        queue_size: int,
+        policy: str,
+        log: Callable[[dict], None],
+    ):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(
+                f"Unknown wax screenshot queue policy '{policy}'; expected one of {QUEUE_POLICIES}"
+            )
+
+        self.queue_size = queue_size
+        self.policy = policy
+        self.log = log
+        self.pending: deque[EncodeJob] = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.workers = [
+            threading.Thread(
+                target=self.run, name=f"wax-screenshot-encoder-{idx}", daemon=True
+            )
+            for idx in range(worker_count)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, job: EncodeJob):
+        dropped = None
+
+        with self.condition:
+            if len(self.pending) >= self.queue_size:
+                if self.policy == "drop":
+                    dropped = job
+                else:
+                    dropped = self.pending.popleft()
+                    self.pending.append(job)
+            else:
+                self.pending.append(job)
+
+            self.condition.notify()
+
+        if dropped is not None:
+            self.log(
+                {
+                    "type": "screenshotDropped",
+                    "filename": dropped.path.name,
+                    "timeOffset": dropped.time_offset,
+                }
+            )
+
+    def close(self):
+        """Writes all waiting screenshots and stops the workers"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+        for worker in self.workers:
+            worker.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+
+                if not self.pending:
+                    return
+
+                job = self.pending.popleft()
+
+            try:
+                if job.base_image is not None:
+                    write_delta(job)
+                elif job.downscale > 1:
+                    write_downscaled(job)
+                else:
+                    job.image.write_file(str(job.path))
+            except Exception as e:
+                notify_from_thread(
+                    f"ERROR: Couldn't write screenshot {job.path.name}", f"{e}"
+                )
+                continue
+
+            job.written = True
+
+            delay = time.perf_counter() - job.captured_at
+            if delay > LATE_SCREENSHOT_SECONDS:
+                self.log(
+                    {
+                        "type": "screenshotLate",
+                        "filename": job.path.name,
+                        "timeOffset": job.time_offset,
+                        "delay": delay,
+                    }
+                )
+
+
+def write_delta(job: EncodeJob):
+    save_delta(
+        job.path,
+        compute_delta(
+            downscale(np.asarray(job.base_image), job.downscale),
+            downscale(np.asarray(job.image), job.downscale),
+        ),
+    )
+
+
+def write_downscaled(job: EncodeJob):
+    pixels = downscale(np.asarray(job.image), job.downscale)
+    Image.from_array(np.ascontiguousarray(pixels)).write_file(str(job.path))
+
+
+def downscale(pixels, factor: int):
+    """Shrinks each side of an image by `factor`, averaging each block of
+    pixels and cropping any partial blocks at the edges"""
+    if factor <= 1:
+        return pixels
+
+    height = pixels.shape[0] // factor
+    width = pixels.shape[1] // factor
+    blocks = pixels[: height * factor, : width * factor].reshape(
+        height, factor, width, factor, -1
+    )
+
+    return blocks.mean(axis=(1, 3)).round().astype(pixels.dtype)
@@ -1,10 +1,14 @@
 import time
+from collections import deque
 from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
+from typing import Any, Callable, Optional, Union
 
-from talon import Module, cron, screen
+from talon import Module, screen, ui
+from talon.types import Rect
 
+from .screenshot_encoder import QUEUE_POLICIES, EncodeJob, ScreenshotEncoder
 from .types import RecordingContext
 
 mod = Module()
@@ -15,23 +19,92 @@ screenshot_time_stamp_only = mod.setting(
     default=True,
     desc="If `True`, don't actually take a screenshot during recording just capture the timestamp so that we can extract it from the video later",
 )
+screenshot_format = mod.setting(
+    "wax_screenshot_format",
+    type=str,
+    default="png",
+    desc="Image format of screenshots; one of `png`, `jpg` or `webp`",
+)
+screenshot_downscale = mod.setting(
+    "wax_screenshot_downscale",
+    type=int,
+    default=1,
+    desc="Factor by which to shrink the width and height of screenshots before writing them, eg `2` to store screenshots of a retina screen at logical resolution. `1` keeps full resolution",
+)
+screenshot_encoder_workers = mod.setting(
+    "wax_screenshot_encoder_workers",
+    type=int,
+    default=2,
+    desc="Number of threads used to encode and write screenshots",
+)
+screenshot_queue_size = mod.setting(
+    "wax_screenshot_queue_size",
+    type=int,
+    default=8,
+    desc="Maximum number of screenshots waiting to be written",
+)
+screenshot_queue_policy = mod.setting(
+    "wax_screenshot_queue_policy",
+    type=str,
+    default="drop",
+    desc="What to do with a new screenshot when `user.wax_screenshot_queue_size` screenshots are waiting to be written: `drop` discards the new screenshot and `coalesce` discards the oldest waiting screenshot",
+)
+screenshot_region = mod.setting(
+    "wax_screenshot_region",
+    type=str,
+    default="screen",
+    desc="Region to capture in screenshots: `screen` for the main screen, `window` for the focused window, or `x y width height` for a fixed rectangle",
+)
+screenshot_delta = mod.setting(
+    "wax_screenshot_delta",
+    type=bool,
+    default=False,
+    desc="If `True`, store each post-command screenshot as the tiles that changed since the most recent full screenshot that had already been written to disk, which is often that of an earlier phrase, as the pre-command screenshot of the same phrase is usually still being encoded",
+)
+
+SCREENSHOT_FORMATS = ["png", "jpg", "webp"]
+# Maximum number of full screenshots kept as candidate delta bases.  Only the
+# newest written one is kept alongside any still waiting to be encoded, which
+# the encoder holds anyway, so this only matters if many are dropped
+MAX_DELTA_BASES = 4
 
 
 class Screenshots:
     screenshots_directory: Path
     recording_start_time: float
     screenshots: dict
+    encoder: Optional[ScreenshotEncoder] = None
+    # The rect and encode job of recent full screenshots, newest last, that
+    # delta screenshots can be diffed against once they've been written
+    delta_bases: deque[tuple[Any, EncodeJob]]
+    # Overrides `user.wax_screenshot_time_stamp_only` if set
+    time_stamp_only: Optional[bool] = None
+    # Logs records about screenshots from the encoder's worker threads
+    log: Callable[[dict], None]
 
-    def init(self, recording_context: RecordingContext, recording_start_time: float):
+    def init(
+        self,
+        recording_context: RecordingContext,
+        recording_start_time: float,
+        log: Callable[[dict], None],
+        time_stamp_only: Optional[bool] = None,
+    ):
         """
         Initialize screenshot code
 
         Args:
             recording_context (RecordingContext): Context object with information about recording
             recording_start_time_ (float): The start time of the recording as returned by perfcounter
+            log (Callable[[dict], None]): Logs a record; called from other threads, so mustn't call Talon
+            time_stamp_only (Optional[bool]): Overrides `user.wax_screenshot_time_stamp_only` for this recording
         """
 
+        # NB: Read once here, so that invalid settings fail the recording
+        # rather than every phrase
+        self.image_format, self.region = read_screenshot_settings()
         self.recording_start_time = recording_start_time
+        self.log = log
+        self.time_stamp_only = time_stamp_only
 
         self.screenshots_directory = (
             recording_context.recording_log_directory / "screenshots"
@@ -39,6 +112,24 @@ class Screenshots:
         self.screenshots_directory.mkdir(parents=True)
 
         self.screenshots = {}
+        self.delta_bases = deque(maxlen=MAX_DELTA_BASES)
+
+    def stop(self):
+        """Finishes writing any screenshots that are waiting to be written"""
+        if self.encoder is not None:
+            self.encoder.close()
+            self.encoder = None
+
+    def get_encoder(self) -> ScreenshotEncoder:
+        if self.encoder is None:
+            self.encoder = ScreenshotEncoder(
+                screenshot_encoder_workers.get(),
+                screenshot_queue_size.get(),
+                screenshot_queue_policy.get(),
+                self.log,
+            )
+
+        return self.encoder
 
     @contextmanager
     def init_object(self):
@@ -47,23 +138,136 @@ class Screenshots:
 
     def take_screenshot(self, name: str):
         """Captures the screen, either as a timestamp in video or to a file, depending on setting.  Name will determine key given to screenshot in log file"""
-        timestamp = time.perf_counter() - self.recording_start_time
-
-        if screenshot_time_stamp_only.get():
-            filename = None
-        else:
-            img = screen.capture_rect(screen.main_screen().rect)
-            date = datetime.utcnow().strftime("%Y-%m-%dT%H-%M-%S-%f")
-            filename = f"{date}.png"
-            path = self.screenshots_directory / filename
-            # NB: Writing the image to the file is expensive so we do it asynchronously
-            cron.after("50ms", lambda: img.write_file(path))
-
-        self.screenshots[name] = {
+        captured_at = time.perf_counter()
+        timestamp = captured_at - self.recording_start_time
+
+        time_stamp_only = self.time_stamp_only
+        if time_stamp_only is None:
+            time_stamp_only = screenshot_time_stamp_only.get()
+
+        if time_stamp_only:
+            self.screenshots[name] = {
+                "filename": None,
+                "timeOffset": timestamp,
+            }
+            return
+
+        image_format = self.image_format
+        region = self.region
+        rect = get_capture_rect(region)
+        img = screen.capture_rect(rect)
+        downscale = screenshot_downscale.get()
+        date = datetime.utcnow().strftime("%Y-%m-%dT%H-%M-%S-%f")
+        filename = f"{date}.{image_format}"
+
+        screenshot_info = {
             "filename": filename,
             "timeOffset": timestamp,
         }
 
+        if downscale > 1:
+            screenshot_info["downscale"] = downscale
+
+        if isinstance(region, Rect) or region == "window":
+            screenshot_info["rect"] = {
+                "x": rect.x,
+                "y": rect.y,
+                "width": rect.width,
+                "height": rect.height,
+            }
+
+        base_job = None
+        if screenshot_delta.get() and name == "postCommand":
+            base_job = self.find_delta_base(rect, downscale)
+            if base_job is not None:
+                filename = f"{date}.delta.npz"
+                screenshot_info["filename"] = filename
+                screenshot_info["baseFilename"] = base_job.path.name
+
+        job = EncodeJob(
+            image=img,
+            path=self.screenshots_directory / filename,
+            captured_at=captured_at,
+            time_offset=timestamp,
+            base_image=None if base_job is None else base_job.image,
+            downscale=downscale,
+        )
+
+        # NB: Encoding the image is expensive so we do it on a worker thread
+        self.get_encoder().submit(job)
+
+        if screenshot_delta.get() and base_job is None:
+            self.delta_bases.append((rect, job))
+
+        self.screenshots[name] = screenshot_info
+
+    def find_delta_base(self, rect, downscale: int) -> Optional[EncodeJob]:
+        """Returns the newest full screenshot that has already been written,
+        if it has the same size as `rect`, discarding any older ones.
+        Screenshots that are still waiting may yet be dropped by the encoder
+        or fail to write, which would leave a delta that can't be
+        reconstructed, so they're never used as bases"""
+        written = [idx for idx, (_, job) in enumerate(self.delta_bases) if job.written]
+        if not written:
+            return None
+
+        for _ in range(written[-1]):
+            self.delta_bases.popleft()
+
+        base_rect, base_job = self.delta_bases[0]
+        # NB: The size can differ if eg the focused window was resized
+        same_size = (base_rect.width, base_rect.height) == (rect.width, rect.height)
+        if not same_size or base_job.downscale != downscale:
+            return None
+
+        return base_job
+
+
+def read_screenshot_settings() -> tuple[str, Union[str, Rect]]:
+    """Returns the screenshot format and region, the latter as `screen`,
+    `window` or a fixed `Rect`, raising `ValueError` if any screenshot setting
+    is invalid"""
+    image_format = screenshot_format.get()
+    if image_format not in SCREENSHOT_FORMATS:
+        raise ValueError(
+            f"Unknown wax screenshot format '{image_format}'; expected one of {SCREENSHOT_FORMATS}"
+        )
+
+    policy = screenshot_queue_policy.get()
+    if policy not in QUEUE_POLICIES:
+        raise ValueError(
+            f"Unknown wax screenshot queue policy '{policy}'; expected one of {QUEUE_POLICIES}"
+        )
+
+    region = screenshot_region.get()
+    if region in ["screen", "window"]:
+        return image_format, region
+
+    try:
+        x, y, width, height = (float(value) for value in region.split())
+    except ValueError:
+        raise ValueError(
+            f"Invalid wax screenshot region '{region}'; expected `screen`, `window` or `x y width height`"
+        )
+
+    return image_format, Rect(x, y, width, height)
+
+
+def get_capture_rect(region: Union[str, Rect]):
+    if isinstance(region, Rect):
+        return region
+
+    if region == "screen":
+        return screen.main_screen().rect
+
+    if region == "window":
+        try:
+            return ui.active_window().rect
+        except Exception:
+            return screen.main_screen().rect
+
+    raise ValueError(f"Invalid wax screenshot region '{region}'")
+
 
 screenshots = Screenshots()
 
@@ -0,0 +1,84 @@
+import json
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKENDS = ["json", "orjson"]
+
+
+class SafeValue:
+    """
+    Wraps a value, such as a capture, that should be logged as `null` if it
+    can't be serialized.  The check happens when the record is serialized, so
+    the value is only encoded once.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+
+def is_json_serializable(value: Any, ancestors: frozenset = frozenset()) -> bool:
+    """Returns whether `json.dumps` would succeed on `value`, without encoding it"""
+    if value is None or isinstance(value, (str, int, float)):
+        return True
+
+    if isinstance(value, (list, tuple, dict)):
+        # `json.dumps` refuses circular references
+        if id(value) in ancestors:
+            return False
+        ancestors = ancestors | {id(value)}
+
+        if isinstance(value, dict):
+            return all(
+                (key is None or isinstance(key, (str, int, float)))
+                and is_json_serializable(item, ancestors)
+                for key, item in value.items()
+            )
+
+        return all(is_json_serializable(item, ancestors) for item in value)
+
+    return False
+
+
+def default(value: Any):
+    if isinstance(value, SafeValue):
+        return value.value if is_json_serializable(value.value) else None
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def json_dumps(value: Any) -> str:
+    return json.dumps(value, default=default)
+
+
+def orjson_dumps(value: Any) -> str:
+    try:
+        return orjson.dumps(
+            value, default=default, option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+    except orjson.JSONEncodeError:
+        # Eg integers too large for orjson
+        return json_dumps(value)
+
+
+def get_dumps(backend: str) -> Callable[[Any], str]:
+    """
+    Returns a function that serializes a log record to a single line of JSON.
+    The `json` backend produces exactly the output of `json.dumps`; `orjson`
+    is faster but writes compact JSON, and falls back to `json` if `orjson`
+    isn't installed.
+    """
+    if backend not in JSON_BACKENDS:
+        raise ValueError(
+            f"Unknown wax JSON backend '{backend}'; expected one of {JSON_BACKENDS}"
+        )
+
+    if backend == "orjson" and orjson is not None:
+        return orjson_dumps
+
+    return json_dumps
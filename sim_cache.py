@@ -0,0 +1,118 @@
+import copy
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from talon import Module, registry
+
+mod = Module()
+
+sim_cache_size = mod.setting(
+    "wax_sim_cache_size",
+    type=int,
+    default=256,
+    desc="Number of phrases whose sim and parsed commands are remembered, so that repeated phrases don't need to be re-simulated. Set to 0 to disable",
+)
+
+
+class SimCache:
+    """
+    A least-recently-used cache of the sim output and parsed commands of a
+    phrase, keyed by its text and the scope it was spoken in: the active
+    modes, tags, app, window title and code language, which are what
+    contexts match on.  The cache is cleared whenever Talon reloads its
+    commands.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[Hashable, tuple[str, Optional[list]]] = OrderedDict()
+        self.max_size = 0
+        # Incremented whenever Talon reloads its commands
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        """Clears the cache and its statistics for a new recording"""
+        with self.lock:
+            self.entries.clear()
+            self.max_size = sim_cache_size.get()
+            self.hits = 0
+            self.misses = 0
+
+    def get(
+        self,
+        text: str,
+        modes: list[str],
+        tags: list[str],
+        app_name: str,
+        window_title: str,
+        language: str,
+        compute: Callable[[], tuple[str, Optional[list]]],
+    ) -> tuple[str, Optional[list]]:
+        """
+        Returns the sim output and parsed commands of a phrase spoken in the
+        given scope, calling `compute` if they aren't cached.  The commands
+        returned may be modified freely.
+
+        NB: Call this from the pre-phrase callback, before the command runs,
+        so that both the key and anything `compute` stores under it reflect
+        the scope the phrase was spoken in.
+        """
+        if self.max_size <= 0:
+            return compute()
+
+        key = (
+            text,
+            frozenset(modes),
+            frozenset(tags),
+            app_name,
+            window_title,
+            language,
+            self.generation,
+        )
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is not None:
+            raw_sim, commands = entry
+            return raw_sim, copy.deepcopy(commands)
+
+        raw_sim, commands = compute()
+
+        with self.lock:
+            # Don't cache results computed with commands that have since been
+            # reloaded
+            if key[-1] == self.generation:
+                self.entries[key] = (raw_sim, copy.deepcopy(commands))
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+
+        return raw_sim, commands
+
+    def invalidate(self, *args: Any):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else None,
+                "size": len(self.entries),
+            }
+
+
+sim_cache = SimCache()
+
+registry.register("update_commands", sim_cache.invalidate)
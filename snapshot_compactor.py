@@ -0,0 +1,52 @@
+import queue
+import threading
+from pathlib import Path
+
+from .notify import notify_from_thread
+from .waxlog.snapshots import SnapshotStore
+
+STOP = object()
+
+
+class SnapshotCompactor:
+    """
+    Compacts Cursorless snapshots on a background thread once they have been
+    written, replacing their document contents with a reference to a
+    deduplicated blob.  See `waxlog/snapshots.py`.
+    """
+
+    def __init__(self, snapshots_directory: Path):
+        self.store = SnapshotStore(snapshots_directory)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(
+            target=self.run, name="wax-snapshot-compactor", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, path: Path):
+        """Queue a snapshot to be compacted; snapshots must be submitted in the
+        order they were taken"""
+        self.queue.put(path)
+
+    def close(self):
+        """Compacts all waiting snapshots and stops the thread"""
+        self.queue.put(STOP)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            path = self.queue.get()
+
+            if path is STOP:
+                return
+
+            # Snapshots that failed are written as `.json` files instead
+            if not path.exists():
+                continue
+
+            try:
+                self.store.compact(path)
+            except Exception as e:
+                notify_from_thread(
+                    f"ERROR: Couldn't compact snapshot {path.name}", f"{e}"
+                )
@@ -0,0 +1,115 @@
+"""
+Runs the tests outside of Talon, against the stand-in Talon API in `stubs`,
+importing wax as the package `wax_talon` as the benchmarks do.  Run from
+outside the wax directory, as its `types.py` would otherwise shadow the
+standard library, eg
+
+    cd /tmp && python -m pytest /path/to/wax/tests
+
+NB: Talon loads every Python file in the user directory, so the tests and
+this file only do anything when pytest is running.
+"""
+
+import sys
+
+if "pytest" in sys.modules:
+    import types
+    from pathlib import Path
+
+    TESTS_DIR = Path(__file__).resolve().parent
+    PACKAGE_NAME = "wax_talon"
+
+    sys.path.insert(0, str(TESTS_DIR / "stubs"))
+
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [str(TESTS_DIR.parent)]
+    sys.modules[PACKAGE_NAME] = package
+
+    import pytest
+    import talon
+
+    @pytest.fixture
+    def wax_settings(monkeypatch):
+        """Sets Talon settings, eg `wax_settings(wax_sim_cache_size=2)`, for
+        one test"""
+
+        def set_settings(**values):
+            for name, value in values.items():
+                monkeypatch.setitem(talon.settings.values, f"user.{name}", value)
+
+        return set_settings
+
+    def make_phrase(idx: int, words: list[str], modes: list[str], tags: list[str]):
+        start = idx * 2.0
+        return {
+            "type": "talonCommandPhrase",
+            "id": f"phrase-{idx}",
+            "timeOffsets": {
+                "speechStart": start,
+                "prePhraseCallbackStart": start + 0.5,
+                "prePhraseCallbackEnd": start + 0.52,
+            },
+            "speechTimeout": 0.3,
+            "phrase": " ".join(words),
+            "raw_words": [
+                {"start": start + 0.1 * n, "end": start + 0.1 * n + 0.08, "text": word}
+                for n, word in enumerate(words)
+            ],
+            "rawSim": f'[1] "{" ".join(words)}"',
+            "commands": [
+                {
+                    "num": 1,
+                    "phrase": " ".join(words),
+                    "file": "user/community/misc/a.talon",
+                    "grammar": " ".join(words),
+                    "user_rule": {"line": idx, "rule": f"{' '.join(words)}: key(a)"},
+                    "captures": [[word] for word in words],
+                }
+            ],
+            "modes": modes,
+            "tags": tags,
+            "screenshots": {},
+        }
+
+    def make_completion(idx: int):
+        start = idx * 2.0
+        return {
+            "id": f"phrase-{idx}",
+            "commandCompleted": True,
+            "timeOffsets": {
+                "postPhraseCallbackStart": start + 0.7,
+                "postPhraseCallbackEnd": start + 0.71,
+            },
+            "screenshots": {},
+        }
+
+    @pytest.fixture
+    def session_records() -> list[dict]:
+        """The records of a short recording: its header, then command phrases
+        each followed by their completion, whose tags change as it goes, and
+        an ignored phrase"""
+        records = [
+            {"type": "initialInfo", "version": 2, "talonDir": "/home/me/.talon"},
+            {"type": "initialTiming", "startTimestampISO": "2022-09-06T13:36:46"},
+        ]
+
+        for idx in range(12):
+            tags = (
+                ["user.foo"] + (["user.bar"] if idx % 3 else []) + [f"user.t{idx % 4}"]
+            )
+            records.append(
+                make_phrase(idx, ["chuck", "line", f"w{idx}"], ["command"], tags)
+            )
+            records.append(make_completion(idx))
+
+        records.append(
+            {
+                "type": "talonIgnoredPhrase",
+                "id": "ignored",
+                "raw_words": [{"start": 30.0, "end": 30.2, "text": "um"}],
+                "timeOffsets": {"speechStart": 30.0, "prePhraseCallbackStart": 30.5},
+                "speechTimeout": 0.3,
+            }
+        )
+
+        return records
@@ -0,0 +1,243 @@
+"""
+Minimal stand-in for the parts of the Talon API that wax uses, so that the
+wax modules can be imported and exercised outside of Talon, by the tests and
+the benchmarks.
+
+NB: Talon loads every Python file in the user directory, these included, but
+as ordinary user modules under their own names, so they never shadow the real
+`talon`.  They must only define things, and never do work at import time.
+"""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+notifications = []
+registered_contexts = []
+module_actions = {}
+
+
+class Settings:
+    def __init__(self):
+        self.values = {"speech.timeout": 0.3}
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+
+settings = Settings()
+
+
+class Setting:
+    def __init__(self, name):
+        self.name = name
+
+    def get(self):
+        return settings.get(self.name)
+
+
+class Module:
+    def tag(self, name, desc=None):
+        pass
+
+    def setting(self, name, type=None, default=None, desc=None):
+        settings.values.setdefault(f"user.{name}", default)
+        return Setting(f"user.{name}")
+
+    def action_class(self, cls):
+        for name, value in vars(cls).items():
+            if callable(value) and not name.startswith("__"):
+                module_actions.setdefault(name, value)
+        return cls
+
+
+def active_tags():
+    return {tag for ctx in registered_contexts for tag in ctx.tags}
+
+
+class Context:
+    def __init__(self):
+        self.matches = ""
+        self.tags = []
+        self.overrides = {}
+        registered_contexts.append(self)
+
+    def is_active(self):
+        # Like Talon, requirements with the same key are alternatives
+        requirements = {}
+        for line in self.matches.strip().splitlines():
+            key, _, value = line.partition(":")
+            requirements.setdefault(key.strip(), []).append(value.strip())
+
+        for key, values in requirements.items():
+            if key == "tag":
+                if not set(values) & active_tags():
+                    return False
+            elif key == "os":
+                if {"darwin": "mac"}.get(sys.platform, sys.platform) not in values:
+                    return False
+            else:
+                return False
+        return True
+
+    def action_class(self, path):
+        def register(cls):
+            for name, value in vars(cls).items():
+                if callable(value) and not name.startswith("__"):
+                    self.overrides[name] = value
+            return cls
+
+        return register
+
+
+class UserActions:
+    def __getattr__(self, name):
+        for ctx in reversed(registered_contexts):
+            if name in ctx.overrides and ctx.is_active():
+                return ctx.overrides[name]
+        try:
+            return module_actions[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class Actions:
+    def __init__(self):
+        self.user = UserActions()
+        self.path = SimpleNamespace(talon_user=lambda: str(talon_user_dir))
+
+    def sleep(self, duration):
+        pass
+
+    def key(self, keys):
+        pass
+
+
+actions = Actions()
+talon_user_dir = Path.home() / ".talon" / "user"
+
+
+class App:
+    platform = "linux"
+
+    def notify(self, title="", body="", *args, **kwargs):
+        notifications.append((title, body))
+
+    def register(self, topic, callback):
+        pass
+
+
+app = App()
+
+
+class Cron:
+    def after(self, duration, callback):
+        callback()
+        return object()
+
+    def interval(self, duration, callback):
+        return object()
+
+    def cancel(self, job):
+        pass
+
+
+cron = Cron()
+
+
+class Scope:
+    def __init__(self):
+        self.values = {"mode": {"command", "all"}, "tag": set()}
+
+    def get(self, key):
+        if key == "tag":
+            return self.values["tag"] | active_tags()
+        return self.values[key]
+
+
+scope = Scope()
+
+
+class SpeechSystem:
+    def __init__(self):
+        self.handlers = {}
+        self.sims = {}
+
+    def register(self, topic, callback):
+        self.handlers.setdefault(topic, []).append(callback)
+
+    def unregister(self, topic, callback):
+        self.handlers.get(topic, []).remove(callback)
+
+    def _sim(self, text):
+        return self.sims.get(text, "")
+
+    def emit(self, topic, j):
+        for callback in list(self.handlers.get(topic, [])):
+            callback(j)
+
+
+speech_system = SpeechSystem()
+
+
+class Registry:
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, topic, callback):
+        self.handlers.setdefault(topic, []).append(callback)
+
+    def emit(self, topic, *args):
+        for callback in list(self.handlers.get(topic, [])):
+            callback(*args)
+
+
+registry = Registry()
+
+
+class Rect:
+    def __init__(self, x, y, width, height):
+        self.x, self.y, self.width, self.height = x, y, width, height
+
+    @property
+    def center(self):
+        return SimpleNamespace(x=self.x + self.width / 2, y=self.y + self.height / 2)
+
+
+class Image:
+    captures = 0
+
+    def __init__(self, rect):
+        self.rect = rect
+        self.width = int(rect.width)
+        self.height = int(rect.height)
+        # Each capture differs from the previous one in a small region
+        Image.captures += 1
+        self.capture_index = Image.captures
+
+    def write_file(self, path):
+        Path(path).write_bytes(b"")
+
+    def __array__(self, dtype=None, copy=None):
+        import numpy as np
+
+        pixels = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        pixels[:32, :32] = self.capture_index % 256
+        return pixels
+
+
+class Screen:
+    rect = Rect(0, 0, 1920, 1080)
+
+
+class ScreenModule:
+    def main_screen(self):
+        return Screen()
+
+    def capture_rect(self, rect, retina=True):
+        return Image(rect)
+
+
+screen = ScreenModule()
+
+from . import canvas, ui  # noqa: E402
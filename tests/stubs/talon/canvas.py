@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+
+class Paint:
+    Style = SimpleNamespace(FILL="fill")
+
+    def __init__(self):
+        self.style = None
+        self.color = None
+        self.textsize = 0
+        self.imagefilter = None
+
+    def measure_text(self, text):
+        from . import Rect
+
+        return None, Rect(0, 0, len(text) * self.textsize / 2, self.textsize)
+
+
+class Canvas:
+    def __init__(self, rect):
+        self.rect = rect
+        self.width = rect.width
+        self.height = rect.height
+        self.paint = Paint()
+        self.callbacks = []
+
+    @classmethod
+    def from_rect(cls, rect):
+        return cls(rect)
+
+    def register(self, topic, callback):
+        self.callbacks.append(callback)
+
+    def freeze(self):
+        for callback in self.callbacks:
+            callback(self)
+
+    def draw_rect(self, rect):
+        pass
+
+    def draw_text(self, text, x, y):
+        pass
+
+    def close(self):
+        pass
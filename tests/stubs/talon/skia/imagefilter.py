@@ -0,0 +1,4 @@
+class ImageFilter:
+    @staticmethod
+    def drop_shadow(*args):
+        return None
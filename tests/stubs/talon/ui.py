@@ -0,0 +1,33 @@
+class UIErr(Exception):
+    pass
+
+
+class Window:
+    title = "wax.py - Visual Studio Code"
+
+    def __init__(self):
+        from . import Rect
+
+        self.rect = Rect(100, 100, 800, 600)
+
+
+def apps(**kwargs):
+    return []
+
+
+def main_screen():
+    from . import Screen
+
+    return Screen()
+
+
+def active_window():
+    return Window()
+
+
+def active_app():
+    return App()
+
+
+class App:
+    name = ""
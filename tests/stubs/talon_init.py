@@ -0,0 +1,4 @@
+import os
+from pathlib import Path
+
+TALON_HOME = Path(os.environ.get("WAX_TALON_HOME", Path.home() / ".talon"))
@@ -0,0 +1,66 @@
+import sys
+
+if "pytest" in sys.modules:
+    import math
+
+    from wax_talon.waxlog.binary import (
+        LOG_FILENAME,
+        BinaryLogWriter,
+        convert_to_jsonl,
+    )
+    from wax_talon.waxlog.reader import find_log, iter_records
+
+    def test_binary_log_round_trips(tmp_path, session_records):
+        writer = BinaryLogWriter(tmp_path)
+        for record in session_records:
+            writer.write(record)
+        writer.close()
+
+        assert find_log(tmp_path).name == LOG_FILENAME
+        assert list(iter_records(find_log(tmp_path))) == session_records
+
+    def test_missing_times_round_trip(tmp_path, session_records):
+        record = session_records[2]
+        record["timeOffsets"]["speechStart"] = None
+        record["raw_words"][0]["end"] = None
+
+        writer = BinaryLogWriter(tmp_path)
+        writer.write(record)
+        writer.close()
+
+        assert list(iter_records(tmp_path / LOG_FILENAME)) == [record]
+
+    def test_values_round_trip(tmp_path):
+        record = {
+            "type": "test",
+            "values": [0, -1, 2**40, 1.5, math.inf, "", "é", True, False, None],
+            "nested": {"a": [{"b": []}], "c": {}},
+        }
+
+        writer = BinaryLogWriter(tmp_path)
+        writer.write(record)
+        writer.write(record)
+        writer.close()
+
+        assert list(iter_records(tmp_path / LOG_FILENAME)) == [record, record]
+
+    def test_partially_written_record_is_skipped(tmp_path, session_records):
+        writer = BinaryLogWriter(tmp_path)
+        for record in session_records:
+            writer.write(record)
+        writer.close()
+
+        path = tmp_path / LOG_FILENAME
+        path.write_bytes(path.read_bytes()[:-3])
+
+        assert list(iter_records(path)) == session_records[:-1]
+
+    def test_converts_to_jsonl(tmp_path, session_records):
+        writer = BinaryLogWriter(tmp_path)
+        for record in session_records:
+            writer.write(record)
+        writer.close()
+
+        convert_to_jsonl(tmp_path / LOG_FILENAME, tmp_path / "talon-log.jsonl")
+
+        assert list(iter_records(tmp_path / "talon-log.jsonl")) == session_records
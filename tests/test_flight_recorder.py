@@ -0,0 +1,109 @@
+import sys
+
+if "pytest" in sys.modules:
+    import pytest
+
+    from wax_talon.flight_recorder import FlightBuffer
+    from wax_talon.waxlog.reader import iter_phrases, iter_records
+
+    @pytest.fixture
+    def screenshots_directory(tmp_path):
+        directory = tmp_path / "spool"
+        directory.mkdir()
+        return directory
+
+    def write(buffer: FlightBuffer, record: dict):
+        buffer.write_encoded(buffer.encode(record))
+
+    def with_screenshot(record: dict, directory) -> dict:
+        filename = f"{record['id']}.png"
+        (directory / filename).write_bytes(b"png")
+        return {**record, "screenshots": {"preCommand": {"filename": filename}}}
+
+    def test_keeps_most_recent_phrases(
+        tmp_path, wax_settings, screenshots_directory, session_records
+    ):
+        wax_settings(wax_flight_max_phrases=3)
+        buffer = FlightBuffer(screenshots_directory)
+        for record in session_records:
+            write(buffer, record)
+
+        buffer.save(tmp_path)
+
+        records = list(iter_records(tmp_path / "talon-log.jsonl"))
+        assert records[:2] == session_records[:2]
+        assert [phrase["id"] for phrase in iter_phrases(records)] == [
+            "phrase-10",
+            "phrase-11",
+        ]
+        assert records[-1]["type"] == "talonIgnoredPhrase"
+
+    def test_byte_cap(wax_settings, screenshots_directory, session_records):
+        wax_settings(wax_flight_max_bytes=5000)
+        buffer = FlightBuffer(screenshots_directory)
+        for record in session_records:
+            write(buffer, record)
+
+        assert 0 < buffer.byte_count <= 5000
+        assert buffer.byte_count == sum(len(entry.data) for entry in buffer.entries)
+
+    def test_age_cap(wax_settings, screenshots_directory, session_records):
+        wax_settings(wax_flight_max_minutes=1.0)
+        buffer = FlightBuffer(screenshots_directory)
+        for record in session_records[2:6]:
+            entry = buffer.encode(record)
+            entry.written_at -= 120
+            buffer.write_encoded(entry)
+        write(buffer, session_records[6])
+
+        assert [entry.data for entry in buffer.entries] == [
+            buffer.encode(session_records[6]).data
+        ]
+
+    def test_evicted_screenshots_are_deleted(
+        tmp_path, wax_settings, screenshots_directory, session_records
+    ):
+        wax_settings(wax_flight_max_phrases=1)
+        buffer = FlightBuffer(screenshots_directory)
+        phrases = [
+            with_screenshot(record, screenshots_directory)
+            for record in session_records[2:8:2]
+        ]
+        for record in phrases:
+            write(buffer, record)
+
+        assert sorted(path.name for path in screenshots_directory.iterdir()) == [
+            "phrase-2.png"
+        ]
+
+        buffer.save(tmp_path)
+        assert (tmp_path / "screenshots" / "phrase-2.png").exists()
+
+    def test_delta_bases_outlive_their_own_records(
+        wax_settings, screenshots_directory, session_records
+    ):
+        wax_settings(wax_flight_max_phrases=1)
+        buffer = FlightBuffer(screenshots_directory)
+        base, delta = session_records[2], session_records[4]
+        (screenshots_directory / "base.png").write_bytes(b"png")
+        (screenshots_directory / "delta.npz").write_bytes(b"npz")
+
+        write(buffer, {**base, "screenshots": {"preCommand": {"filename": "base.png"}}})
+        write(
+            buffer,
+            {
+                **delta,
+                "screenshots": {
+                    "postCommand": {"filename": "delta.npz", "baseFilename": "base.png"}
+                },
+            },
+        )
+
+        assert sorted(path.name for path in screenshots_directory.iterdir()) == [
+            "base.png",
+            "delta.npz",
+        ]
+
+        write(buffer, session_records[6])
+
+        assert list(screenshots_directory.iterdir()) == []
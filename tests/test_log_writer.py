@@ -0,0 +1,37 @@
+import sys
+
+if "pytest" in sys.modules:
+    import talon
+
+    from wax_talon.log_writer import LogWriter
+
+    class FailingSink:
+        def __init__(self):
+            self.written = []
+
+        def encode(self, record):
+            return record
+
+        def write_encoded(self, data):
+            self.written.append(data)
+
+        def flush(self):
+            raise OSError("disk full")
+
+        def close(self):
+            raise OSError("disk full")
+
+    def test_keeps_draining_after_flush_errors(tmp_path, wax_settings, monkeypatch):
+        monkeypatch.setattr(talon, "notifications", [])
+        wax_settings(wax_log_durability="phrase", wax_log_queue_size=2)
+        sink = FailingSink()
+        writer = LogWriter(tmp_path, sink)
+
+        for idx in range(5):
+            writer.write({"id": idx})
+            writer.end_phrase()
+        writer.wait_until_written()
+        writer.close()
+
+        assert [record["id"] for record in sink.written] == list(range(5))
+        assert ("ERROR: Couldn't close wax log", "disk full") in talon.notifications
@@ -0,0 +1,113 @@
+import sys
+
+if "pytest" in sys.modules:
+    import copy
+    import json
+
+    from wax_talon.log_writer import LogWriter
+    from wax_talon.waxlog.reader import (
+        SessionIndex,
+        find_log,
+        iter_phrases,
+        iter_records,
+        merge_completion,
+    )
+    from wax_talon.waxlog.scope import ScopeDeltaEncoder
+
+    def write_log(directory, records: list[dict]):
+        with open(directory / "talon-log.jsonl", "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+
+    def test_log_writer_round_trips(tmp_path, session_records):
+        writer = LogWriter(tmp_path)
+        for record in session_records:
+            writer.write(record)
+        writer.close()
+
+        assert list(iter_records(find_log(tmp_path))) == session_records
+
+    def test_partially_written_record_is_skipped(tmp_path, session_records):
+        write_log(tmp_path, session_records)
+        with open(tmp_path / "talon-log.jsonl", "a") as f:
+            f.write('{"type": "talonCommandPhrase", "id": "part')
+
+        assert list(iter_records(tmp_path / "talon-log.jsonl")) == session_records
+
+    def test_iter_phrases_merges_completions(session_records):
+        phrases = list(iter_phrases(session_records))
+
+        assert [phrase["id"] for phrase in phrases] == [
+            f"phrase-{idx}" for idx in range(12)
+        ]
+        assert all(phrase["commandCompleted"] for phrase in phrases)
+        assert phrases[0]["timeOffsets"] == {
+            **session_records[2]["timeOffsets"],
+            **session_records[3]["timeOffsets"],
+        }
+
+    def test_iter_phrases_yields_uncompleted_phrases(session_records):
+        # Drop the completion of the second phrase
+        records = session_records[:5] + session_records[6:]
+
+        phrases = list(iter_phrases(records, max_pending=2))
+
+        assert len(phrases) == 12
+        assert "commandCompleted" not in phrases[1]
+
+    def test_session_index_finds_phrases(tmp_path, session_records):
+        write_log(tmp_path, session_records)
+
+        index = SessionIndex.open(tmp_path / "talon-log.jsonl")
+
+        assert index.get_phrase("phrase-3") == merge_completion(
+            session_records[8], session_records[9]
+        )
+        assert index.phrase_ids_between(2.0, 6.0) == ["phrase-1", "phrase-2"]
+        assert index.phrase_at(7.0) == "phrase-3"
+        assert index.phrase_at(-1.0) is None
+
+    def test_session_index_extends_incrementally(tmp_path, session_records):
+        log_path = tmp_path / "talon-log.jsonl"
+        write_log(tmp_path, session_records[:10])
+        SessionIndex.open(log_path)
+
+        with open(log_path, "a") as f:
+            for record in session_records[10:]:
+                f.write(json.dumps(record) + "\n")
+        index = SessionIndex.open(log_path)
+
+        assert index.phrase_ids_between(0.0, 100.0) == [
+            f"phrase-{idx}" for idx in range(12)
+        ]
+
+    def test_session_index_is_rebuilt_for_rewritten_log(tmp_path, session_records):
+        log_path = tmp_path / "talon-log.jsonl"
+        write_log(tmp_path, session_records[:10])
+        SessionIndex.open(log_path)
+
+        # A bigger log with different contents, eg after being re-exported
+        rewritten = [
+            {**record, "padding": "x" * 10} if "id" in record else record
+            for record in session_records
+        ]
+        write_log(tmp_path, rewritten)
+        index = SessionIndex.open(log_path)
+
+        assert index.get_phrase("phrase-3")["padding"] == "x" * 10
+        assert index.phrase_ids_between(0.0, 100.0) == [
+            f"phrase-{idx}" for idx in range(12)
+        ]
+
+    def test_session_index_rebuilds_scope(tmp_path, session_records):
+        encoder = ScopeDeltaEncoder(5)
+        records = copy.deepcopy(session_records)
+        for record in records:
+            if record.get("type") == "talonCommandPhrase":
+                encoder.encode(record)
+        write_log(tmp_path, records)
+
+        phrase = SessionIndex.open(tmp_path / "talon-log.jsonl").get_phrase("phrase-8")
+
+        assert set(phrase["tags"]) == set(session_records[18]["tags"])
+        assert "scopeDelta" not in phrase
@@ -0,0 +1,61 @@
+import sys
+
+if "pytest" in sys.modules:
+    import pytest
+
+    from wax_talon import recorder_scheduler
+    from wax_talon.recorder_scheduler import RecorderScheduler
+    from wax_talon.types import Recorder, RecordingContext
+
+    class FakeRecorder(Recorder):
+        def __init__(self, events, name, fail=False, **attributes):
+            self.events = events
+            self.name = name
+            self.fail = fail
+            vars(self).update(attributes)
+
+        def start_recording(self, context):
+            if self.fail:
+                raise RuntimeError(f"{self.name} failed")
+            self.events.append(("start", self.name))
+
+        def stop_recording(self):
+            self.events.append(("stop", self.name))
+
+    @pytest.fixture
+    def timings(monkeypatch):
+        logged = []
+        monkeypatch.setattr(
+            recorder_scheduler,
+            "log_timings",
+            lambda operation, timings: logged.append((operation, timings)),
+        )
+        return logged
+
+    def test_failed_start_is_rolled_back_once_by_the_caller(tmp_path, timings):
+        events = []
+        scheduler = RecorderScheduler(
+            [
+                FakeRecorder(events, "screen", provides=["screenCapture"]),
+                FakeRecorder(
+                    events, "broken", fail=True, start_after=["screenCapture"]
+                ),
+            ]
+        )
+
+        with pytest.raises(RuntimeError, match="broken failed"):
+            scheduler.start(RecordingContext(tmp_path, lambda record: None))
+
+        assert events == [("start", "screen")]
+        assert timings == []
+
+        scheduler.rollback()
+        scheduler.rollback()
+
+        assert events == [("start", "screen"), ("stop", "screen")]
+        assert [operation for operation, _ in timings] == ["rollback"]
+
+    def test_rollback_with_nothing_started_logs_nothing(timings):
+        RecorderScheduler([FakeRecorder([], "screen")]).rollback()
+
+        assert timings == []
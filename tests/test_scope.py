@@ -0,0 +1,65 @@
+import sys
+
+if "pytest" in sys.modules:
+    import copy
+
+    from wax_talon.waxlog.scope import ScopeDeltaEncoder, expand_scope, is_keyframe
+
+    def encode(records: list[dict], keyframe_interval: int) -> list[dict]:
+        encoder = ScopeDeltaEncoder(keyframe_interval)
+        encoded = copy.deepcopy(records)
+        for record in encoded:
+            if record.get("type") == "talonCommandPhrase":
+                encoder.encode(record)
+        return encoded
+
+    def phrases(records: list[dict]) -> list[dict]:
+        return [
+            record for record in records if record.get("type") == "talonCommandPhrase"
+        ]
+
+    def test_keyframes_are_written_every_interval(session_records):
+        encoded = phrases(encode(session_records, 5))
+
+        assert [idx for idx, record in enumerate(encoded) if is_keyframe(record)] == [
+            0,
+            5,
+            10,
+        ]
+
+    def test_deltas_only_list_changes(session_records):
+        first, second = phrases(encode(session_records, 5))[:2]
+
+        assert first["tags"] == ["user.foo", "user.t0"]
+        assert second["scopeDelta"] == {
+            "tags": {"added": ["user.bar", "user.t1"], "removed": ["user.t0"]}
+        }
+        assert "modes" not in second and "tags" not in second
+
+    def test_expand_scope_round_trips(session_records):
+        expanded = phrases(expand_scope(encode(session_records, 5)))
+
+        assert len(expanded) == len(phrases(session_records))
+        for original, record in zip(phrases(session_records), expanded):
+            assert "scopeDelta" not in record
+            assert set(record["modes"]) == set(original["modes"])
+            assert set(record["tags"]) == set(original["tags"])
+
+    def test_expand_scope_starts_from_segment_header(session_records):
+        encoded = encode(session_records, 100)
+        phrase_records = phrases(encoded)
+        # Reading a segment that starts partway through the recording
+        header = {
+            "type": "segmentHeader",
+            "index": 1,
+            "startOffset": 0,
+            "scope": {
+                "modes": session_records[2 + 2 * 5]["modes"],
+                "tags": session_records[2 + 2 * 5]["tags"],
+            },
+        }
+
+        expanded = list(expand_scope([header, *phrase_records[6:]]))[1:]
+
+        for original, record in zip(phrases(session_records)[6:], expanded):
+            assert set(record["tags"]) == set(original["tags"])
@@ -0,0 +1,89 @@
+import sys
+
+if "pytest" in sys.modules:
+    import threading
+
+    import numpy as np
+    import pytest
+    from talon import Rect
+
+    from wax_talon.screenshot_encoder import EncodeJob, ScreenshotEncoder, downscale
+    from wax_talon.screenshots import Screenshots, read_screenshot_settings
+    from wax_talon.types import RecordingContext
+
+    def test_downscale_averages_blocks_and_crops_edges():
+        pixels = np.arange(5 * 7 * 4, dtype=np.uint8).reshape(5, 7, 4)
+
+        shrunk = downscale(pixels, 2)
+
+        assert shrunk.shape == (2, 3, 4)
+        assert shrunk.dtype == np.uint8
+        assert shrunk[1, 2, 0] == pixels[2:4, 4:6, 0].mean()
+        assert downscale(pixels, 1) is pixels
+
+    def test_dropped_screenshots_are_logged_with_callback(tmp_path):
+        logged = []
+        blocked = threading.Event()
+
+        class SlowImage:
+            def write_file(self, path):
+                blocked.wait()
+
+        encoder = ScreenshotEncoder(1, 1, "drop", logged.append)
+        jobs = [
+            EncodeJob(SlowImage(), tmp_path / f"{idx}.png", 0.0, float(idx))
+            for idx in range(4)
+        ]
+        for job in jobs:
+            encoder.submit(job)
+        blocked.set()
+        encoder.close()
+
+        dropped = [r for r in logged if r["type"] == "screenshotDropped"]
+        assert len(dropped) >= 2
+
+    def test_deltas_are_only_based_on_written_screenshots(tmp_path):
+        shots = Screenshots()
+        shots.init(
+            RecordingContext(tmp_path, lambda record: None), 0.0, lambda record: None
+        )
+
+        rect = Rect(0, 0, 64, 64)
+        pending = EncodeJob(None, tmp_path / "pending.png", 0.0, 0.0)
+        written = EncodeJob(None, tmp_path / "written.png", 0.0, 0.0, written=True)
+        shots.delta_bases.extend([(rect, written), (rect, pending)])
+
+        assert shots.find_delta_base(rect, 1) is written
+        assert shots.find_delta_base(Rect(0, 0, 32, 64), 1) is None
+        assert shots.find_delta_base(rect, 2) is None
+
+        pending.written = True
+        assert shots.find_delta_base(rect, 1) is pending
+        # Only the newest written screenshot is kept
+        assert [job for _, job in shots.delta_bases] == [pending]
+
+    @pytest.mark.parametrize(
+        "settings",
+        [
+            {"wax_screenshot_format": "gif"},
+            {"wax_screenshot_region": "top left"},
+            {"wax_screenshot_queue_policy": "block"},
+        ],
+    )
+    def test_invalid_settings_fail_init(tmp_path, wax_settings, settings):
+        wax_settings(**settings)
+
+        with pytest.raises(ValueError):
+            Screenshots().init(
+                RecordingContext(tmp_path, lambda record: None),
+                0.0,
+                lambda record: None,
+            )
+
+    def test_fixed_region_is_parsed_once(wax_settings):
+        wax_settings(wax_screenshot_region="10 20 300 400")
+
+        image_format, region = read_screenshot_settings()
+
+        assert image_format == "png"
+        assert (region.x, region.y, region.width, region.height) == (10, 20, 300, 400)
@@ -0,0 +1,67 @@
+import sys
+
+if "pytest" in sys.modules:
+    import json
+
+    import pytest
+
+    from wax_talon.log_segments import SegmentedJsonlSink
+    from wax_talon.waxlog.reader import iter_records, segmented_phrases_between
+    from wax_talon.waxlog.scope import ScopeDeltaEncoder
+    from wax_talon.waxlog.segments import MANIFEST_FILENAME, load_manifest
+
+    def write_segmented(directory, records: list[dict], compression: str = "none"):
+        sink = SegmentedJsonlSink(directory, json.dumps, 1000, 0, compression)
+        for record in records:
+            sink.write_encoded(sink.encode(record))
+        sink.close()
+
+    def without_headers(records) -> list[dict]:
+        return [record for record in records if record.get("type") != "segmentHeader"]
+
+    @pytest.mark.parametrize("compression", ["none", "gzip"])
+    def test_segmented_log_round_trips(tmp_path, session_records, compression):
+        write_segmented(tmp_path, session_records, compression)
+
+        manifest = load_manifest(tmp_path / MANIFEST_FILENAME)
+        assert len(manifest["segments"]) > 1
+        assert all(segment["closed"] for segment in manifest["segments"])
+        if compression == "gzip":
+            assert all(
+                segment["filename"].endswith(".gz") for segment in manifest["segments"]
+            )
+
+        assert without_headers(iter_records(tmp_path)) == session_records
+
+    def test_segments_start_before_phrases(tmp_path, session_records):
+        write_segmented(tmp_path, session_records)
+
+        for segment in load_manifest(tmp_path / MANIFEST_FILENAME)["segments"][1:]:
+            with open(tmp_path / segment["filename"]) as f:
+                f.readline()
+                first = json.loads(f.readline())
+            assert first["type"] in ["talonCommandPhrase", "talonIgnoredPhrase"]
+
+    def test_phrases_between_expands_scope(tmp_path, session_records):
+        original = {
+            record["id"]: record
+            for record in session_records
+            if record.get("type") == "talonCommandPhrase"
+        }
+        encoder = ScopeDeltaEncoder(100)
+        records = json.loads(json.dumps(session_records))
+        for record in records:
+            if record.get("type") == "talonCommandPhrase":
+                encoder.encode(record)
+        write_segmented(tmp_path, records)
+
+        phrases = list(segmented_phrases_between(tmp_path, 14.0, 20.0))
+
+        assert [phrase["id"] for phrase in phrases] == [
+            "phrase-7",
+            "phrase-8",
+            "phrase-9",
+        ]
+        for phrase in phrases:
+            assert set(phrase["tags"]) == set(original[phrase["id"]]["tags"])
+            assert phrase["commandCompleted"]
@@ -0,0 +1,116 @@
+import sys
+
+if "pytest" in sys.modules:
+    import pytest
+
+    from wax_talon.sim_cache import SimCache
+
+    @pytest.fixture
+    def cache(wax_settings):
+        wax_settings(wax_sim_cache_size=2)
+        cache = SimCache()
+        cache.start()
+        return cache
+
+    def simulator(calls: list):
+        def simulate(text):
+            def compute():
+                calls.append(text)
+                return f"sim {text}", [{"phrase": text}]
+
+            return compute
+
+        return simulate
+
+    def test_repeated_phrase_is_cached(cache):
+        calls = []
+        simulate = simulator(calls)
+
+        first = cache.get(
+            "chuck line",
+            ["command"],
+            ["user.a"],
+            "Code",
+            "a.py",
+            "python",
+            simulate("chuck line"),
+        )
+        second = cache.get(
+            "chuck line",
+            ["command"],
+            ["user.a"],
+            "Code",
+            "a.py",
+            "python",
+            simulate("chuck line"),
+        )
+
+        assert first == second == ("sim chuck line", [{"phrase": "chuck line"}])
+        assert calls == ["chuck line"]
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_scope_is_part_of_the_key(cache):
+        calls = []
+        simulate = simulator(calls)
+
+        for tags, app_name, title, language in [
+            (["user.a", "user.b"], "Code", "a.py", "python"),
+            # Order of tags doesn't matter
+            (["user.b", "user.a"], "Code", "a.py", "python"),
+            (["user.a"], "Code", "a.py", "python"),
+            (["user.a", "user.b"], "Slack", "a.py", "python"),
+            (["user.a", "user.b"], "Slack", "b.ts", "python"),
+            (["user.a", "user.b"], "Slack", "b.ts", "typescript"),
+        ]:
+            cache.get(
+                "chuck line",
+                ["command"],
+                tags,
+                app_name,
+                title,
+                language,
+                simulate("chuck line"),
+            )
+
+        assert len(calls) == 5
+
+    def test_returned_commands_can_be_modified(cache):
+        simulate = simulator([])
+
+        _, commands = cache.get("a", [], [], "Code", "a.py", "python", simulate("a"))
+        commands[0]["captures"] = ["modified"]
+        _, commands = cache.get("a", [], [], "Code", "a.py", "python", simulate("a"))
+
+        assert commands == [{"phrase": "a"}]
+
+    def test_least_recently_used_is_evicted(cache):
+        calls = []
+        simulate = simulator(calls)
+
+        for text in ["a", "b", "a", "c", "a", "b"]:
+            cache.get(text, [], [], "Code", "a.py", "python", simulate(text))
+
+        assert calls == ["a", "b", "c", "b"]
+
+    def test_reloading_commands_invalidates(cache):
+        calls = []
+        simulate = simulator(calls)
+
+        cache.get("a", [], [], "Code", "a.py", "python", simulate("a"))
+        cache.invalidate()
+        cache.get("a", [], [], "Code", "a.py", "python", simulate("a"))
+
+        assert calls == ["a", "a"]
+
+    def test_size_zero_disables_cache(wax_settings):
+        wax_settings(wax_sim_cache_size=0)
+        cache = SimCache()
+        cache.start()
+        calls = []
+        simulate = simulator(calls)
+
+        cache.get("a", [], [], "Code", "a.py", "python", simulate("a"))
+        cache.get("a", [], [], "Code", "a.py", "python", simulate("a"))
+
+        assert calls == ["a", "a"]
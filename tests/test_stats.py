@@ -0,0 +1,106 @@
+import sys
+
+if "pytest" in sys.modules:
+    import json
+    import random
+
+    import pytest
+
+    from wax_talon.waxlog.stats import (
+        RELATIVE_ACCURACY,
+        SUMMARY_FILENAME,
+        LatencyHistogram,
+        SessionStats,
+        TopK,
+        nearest_rank,
+    )
+
+    def test_summary_counts_phrases(session_records):
+        stats = SessionStats()
+        for record in session_records:
+            stats.add(record)
+
+        summary = stats.summary()
+
+        assert summary["phrases"]["total"] == 13
+        assert summary["phrases"]["command"] == 12
+        assert summary["phrases"]["ignored"] == 1
+        assert summary["words"] == 12 * 3 + 1
+        assert summary["durationSeconds"] == pytest.approx(30.5)
+        assert summary["topRules"][0]["rule"].endswith(": key(a)")
+        assert summary["topFiles"] == [
+            {"value": "user/community/misc/a.talon", "count": 12, "error": 0}
+        ]
+
+    def test_summary_latencies(session_records):
+        stats = SessionStats()
+        for record in session_records:
+            stats.add(record)
+
+        summary = stats.summary()
+
+        # From the end of the last word to the pre-phrase callback
+        assert summary["recognitionLatency"]["count"] == 12
+        assert summary["recognitionLatency"]["p50"] == pytest.approx(
+            0.22, rel=RELATIVE_ACCURACY
+        )
+        # From the end of the pre-phrase callback to the post-phrase callback
+        assert summary["commandDuration"]["p50"] == pytest.approx(
+            0.18, rel=RELATIVE_ACCURACY
+        )
+
+    def test_save_writes_summary(tmp_path, session_records):
+        stats = SessionStats()
+        for record in session_records:
+            stats.add(record)
+
+        stats.save(tmp_path)
+
+        with open(tmp_path / SUMMARY_FILENAME) as f:
+            assert json.load(f) == json.loads(json.dumps(stats.summary()))
+
+    def test_histogram_quantiles_are_within_relative_accuracy():
+        values = [random.Random(idx).lognormvariate(-2, 1) for idx in range(10_000)]
+        histogram = LatencyHistogram()
+        for value in values:
+            histogram.add(value)
+
+        values.sort()
+        for q in [0.5, 0.9, 0.99]:
+            exact = values[nearest_rank(len(values), q)]
+            assert histogram.quantile(q) == pytest.approx(
+                exact, rel=2 * RELATIVE_ACCURACY
+            )
+
+    def test_top_k_counts_are_bounded_by_error():
+        top = TopK(capacity=3)
+        items = ["a"] * 10 + ["b"] * 5 + ["c", "d", "e", "f"] + ["a"] * 2
+
+        for item in items:
+            top.add(item)
+
+        for entry in top.top():
+            true_count = items.count(entry["value"])
+            assert entry["count"] - entry["error"] <= true_count <= entry["count"]
+        assert top.top(1)[0]["value"] == "a"
+
+    def test_percentiles_agree_with_overhead_summary():
+        from wax_talon.overhead import Profiler
+
+        values = [0.001 * (idx + 1) for idx in range(10)]
+        histogram = LatencyHistogram()
+        profiler = Profiler()
+        for value in values:
+            histogram.add(value)
+            profiler.add_sample(("sim",), value)
+
+        overhead = profiler.summary()["stages"]["sim"]
+
+        # With 10 samples, p99 is the largest, not an interpolation below it
+        assert overhead["p99"] == values[-1]
+        assert histogram.quantile(0.99) == pytest.approx(
+            overhead["p99"], rel=RELATIVE_ACCURACY
+        )
+        assert histogram.quantile(0.5) == pytest.approx(
+            overhead["p50"], rel=RELATIVE_ACCURACY
+        )
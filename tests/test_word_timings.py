@@ -0,0 +1,46 @@
+import sys
+
+if "pytest" in sys.modules:
+    from wax_talon import word_timings as word_timings_module
+    from wax_talon.overhead import Profiler
+    from wax_talon.word_timings import WordTimings
+
+    class Word(str):
+        def __new__(cls, text, start):
+            word = super().__new__(cls, text)
+            word.start = start
+            word.end = start + 0.1
+            return word
+
+    def phrase(idx: int) -> list[Word]:
+        return [Word("chuck", 10.0 + idx), Word(f"w{idx}", 10.5 + idx)]
+
+    def test_expanded_words_are_discarded(monkeypatch):
+        monkeypatch.setattr(word_timings_module, "DISCARD_WORD_COUNT", 4)
+        timings = WordTimings(10.0)
+
+        spans = []
+        for idx in range(10):
+            span = timings.append(phrase(idx))
+            spans.append(span)
+            if idx < 8:
+                assert timings.expand(span)[1]["text"] == f"w{idx}"
+
+        assert len(timings.word_ids) < 10
+        assert len(timings.words) < 10
+        words = timings.expand(spans[8])
+        assert [word["text"] for word in words] == ["chuck", "w8"]
+        assert [word["start"] for word in words] == [8.0, 8.5]
+        assert timings.expand(spans[9])[1]["text"] == "w9"
+
+    def test_profiler_can_skip_samples():
+        profiler = Profiler()
+        profiler.start(keep_samples=False)
+        profiler.finish_phrase({}, {"sim": 0.1})
+
+        assert profiler.samples == {}
+
+        profiler.start()
+        profiler.finish_phrase({}, {"sim": 0.1})
+
+        assert profiler.samples == {("sim",): [0.1]}
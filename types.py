@@ -1,11 +1,14 @@
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
 
 @dataclass
 class RecordingContext:
     recording_log_directory: Path
+    # Logs a record to the recording log.  Unlike `user.wax_log_object`, this
+    # can be called from the background threads that recorders start on
+    log: Callable[[dict], None]
 
 
 @dataclass
@@ -22,6 +25,22 @@ class Recorder:
     # recording
     has_calibration_display = False
 
+    # Roles that this recorder fulfils, such as `"screenCapture"`, so that
+    # other recorders can be started after it
+    provides: list[str] = []
+
+    # Roles of the recorders that must have started, and be ready, before this
+    # recorder starts.  When stopping, this recorder is stopped first
+    start_after: list[str] = []
+
+    # Set this to true if the recorder drives the UI, eg by pressing keys or
+    # focusing apps.  Such recorders are started and stopped one at a time on
+    # Talon's main thread; all others run concurrently in the background
+    uses_ui = False
+
+    # Maximum number of seconds to wait for `is_ready` after starting
+    ready_timeout = 5.0
+
     def check_can_start(self):
         """
         Checks that the necessary prerequisites are met to begin recording;
@@ -42,6 +61,14 @@ class Recorder:
         """Begins recording for this recorder"""
         pass
 
+    def is_ready(self) -> bool:
+        """
+        Returns whether recording has actually begun after `start_recording`
+        returned, eg once a screen recorder's countdown has finished.  Polled
+        until it returns true or `ready_timeout` elapses
+        """
+        return True
+
     def capture_pre_phrase(self, phrase_info: PhraseInfo):
         """Capture anything you'd like to capture right before every phrase is executed"""
         pass
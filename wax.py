@@ -1,9 +1,9 @@
-import json
+import shutil
 import time
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
 from talon import (
     Context,
@@ -15,11 +15,30 @@ from talon import (
     screen,
     settings,
     speech_system,
+    ui,
 )
 from talon.canvas import Canvas
 
-from .screenshots import screenshots
+from .catalog_indexer import update_catalog_in_background
+from .flight_recorder import FlightBuffer, flight_recorder_enabled, flight_screenshots
+from .log_writer import LogWriter
+from .notify import notify_from_thread
+from .overhead import profiler
+from .parse_sim import (
+    match_rules,
+    match_rules_live,
+    notify_no_rule,
+    parse_sim_commands,
+    rule_index,
+)
+from .recorder_scheduler import RecorderScheduler
+from .screenshots import read_screenshot_settings, screenshots
+from .serializer import SafeValue, json_dumps
+from .sim_cache import sim_cache
 from .types import PhraseInfo, Recorder, RecordingContext
+from .word_timings import WordTimings
+from .waxlog.scope import ScopeDeltaEncoder
+from .waxlog.stats import SessionStats
 
 CALIBRATION_DISPLAY_BACKGROUND_COLOR = "#1b0026"
 CALIBRATION_DISPLAY_DURATION = "50ms"
@@ -29,6 +48,23 @@ mod.tag(
     "wax_is_recording",
     "Indicates that Wax is currently recording",
 )
+mod.tag(
+    "wax_is_flight_recording",
+    "Indicates that Wax is keeping recent phrases in its flight recorder",
+)
+
+log_scope_deltas = mod.setting(
+    "wax_log_scope_deltas",
+    type=bool,
+    default=False,
+    desc="If true, log the modes and tags that changed since the previous phrase instead of the full modes and tags of every phrase",
+)
+scope_keyframe_interval = mod.setting(
+    "wax_scope_keyframe_interval",
+    type=int,
+    default=50,
+    desc="When logging scope deltas, log the full modes and tags every this many phrases",
+)
 
 
 ctx = Context()
@@ -36,15 +72,24 @@ ctx = Context()
 recording_screen_ctx = Context()
 recording_screen_ctx.matches = r"""
 tag: user.wax_is_recording
+tag: user.wax_is_flight_recording
 """
 
 recordings_root_dir = Path.home() / "talon-recording-logs"
+# Where the flight recorder spools its screenshots
+flight_directory = recordings_root_dir / ".flight"
 
 recorders: list[Recorder]
+recorder_scheduler: Optional[RecorderScheduler] = None
 recording_context: RecordingContext
 recording_start_time: float
 recording_log_file: Path
+log_writer: Optional[LogWriter] = None
+session_stats: Optional[SessionStats] = None
+scope_encoder: Optional[ScopeDeltaEncoder] = None
 current_phrase_info: Optional[PhraseInfo] = None
+word_timings: WordTimings
+flight_buffer: Optional[FlightBuffer] = None
 
 
 @mod.action_class
@@ -58,13 +103,20 @@ class Actions:
     ):
         """Start recording a talon session"""
         global recorders
+        global recorder_scheduler
         global recording_context
         global recording_start_time
         global recording_log_file
+        global log_writer
+        global session_stats
+        global scope_encoder
         global current_phrase_info
         global screenshots
 
-        active_recorders = []
+        recorder_scheduler = None
+
+        # The flight recorder shares the phrase hooks with the recording
+        stop_flight_recording()
 
         try:
             actions.user.private_wax_notify_sticky("Initializing recorder...")
@@ -86,27 +138,43 @@ class Actions:
                 for recorder in non_null_recorders
                 if recorder.has_calibration_display
             ]
+            recorder_scheduler = RecorderScheduler(recorders)
 
             for recorder in recorders:
                 recorder.check_can_start()
 
+            # Screenshots are only set up once the recorders have started
+            read_screenshot_settings()
+
+            # Index the rules of all Talon files up front so that matching
+            # rules during a phrase doesn't need to read them
+            if match_rules_live.get():
+                rule_index.warm_in_background(Path(actions.path.talon_user()))
+
             recording_log_directory = recordings_root_dir / time.strftime(
                 "%Y-%m-%dT%H-%M-%S"
             )
             recording_log_directory.mkdir(parents=True)
 
             recording_log_file = recording_log_directory / "talon-log.jsonl"
+            session_stats = SessionStats()
+            log_writer = LogWriter(recording_log_directory, stats=session_stats)
+            scope_encoder = (
+                ScopeDeltaEncoder(scope_keyframe_interval.get())
+                if log_scope_deltas.get()
+                else None
+            )
 
-            ctx.tags = ["user.wax_is_recording"]
+            set_recording_tags(["user.wax_is_recording"])
 
             current_phrase_info = None
 
-            recording_context = RecordingContext(recording_log_directory)
+            recording_context = RecordingContext(recording_log_directory, write_record)
 
-            for recorder in recorders:
-                actions.sleep("250ms")
-                recorder.start_recording(recording_context)
-                active_recorders.append(recorder)
+            profiler.start()
+            sim_cache.start()
+
+            recorder_scheduler.start(recording_context)
 
             # Flash a rectangle so that we can synchronize the recording start time
             flash_rect()
@@ -121,32 +189,45 @@ class Actions:
                 }
             )
         except Exception as e:
-            # In case of error, stop any recorders that we started
-            for recorder in active_recorders:
-                actions.sleep("250ms")
-                try:
-                    recorder.check_can_stop()
-                    recorder.stop_recording()
-                except:
-                    pass
+            # In case of error, stop any recorders that we started.  NB: This
+            # is the only place a failed start is rolled back
+            if recorder_scheduler is not None:
+                recorder_scheduler.rollback()
+
+            close_log_writer()
 
             app.notify(f"ERROR: {e}")
 
+            resume_flight_recording()
+
             raise
         finally:
             actions.user.private_wax_hide_sticky_notification()
 
     def wax_stop_recording():
         """Stop recording screen"""
+        if recorder_scheduler is None:
+            # Eg only the flight recorder is running, which must keep its hooks
+            app.notify("ERROR: wax isn't recording")
+            return
+
         try:
             for recorder in recorders:
                 recorder.check_can_stop()
 
-            ctx.tags = []
+            set_recording_tags([])
 
-            for recorder in recorders:
-                actions.sleep("250ms")
-                recorder.stop_recording()
+            try:
+                recorder_scheduler.stop()
+            finally:
+                screenshots.stop()
+                log_deferred(
+                    lambda: {**profiler.summary(), "simCache": sim_cache.stats()}
+                )
+                close_log_writer()
+                save_session_summary()
+                update_catalog_in_background(recordings_root_dir)
+                resume_flight_recording()
         except Exception as e:
             app.notify(f"ERROR: {e}")
 
@@ -154,8 +235,53 @@ class Actions:
 
     def wax_log_object(output_object: dict):
         """Log an object to the wax recording log"""
+        if log_writer is not None:
+            log_writer.write(output_object)
+            return
+
+        # Not recording; eg a recorder logging after the recording stopped
         with open(recording_log_file, "a") as out:
-            out.write(json.dumps(output_object) + "\n")
+            out.write(json_dumps(output_object) + "\n")
+
+    def wax_save_session_summary():
+        """Write `summary.json` for the current recording, as is done when recording stops"""
+        if session_stats is None or log_writer is None:
+            app.notify("ERROR: wax isn't recording")
+            return
+
+        log_writer.wait_until_written()
+        session_stats.save(recording_log_file.parent)
+
+    def wax_start_flight_recording():
+        """Start keeping the most recent phrases in memory, so that they can be saved with `user.wax_save_flight_recording()`"""
+        if recorder_scheduler is not None:
+            # NB: The flight recorder would take over the recording's log
+            # writer, and resumes by itself once the recording stops
+            app.notify("ERROR: Can't start the wax flight recorder while recording")
+            return
+
+        if flight_buffer is None:
+            start_flight_recording()
+
+    def wax_stop_flight_recording():
+        """Stop the flight recorder, discarding the phrases it kept"""
+        stop_flight_recording()
+
+    def wax_save_flight_recording():
+        """Save the phrases kept by the flight recorder as a recording in `~/talon-recording-logs`"""
+        if flight_buffer is None:
+            app.notify("ERROR: The wax flight recorder isn't running")
+            return
+
+        log_writer.wait_until_written()
+        # Finish writing any screenshots of the buffered phrases
+        screenshots.stop()
+
+        directory = recordings_root_dir / time.strftime("%Y-%m-%dT%H-%M-%S")
+        directory.mkdir(parents=True)
+        flight_buffer.save(directory)
+
+        app.notify("Saved flight recording", str(directory))
 
     def private_wax_maybe_capture_phrase(j: Any):
         """Possibly capture a phrase; does nothing unless screen recording is active"""
@@ -164,16 +290,117 @@ class Actions:
         """Possibly capture a phrase; does nothing unless screen recording is active"""
 
 
+def save_session_summary():
+    """Writes `summary.json` for the recording that just stopped"""
+    global session_stats
+
+    if session_stats is not None:
+        stats = session_stats
+        session_stats = None
+        try:
+            stats.save(recording_log_file.parent)
+        except Exception as e:
+            app.notify(f"ERROR: Couldn't write session summary", f"{e}")
+
+
+def close_log_writer():
+    """Drains any queued records into the log file and closes it"""
+    global log_writer
+
+    if log_writer is not None:
+        writer = log_writer
+        log_writer = None
+        writer.close()
+
+
+def start_flight_recording():
+    """Starts a recording without recorders that only keeps the most recent
+    phrases, in memory"""
+    global recorders
+    global recorder_scheduler
+    global recording_context
+    global recording_start_time
+    global log_writer
+    global scope_encoder
+    global current_phrase_info
+    global word_timings
+    global flight_buffer
+
+    shutil.rmtree(flight_directory, ignore_errors=True)
+    flight_directory.mkdir(parents=True)
+
+    recorders = []
+    recorder_scheduler = None
+    recording_context = RecordingContext(flight_directory, write_record)
+    flight_buffer = FlightBuffer(flight_directory / "screenshots")
+    log_writer = LogWriter(flight_directory, flight_buffer)
+    scope_encoder = None
+    current_phrase_info = None
+
+    # NB: Overhead samples are only summarized when a recording stops, so the
+    # flight recorder doesn't keep them
+    profiler.start(keep_samples=False)
+    sim_cache.start()
+
+    recording_start_time = time.perf_counter()
+    word_timings = WordTimings(recording_start_time)
+    screenshots.init(
+        recording_context,
+        recording_start_time,
+        write_record,
+        time_stamp_only=not flight_screenshots.get(),
+    )
+
+    log_writer.write(
+        {
+            "type": "initialInfo",
+            "version": 2,
+            "talonDir": str(Path(actions.path.talon_user()).parent),
+            "flightRecording": True,
+        }
+    )
+    log_writer.write(
+        {
+            "type": "initialTiming",
+            "startTimestampISO": datetime.utcnow().isoformat(),
+        }
+    )
+
+    set_recording_tags(["user.wax_is_flight_recording"])
+
+
+def stop_flight_recording():
+    global flight_buffer
+
+    if flight_buffer is None:
+        return
+
+    set_recording_tags([])
+    screenshots.stop()
+    close_log_writer()
+    flight_buffer = None
+    shutil.rmtree(flight_directory, ignore_errors=True)
+
+
+def resume_flight_recording():
+    """Restarts the flight recorder after a recording, if enabled"""
+    if flight_recorder_enabled.get():
+        start_flight_recording()
+
+
 def finish_init(canvas: Canvas) -> None:
     # NB: We record the initial time stamp right before we close the purple
     # flash so that we can guarantee that the timestamp is while the flash is
     # displaying
     global recording_start_time
+    global word_timings
 
     recording_start_time = time.perf_counter()
     start_timestamp_iso = datetime.utcnow().isoformat()
 
-    screenshots.init(recording_context, recording_start_time)
+    word_timings = WordTimings(recording_start_time)
+
+    screenshots.init(recording_context, recording_start_time, write_record)
 
     actions.user.wax_log_object(
         {
@@ -221,19 +448,6 @@ class UserActions:
         pass
 
 
-def json_safe(arg: Any):
-    """
-    Checks whether arg can be json serialized and if so just returns arg as is
-    otherwise returns none
-
-    """
-    try:
-        json.dumps(arg)
-        return arg
-    except:
-        return None
-
-
 @recording_screen_ctx.action_class("user")
 class RecordingUserActions:
     def private_wax_maybe_capture_phrase(j: Any):
@@ -245,22 +459,8 @@ class RecordingUserActions:
 
         text = actions.user.history_transform_phrase_text(words)
 
-        word_infos = [
-            {
-                "start": (
-                    words[idx].start - recording_start_time
-                    if words[idx].start is not None
-                    else None
-                ),
-                "end": (
-                    words[idx].end - recording_start_time
-                    if words[idx].end is not None
-                    else None
-                ),
-                "text": str(words[idx]),
-            }
-            for idx in range(len(words))
-        ]
+        # Expanded to `raw_words` when the record is written
+        word_span = word_timings.append(words)
 
         if text is None:
             try:
@@ -268,67 +468,96 @@ class RecordingUserActions:
             except KeyError:
                 speech_start = None
 
-            actions.user.wax_log_object(
-                {
+            phrase_id = str(uuid.uuid4())
+            speech_timeout = settings.get("speech.timeout")
+
+            log_deferred(
+                lambda: {
                     "type": "talonIgnoredPhrase",
-                    "id": str(uuid.uuid4()),
-                    "raw_words": word_infos,
+                    "id": phrase_id,
+                    "raw_words": word_timings.expand(word_span),
                     "timeOffsets": {
                         "speechStart": speech_start,
                         "prePhraseCallbackStart": pre_phrase_start,
                     },
-                    "speechTimeout": settings.get("speech.timeout"),
+                    "speechTimeout": speech_timeout,
                 }
             )
 
             current_phrase_info = None
 
-            return
+            end_phrase()
 
-        sim = None
-        commands = None
-        try:
-            sim = speech_system._sim(text)
-            commands = actions.user.parse_sim(sim)
-        except Exception as e:
-            app.notify(f'Couldn\'t sim for "{text}"', f"{e}")
+            return
 
         parsed = list(j["parsed"])
 
-        if commands is not None:
-            for idx, capture_list in enumerate(parsed):
-                commands[idx]["captures"] = [
-                    json_safe(capture) for capture in capture_list
-                ]
-
         phrase_id = str(uuid.uuid4())
 
         current_phrase_info = PhraseInfo(phrase_id, parsed)
 
-        with screenshots.init_object() as screenshots_object:
-            screenshots.take_screenshot("preCommand")
+        overhead = {}
+
+        speech_timeout = settings.get("speech.timeout")
+        modes = list(scope.get("mode"))
+        tags = list(scope.get("tag"))
+
+        # NB: Sim before the command runs, as it could change the modes, tags
+        # or focused app and so which commands the phrase matches
+        raw_sim = None
+        commands = None
+        with profiler.measuring(overhead):
+            try:
+                raw_sim, commands = sim_cache.get(
+                    text,
+                    modes,
+                    tags,
+                    ui.active_app().name,
+                    get_window_title(),
+                    get_code_language(),
+                    lambda: simulate(text),
+                )
+            except Exception as e:
+                app.notify(f'Couldn\'t sim for "{text}"', f"{e}")
+
+        with profiler.measuring(
+            overhead
+        ), screenshots.init_object() as screenshots_object:
+            with profiler.stage("screenshots"):
+                screenshots.take_screenshot("preCommand")
 
             for recorder in recorders:
-                recorder.capture_pre_phrase(current_phrase_info)
+                with profiler.recorder_stage(recorder, "capturePrePhrase"):
+                    recorder.capture_pre_phrase(current_phrase_info)
 
-        actions.user.wax_log_object(
-            {
-                "type": "talonCommandPhrase",
-                "id": phrase_id,
-                "timeOffsets": {
-                    "speechStart": j["_ts"] - recording_start_time,
-                    "prePhraseCallbackStart": pre_phrase_start,
-                    "prePhraseCallbackEnd": time.perf_counter() - recording_start_time,
+        time_offsets = {
+            "speechStart": j["_ts"] - recording_start_time,
+            "prePhraseCallbackStart": pre_phrase_start,
+            "prePhraseCallbackEnd": time.perf_counter() - recording_start_time,
+        }
+        should_match_rules = match_rules_live.get()
+
+        # Rule matching and serialization are done on the log writer thread so
+        # that they don't hold up the command
+        log_deferred(
+            lambda: build_command_phrase_record(
+                {
+                    "type": "talonCommandPhrase",
+                    "id": phrase_id,
+                    "timeOffsets": time_offsets,
+                    "speechTimeout": speech_timeout,
+                    "phrase": text,
+                    "raw_words": word_span,
+                    "rawSim": raw_sim,
+                    "commands": commands,
+                    "modes": modes,
+                    "tags": tags,
+                    "screenshots": dict(screenshots_object),
                 },
-                "speechTimeout": settings.get("speech.timeout"),
-                "phrase": text,
-                "raw_words": word_infos,
-                "rawSim": sim,
-                "commands": commands,
-                "modes": list(scope.get("mode")),
-                "tags": list(scope.get("tag")),
-                "screenshots": screenshots_object,
-            }
+                parsed,
+                should_match_rules,
+                overhead,
+            )
         )
 
     def private_wax_maybe_capture_post_phrase(j: Any):
@@ -337,31 +566,116 @@ class RecordingUserActions:
         if current_phrase_info is not None:
             post_phrase_start = time.perf_counter() - recording_start_time
 
-            with screenshots.init_object() as screenshots_object:
+            overhead = {}
+
+            with profiler.measuring(
+                overhead
+            ), screenshots.init_object() as screenshots_object:
                 for recorder in recorders:
-                    recorder.capture_post_phrase(current_phrase_info)
+                    with profiler.recorder_stage(recorder, "capturePostPhrase"):
+                        recorder.capture_post_phrase(current_phrase_info)
 
-                screenshots.take_screenshot("postCommand")
+                with profiler.stage("screenshots"):
+                    screenshots.take_screenshot("postCommand")
 
             # NB: This object will get merged with the pre-phrase object during
             # postprocessing.  See
             # https://github.com/pokey/voice_vid/blob/079558a2246875fd651bdd7f5d7b76974dc9b3eb/voice_vid/io/parse_transcript.py#L112-L117
-            actions.user.wax_log_object(
-                {
-                    "id": current_phrase_info.phrase_id,
-                    "commandCompleted": True,
-                    "timeOffsets": {
-                        "postPhraseCallbackStart": post_phrase_start,
-                        "postPhraseCallbackEnd": (
-                            time.perf_counter() - recording_start_time
-                        ),
-                    },
-                    "screenshots": screenshots_object,
-                }
-            )
+            record = {
+                "id": current_phrase_info.phrase_id,
+                "commandCompleted": True,
+                "timeOffsets": {
+                    "postPhraseCallbackStart": post_phrase_start,
+                    "postPhraseCallbackEnd": (
+                        time.perf_counter() - recording_start_time
+                    ),
+                },
+                "screenshots": screenshots_object,
+            }
+            profiler.finish_phrase(record, overhead)
+            actions.user.wax_log_object(record)
 
             current_phrase_info = None
 
+            end_phrase()
+
+
+def build_command_phrase_record(
+    record: dict, parsed: list[list[Any]], should_match_rules: bool, overhead: dict
+) -> dict:
+    """Fills in the words, rules and captures of a command phrase record.  Runs
+    on the log writer thread, so mustn't call Talon actions"""
+    record["raw_words"] = word_timings.expand(record["raw_words"])
+    commands = record["commands"]
+
+    if commands is not None and should_match_rules:
+        with profiler.measuring(overhead):
+            try:
+                for cmd in match_rules(commands):
+                    cron.after("0ms", lambda cmd=cmd: notify_no_rule(cmd))
+            except Exception as e:
+                notify_from_thread(
+                    f'Couldn\'t match rules for "{record["phrase"]}"', f"{e}"
+                )
+
+    if commands is not None:
+        for idx, capture_list in enumerate(parsed):
+            # Captures that can't be serialized will be logged as `null`
+            commands[idx]["captures"] = [SafeValue(capture) for capture in capture_list]
+
+    if scope_encoder is not None:
+        scope_encoder.encode(record)
+
+    profiler.finish_phrase(record, overhead)
+
+    return record
+
+
+def simulate(text: str) -> tuple[str, Optional[list]]:
+    with profiler.stage("sim"):
+        raw_sim = speech_system._sim(text)
+    with profiler.stage("parseSim"):
+        commands = parse_sim_commands(raw_sim)
+
+    return raw_sim, commands
+
+
+def get_window_title() -> str:
+    try:
+        return ui.active_window().title
+    except Exception:
+        return ""
+
+
+def get_code_language() -> str:
+    """Returns the language of the focused code, as contexts match with
+    `code.language`, or "" if the user's scripts don't define one"""
+    try:
+        return actions.code.language() or ""
+    except Exception:
+        return ""
+
+
+def write_record(record: dict):
+    """Logs a record from any thread.  Unlike `user.wax_log_object`, this
+    never calls Talon, so records written after the log is closed are lost"""
+    if log_writer is not None:
+        log_writer.write(record)
+
+
+def log_deferred(build_object: Callable[[], dict]):
+    """Logs the object returned by `build_object`, calling it off the phrase
+    path if possible"""
+    if log_writer is not None:
+        log_writer.write_deferred(build_object)
+    else:
+        actions.user.wax_log_object(build_object())
+
+
+def end_phrase():
+    if log_writer is not None:
+        log_writer.end_phrase()
+
 
 last_phrase = None
 
@@ -374,5 +688,28 @@ def on_post_phrase(j):
     actions.user.private_wax_maybe_capture_post_phrase(j)
 
 
-speech_system.register("pre:phrase", on_phrase)
-speech_system.register("post:phrase", on_post_phrase)
+speech_hooks_registered = False
+
+
+def set_recording_tags(tags: list[str]):
+    """Sets the tags that activate the recording actions, and registers the
+    phrase hooks only while one of them is set, so that phrases spoken while
+    not recording don't go through wax at all"""
+    global speech_hooks_registered
+
+    ctx.tags = tags
+
+    if bool(tags) == speech_hooks_registered:
+        return
+
+    if tags:
+        speech_system.register("pre:phrase", on_phrase)
+        speech_system.register("post:phrase", on_post_phrase)
+    else:
+        speech_system.unregister("pre:phrase", on_phrase)
+        speech_system.unregister("post:phrase", on_post_phrase)
+
+    speech_hooks_registered = bool(tags)
+
+
+app.register("ready", resume_flight_recording)
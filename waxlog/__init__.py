@@ -0,0 +1,11 @@
+"""
+Tools for working with wax recordings outside of Talon.  Nothing in this
+package may import `talon`, so that postprocessors can use it by appending
+the wax directory to `sys.path` and importing `waxlog`.  Append rather than
+insert, as wax's `types.py` would otherwise shadow the standard library.
+
+NB: Talon loads every Python file in the user directory at startup, this
+package included, so modules here import anything that is slow to import or
+only needed by some commands, such as numpy or sqlite3, with
+`waxlog.lazy.lazy_import`, which defers the import until it is first used.
+"""
@@ -0,0 +1,35 @@
+"""
+Command line interface to `waxlog`.  Run as eg
+
+    python path/to/wax/waxlog phrases path/to/talon-log.jsonl
+"""
+
+import importlib
+import sys
+from pathlib import Path
+
+COMMANDS = {
+    "annotate": "annotate",
+    "catalog": "catalog",
+    "phrases": "reader",
+    "to-jsonl": "binary",
+    "rehydrate-snapshots": "snapshots",
+    "stats": "stats",
+    "timeline": "timeline",
+}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print(f"Usage: waxlog {{{','.join(COMMANDS)}}} ...", file=sys.stderr)
+        sys.exit(2)
+
+    # NB: Append rather than insert, as wax's `types.py` would otherwise
+    # shadow the standard library
+    sys.path.append(str(Path(__file__).resolve().parent.parent))
+    module = importlib.import_module(f"waxlog.{COMMANDS[sys.argv[1]]}")
+    module.main(sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+Links the commands of recordings to the rules they matched, offline.  The
+`.talon` files are read at the commits logged in the recording's
+`directoryInfo` records, from local clones of the repositories, so the links
+are right even if the files have changed since, and recording can run with
+`user.wax_match_rules_live` turned off.
+
+Files are read through one long-running `git cat-file --batch` per clone, and
+the rules of each file at each commit are indexed once per process, however
+many phrases and recordings refer to them.  The annotated log is written to
+`talon-log.annotated.jsonl` in the recording directory, with each command's
+`user_rule` set wherever the rule was found.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from functools import partial
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from .lazy import lazy_import
+from .reader import find_log, iter_records
+from .rules import index_rules, lookup_rule
+
+concurrent_futures = lazy_import("concurrent.futures")
+
+GIT = "git"
+ANNOTATED_LOG_FILENAME = "talon-log.annotated.jsonl"
+
+
+class GitBlobReader:
+    """Reads files at given commits from a clone, with a single `git cat-file
+    --batch` process"""
+
+    def __init__(self, clone: Path):
+        self.process = subprocess.Popen(
+            [GIT, "cat-file", "--batch"],
+            cwd=clone,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def read(self, sha: str, path: str) -> Optional[bytes]:
+        """Returns the contents of `path` (relative to the root of the repo) at
+        commit `sha`, or `None` if it doesn't exist"""
+        self.process.stdin.write(f"{sha}:{path}\n".encode())
+        self.process.stdin.flush()
+
+        # Either `<oid> <type> <size>` or eg `<object> missing`
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            return None
+
+        data = self.process.stdout.read(int(header[2]))
+        self.process.stdout.read(1)
+
+        return data if header[1] == b"blob" else None
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class CommitRuleIndex:
+    """
+    Caches the rules of `.talon` files at given commits, keyed by clone,
+    commit sha and path.  As commits don't change, entries never need to be
+    invalidated.
+    """
+
+    def __init__(self):
+        self.readers: dict[Path, GitBlobReader] = {}
+        # Maps (clone, sha, path) to (lines, rules by normalized grammar), or
+        # `None` if the file doesn't exist at that commit
+        self.files: dict[
+            tuple[Path, str, str], Optional[tuple[list[str], dict[str, Any]]]
+        ] = {}
+
+    def lookup(self, clone: Path, sha: str, path: str, grammar: str) -> Optional[dict]:
+        key = (clone, sha, path)
+
+        try:
+            entry = self.files[key]
+        except KeyError:
+            entry = self.files[key] = self.read_file(clone, sha, path)
+
+        if entry is None:
+            return None
+
+        lines, rules = entry
+        return lookup_rule(lines, rules, grammar)
+
+    def read_file(self, clone: Path, sha: str, path: str):
+        reader = self.readers.get(clone)
+        if reader is None:
+            reader = self.readers[clone] = GitBlobReader(clone)
+
+        data = reader.read(sha, path)
+        if data is None:
+            return None
+
+        lines = data.decode(errors="replace").splitlines(keepends=True)
+        return lines, index_rules(lines)
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+        self.readers.clear()
+
+
+# Shared by every recording annotated in this process
+rule_index = CommitRuleIndex()
+
+
+def to_posix(path: str) -> str:
+    return path.replace("\\", "/").rstrip("/")
+
+
+def repo_name(remote_url: str) -> str:
+    """Returns the last component of a remote url, without `.git`"""
+    name = to_posix(remote_url).rsplit("/", 1)[-1].rsplit(":", 1)[-1]
+    return name[: -len(".git")] if name.endswith(".git") else name
+
+
+class Checkout:
+    """A directory of the Talon user directory at the time of recording, as
+    logged in a `directoryInfo` record"""
+
+    def __init__(self, info: dict, talon_dir: str, clone: Path):
+        # Path of the directory relative to the Talon home directory, which is
+        # what `sim()` reports command files relative to
+        local_path = to_posix(info["localPath"])
+        self.relative_path = local_path[len(talon_dir) + 1 :]
+        self.repo_prefix = info["repoPrefix"]
+        self.commit_sha = info["commitSha"]
+        self.clone = clone
+
+    def repo_path(self, file: str) -> Optional[str]:
+        """Returns the path within the repo of a command's file, or `None` if
+        it isn't in this directory"""
+        if not file.startswith(self.relative_path + "/"):
+            return None
+        return self.repo_prefix + file[len(self.relative_path) + 1 :]
+
+
+def find_clone(
+    info: dict, clones: dict[str, Path], clones_dir: Optional[Path]
+) -> Optional[Path]:
+    """Finds a local clone of the repo of a `directoryInfo` record, falling back
+    to the directory that was recorded, if it still exists"""
+    clone = clones.get(info["repoRemoteUrl"])
+    if clone is not None:
+        return clone
+
+    if clones_dir is not None:
+        candidate = clones_dir / repo_name(info["repoRemoteUrl"])
+        if candidate.is_dir():
+            return candidate
+
+    local_path = Path(info["localRealPath"])
+    return local_path if local_path.is_dir() else None
+
+
+def annotate_recording(
+    recording: Union[str, Path],
+    clones: dict[str, Path],
+    clones_dir: Optional[Path] = None,
+) -> dict[str, Any]:
+    """Writes the annotated log of a recording, returning statistics about the
+    commands it linked"""
+    log_path = find_log(recording)
+    directory_infos: list[dict] = []
+    talon_dir: Optional[str] = None
+    checkouts: Optional[list[Checkout]] = None
+    stats = {
+        "recording": str(log_path.parent),
+        "commands": 0,
+        "linked": 0,
+        "changed": 0,
+        "unresolved": 0,
+    }
+
+    with open(log_path.parent / ANNOTATED_LOG_FILENAME, "w") as out:
+        for record in iter_records(log_path):
+            record_type = record.get("type")
+
+            if record_type == "directoryInfo":
+                directory_infos.append(record)
+            elif record_type == "initialInfo":
+                talon_dir = to_posix(record["talonDir"])
+            elif record_type == "talonCommandPhrase" and record.get("commands"):
+                if checkouts is None:
+                    checkouts = make_checkouts(
+                        directory_infos, talon_dir, clones, clones_dir
+                    )
+                for command in record["commands"]:
+                    annotate_command(command, checkouts, stats)
+
+            out.write(json.dumps(record) + "\n")
+
+    return stats
+
+
+def make_checkouts(
+    directory_infos: list[dict],
+    talon_dir: Optional[str],
+    clones: dict[str, Path],
+    clones_dir: Optional[Path],
+) -> list[Checkout]:
+    checkouts = []
+
+    for info in directory_infos:
+        clone = find_clone(info, clones, clones_dir)
+        if clone is None:
+            print(
+                f"WARNING: No clone of {info['repoRemoteUrl']}; pass --clone or --clones-dir",
+                file=sys.stderr,
+            )
+            continue
+
+        # Logs written before `talonDir` was recorded only have directories
+        # directly within the user directory
+        directory_talon_dir = (
+            talon_dir
+            if talon_dir is not None
+            else to_posix(str(Path(info["localPath"]).parent.parent))
+        )
+        if not to_posix(info["localPath"]).startswith(directory_talon_dir + "/"):
+            continue
+        checkouts.append(Checkout(info, directory_talon_dir, clone))
+
+    return checkouts
+
+
+def annotate_command(command: dict, checkouts: list[Checkout], stats: dict):
+    stats["commands"] += 1
+    file = to_posix(command["file"])
+
+    for checkout in checkouts:
+        path = checkout.repo_path(file)
+        if path is None:
+            continue
+
+        match = rule_index.lookup(
+            checkout.clone, checkout.commit_sha, path, command["grammar"]
+        )
+        if match is not None:
+            stats["linked"] += 1
+            if command.get("user_rule") != match:
+                stats["changed"] += 1
+                command["user_rule"] = match
+            return
+
+    stats["unresolved"] += 1
+
+
+def parse_clone(value: str) -> tuple[str, Path]:
+    url, equals, path = value.rpartition("=")
+    if not equals:
+        raise argparse.ArgumentTypeError(f"Expected REMOTE_URL=PATH, got '{value}'")
+    return url, Path(path)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="waxlog annotate",
+        description="Link the commands of recordings to the rules they matched, using the .talon files at the commits that were recorded",
+    )
+    parser.add_argument(
+        "recordings",
+        type=Path,
+        nargs="+",
+        help="Paths to recording directories or their logs",
+    )
+    parser.add_argument(
+        "--clone",
+        type=parse_clone,
+        action="append",
+        default=[],
+        metavar="REMOTE_URL=PATH",
+        help="Local clone of the repo with the given remote url. Can be repeated",
+    )
+    parser.add_argument(
+        "--clones-dir",
+        type=Path,
+        help="Directory containing clones named after their repos, eg `pokey_talon`",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of recordings to annotate at the same time",
+    )
+    args = parser.parse_args(argv)
+
+    annotate = partial(
+        annotate_recording, clones=dict(args.clone), clones_dir=args.clones_dir
+    )
+
+    if args.jobs <= 1 or len(args.recordings) == 1:
+        for stats in map(annotate, args.recordings):
+            sys.stdout.write(json.dumps(stats) + "\n")
+        return
+
+    with concurrent_futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for stats in executor.map(annotate, args.recordings):
+            sys.stdout.write(json.dumps(stats) + "\n")
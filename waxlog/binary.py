@@ -0,0 +1,412 @@
+"""
+A compact binary alternative to `talon-log.jsonl`.  A recording directory
+using it contains:
+
+- `talon-log.wax`: A header followed by length-prefixed records, encoded in
+  a tagged format in which repeated strings, such as rule files, grammars,
+  tags and modes, are written once and then referred to by id.
+- `words.f64`: The start and end time of every word in `raw_words`, as
+  little-endian float64 pairs, so `numpy.fromfile(path, "<f8").reshape(-1, 2)`
+  (or `numpy.memmap`) gives one row per word.  Missing times are NaN.
+- `timings.f64`: The values of every `timeOffsets` object, as little-endian
+  float64.
+
+Records refer to their rows in the column files, so the conversion back to
+JSON lines is lossless.
+"""
+
+import argparse
+import math
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterator, Optional, Union
+
+MAGIC = b"WAXLOG\x00\x01"
+LOG_FILENAME = "talon-log.wax"
+WORDS_FILENAME = "words.f64"
+TIMINGS_FILENAME = "timings.f64"
+
+NONE = 0x00
+FALSE = 0x01
+TRUE = 0x02
+INT = 0x03
+FLOAT = 0x04
+STRING = 0x05
+STRING_DEFINITION = 0x06
+STRING_REFERENCE = 0x07
+LIST = 0x08
+DICT = 0x09
+WORDS = 0x0A
+TIME_OFFSETS = 0x0B
+
+# Strings under these keys are unique to a record, so interning them would
+# only grow the string table
+UNINTERNED_KEYS = {"id", "phraseId", "filename", "baseFilename", "startTimestampISO"}
+MAX_INTERNED_LENGTH = 4096
+
+DOUBLE = struct.Struct("<d")
+WORD_KEYS = ["start", "end", "text"]
+
+
+def write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data: memoryview, position: int) -> tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def json_key(key: Any) -> str:
+    """Converts a dict key to a string the way `json.dumps` does"""
+    if isinstance(key, str):
+        return str(key)
+    if key is True:
+        return "true"
+    if key is False:
+        return "false"
+    if key is None:
+        return "null"
+    if isinstance(key, int):
+        return int.__repr__(key)
+    if isinstance(key, float):
+        if math.isnan(key):
+            return "NaN"
+        if math.isinf(key):
+            return "Infinity" if key > 0 else "-Infinity"
+        return float.__repr__(key)
+    raise TypeError(
+        f"keys must be str, int, float, bool or None, not {type(key).__name__}"
+    )
+
+
+def is_timing(value: Any) -> bool:
+    # Ints and NaNs wouldn't survive the round trip through a float column
+    return value is None or (type(value) is float and not math.isnan(value))
+
+
+def is_word_list(value: list) -> bool:
+    return all(
+        type(word) is dict
+        and list(word) == WORD_KEYS
+        and is_timing(word["start"])
+        and is_timing(word["end"])
+        and type(word["text"]) is str
+        for word in value
+    )
+
+
+class Encoder:
+    def __init__(self, default: Optional[Callable[[Any], Any]] = None):
+        self.default = default
+        self.strings: dict[str, int] = {}
+        self.words = array("d")
+        self.timings = array("d")
+
+    def encode(self, record: dict) -> bytes:
+        """Encodes a record, appending its timings to the column buffers"""
+        string_count = len(self.strings)
+        word_count = len(self.words)
+        timing_count = len(self.timings)
+
+        out = bytearray()
+        try:
+            self.encode_value(out, record, None)
+        except Exception:
+            # The record won't be written, so forget any strings it defined
+            # and timings it appended
+            for string in list(self.strings)[string_count:]:
+                del self.strings[string]
+            del self.words[word_count:]
+            del self.timings[timing_count:]
+            raise
+
+        return bytes(out)
+
+    def encode_string(self, out: bytearray, value: str, intern: bool):
+        if intern:
+            string_id = self.strings.get(value)
+            if string_id is not None:
+                out.append(STRING_REFERENCE)
+                write_varint(out, string_id)
+                return
+
+        encoded = value.encode("utf-8", "surrogatepass")
+        if intern and len(encoded) <= MAX_INTERNED_LENGTH:
+            self.strings[value] = len(self.strings)
+            out.append(STRING_DEFINITION)
+        else:
+            out.append(STRING)
+        write_varint(out, len(encoded))
+        out += encoded
+
+    def encode_value(self, out: bytearray, value: Any, key: Optional[str]):
+        if value is None:
+            out.append(NONE)
+        elif value is True:
+            out.append(TRUE)
+        elif value is False:
+            out.append(FALSE)
+        elif isinstance(value, str):
+            self.encode_string(out, str(value), key not in UNINTERNED_KEYS)
+        elif isinstance(value, int):
+            out.append(INT)
+            value = int(value)
+            write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+        elif isinstance(value, float):
+            out.append(FLOAT)
+            out += DOUBLE.pack(value)
+        elif isinstance(value, dict):
+            if key == "timeOffsets" and all(map(is_timing, value.values())):
+                self.encode_time_offsets(out, value)
+                return
+            out.append(DICT)
+            write_varint(out, len(value))
+            for item_key, item in value.items():
+                item_key = json_key(item_key)
+                self.encode_string(out, item_key, True)
+                self.encode_value(out, item, item_key)
+        elif isinstance(value, (list, tuple)):
+            if key == "raw_words" and value and is_word_list(value):
+                self.encode_words(out, value)
+                return
+            out.append(LIST)
+            write_varint(out, len(value))
+            for item in value:
+                self.encode_value(out, item, None)
+        elif self.default is not None:
+            self.encode_value(out, self.default(value), key)
+        else:
+            raise TypeError(
+                f"Object of type {type(value).__name__} is not JSON serializable"
+            )
+
+    def encode_words(self, out: bytearray, words: list[dict]):
+        out.append(WORDS)
+        write_varint(out, len(self.words) // 2)
+        write_varint(out, len(words))
+        for word in words:
+            self.words.append(math.nan if word["start"] is None else word["start"])
+            self.words.append(math.nan if word["end"] is None else word["end"])
+            self.encode_string(out, word["text"], True)
+
+    def encode_time_offsets(self, out: bytearray, time_offsets: dict):
+        out.append(TIME_OFFSETS)
+        write_varint(out, len(self.timings))
+        write_varint(out, len(time_offsets))
+        for name, value in time_offsets.items():
+            self.timings.append(math.nan if value is None else value)
+            self.encode_string(out, name, True)
+
+
+def column_value(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+class Decoder:
+    def __init__(self, words: array, timings: array):
+        self.strings: list[str] = []
+        self.words = words
+        self.timings = timings
+
+    def decode(self, payload: bytes) -> dict:
+        value, _ = self.decode_value(memoryview(payload), 0)
+        return value
+
+    def decode_value(self, data: memoryview, position: int) -> tuple[Any, int]:
+        tag = data[position]
+        position += 1
+
+        if tag == NONE:
+            return None, position
+        if tag == TRUE:
+            return True, position
+        if tag == FALSE:
+            return False, position
+        if tag in (STRING, STRING_DEFINITION):
+            length, position = read_varint(data, position)
+            value = str(data[position : position + length], "utf-8", "surrogatepass")
+            if tag == STRING_DEFINITION:
+                self.strings.append(value)
+            return value, position + length
+        if tag == STRING_REFERENCE:
+            string_id, position = read_varint(data, position)
+            return self.strings[string_id], position
+        if tag == INT:
+            value, position = read_varint(data, position)
+            return (value >> 1 if value % 2 == 0 else -((value + 1) >> 1)), position
+        if tag == FLOAT:
+            return DOUBLE.unpack_from(data, position)[0], position + DOUBLE.size
+        if tag == LIST:
+            count, position = read_varint(data, position)
+            items = []
+            for _ in range(count):
+                item, position = self.decode_value(data, position)
+                items.append(item)
+            return items, position
+        if tag == DICT:
+            count, position = read_varint(data, position)
+            items = {}
+            for _ in range(count):
+                key, position = self.decode_value(data, position)
+                items[key], position = self.decode_value(data, position)
+            return items, position
+        if tag == WORDS:
+            row, position = read_varint(data, position)
+            count, position = read_varint(data, position)
+            words = []
+            for idx in range(count):
+                text, position = self.decode_value(data, position)
+                words.append(
+                    {
+                        "start": column_value(self.words[2 * (row + idx)]),
+                        "end": column_value(self.words[2 * (row + idx) + 1]),
+                        "text": text,
+                    }
+                )
+            return words, position
+        if tag == TIME_OFFSETS:
+            row, position = read_varint(data, position)
+            count, position = read_varint(data, position)
+            time_offsets = {}
+            for idx in range(count):
+                name, position = self.decode_value(data, position)
+                time_offsets[name] = column_value(self.timings[row + idx])
+            return time_offsets, position
+
+        raise ValueError(f"Unknown wax binary log tag {tag:#x}")
+
+
+class BinaryLogWriter:
+    """Writes records to a binary log in `directory`"""
+
+    def __init__(self, directory: Path, default: Optional[Callable[[Any], Any]] = None):
+        self.encoder = Encoder(default)
+        self.log_file = open(directory / LOG_FILENAME, "wb")
+        self.words_file = open(directory / WORDS_FILENAME, "wb")
+        self.timings_file = open(directory / TIMINGS_FILENAME, "wb")
+        self.log_file.write(MAGIC)
+        self.words_written = 0
+        self.timings_written = 0
+
+    def encode(self, record: dict) -> bytes:
+        payload = self.encoder.encode(record)
+        out = bytearray()
+        write_varint(out, len(payload))
+        return bytes(out) + payload
+
+    def write_encoded(self, data: bytes):
+        # Columns are written first so that a reader never sees a record
+        # whose timings are missing
+        self.write_columns()
+        self.log_file.write(data)
+
+    def write(self, record: dict):
+        self.write_encoded(self.encode(record))
+
+    def write_columns(self):
+        words = self.encoder.words
+        if len(words) > self.words_written:
+            write_doubles(self.words_file, words[self.words_written :])
+            self.words_written = len(words)
+
+        timings = self.encoder.timings
+        if len(timings) > self.timings_written:
+            write_doubles(self.timings_file, timings[self.timings_written :])
+            self.timings_written = len(timings)
+
+    def flush(self):
+        for f in self.files:
+            f.flush()
+
+    def close(self):
+        """Flushes the log and its columns, syncs them to disk and closes them"""
+        self.flush()
+        for f in self.files:
+            os.fsync(f.fileno())
+            f.close()
+
+    @property
+    def files(self) -> list[BinaryIO]:
+        # Columns before the log, for the same reason as in `write_encoded`
+        return [self.words_file, self.timings_file, self.log_file]
+
+
+def write_doubles(f: BinaryIO, values: array):
+    if sys.byteorder == "big":
+        values = array("d", values)
+        values.byteswap()
+    f.write(values.tobytes())
+
+
+def read_doubles(path: Path) -> array:
+    values = array("d")
+    if path.exists():
+        values.frombytes(path.read_bytes())
+        if sys.byteorder == "big":
+            values.byteswap()
+    return values
+
+
+def iter_records(path: Union[str, Path]) -> Iterator[dict]:
+    """Yields the records of a binary log, given the path to its `talon-log.wax`"""
+    path = Path(path)
+    decoder = Decoder(
+        read_doubles(path.with_name(WORDS_FILENAME)),
+        read_doubles(path.with_name(TIMINGS_FILENAME)),
+    )
+
+    data = memoryview(path.read_bytes())
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a wax binary log")
+
+    position = len(MAGIC)
+    while position < len(data):
+        try:
+            length, payload_start = read_varint(data, position)
+        except IndexError:
+            # Partially written record
+            return
+        if payload_start + length > len(data):
+            return
+        yield decoder.decode(data[payload_start : payload_start + length])
+        position = payload_start + length
+
+
+def convert_to_jsonl(path: Union[str, Path], output_path: Union[str, Path]):
+    """Converts a binary log back to the `talon-log.jsonl` format"""
+    import json
+
+    with open(output_path, "w") as out:
+        for record in iter_records(path):
+            out.write(json.dumps(record) + "\n")
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="waxlog to-jsonl",
+        description="Convert a binary wax log back to talon-log.jsonl",
+    )
+    parser.add_argument("log", type=Path, help=f"Path to {LOG_FILENAME}")
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="Path to write the JSON lines to; defaults to talon-log.jsonl next to the binary log",
+    )
+    args = parser.parse_args(argv)
+
+    convert_to_jsonl(args.log, args.output or args.log.with_name("talon-log.jsonl"))
@@ -0,0 +1,476 @@
+"""
+A SQLite index of every recording in `~/talon-recording-logs`, for finding
+phrases across sessions without reading their logs, eg
+
+    catalog = Catalog(root / CATALOG_FILENAME)
+    catalog.update(root)
+    catalog.find_phrases(text="chuck", tag="user.cursorless")
+    catalog.find_sessions(rule_file="user/pokey_talon/misc/a.talon")
+
+`update` only indexes recordings whose log is new or has changed since it
+was last indexed.  Phrase text is searched with an FTS5 full text index if
+SQLite supports it, or a `LIKE` scan otherwise.  The distinct sets of tags
+that phrases were spoken with are stored once, so filtering by tag stays
+cheap however many phrases there are.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterable, Optional, Union
+
+from .lazy import lazy_import
+from .reader import find_log, iter_records, phrase_time
+from .scope import expand_scope
+
+if TYPE_CHECKING:
+    import sqlite3
+else:
+    sqlite3 = lazy_import("sqlite3")
+
+CATALOG_FILENAME = "catalog.sqlite"
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    directory TEXT NOT NULL UNIQUE,
+    log_path TEXT NOT NULL,
+    log_mtime_ns INTEGER NOT NULL,
+    log_size INTEGER NOT NULL,
+    start_timestamp REAL
+);
+CREATE TABLE IF NOT EXISTS scopes (
+    id INTEGER PRIMARY KEY,
+    tags TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS scope_tags (
+    scope_id INTEGER NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scope_tags_tag ON scope_tags (tag, scope_id);
+CREATE TABLE IF NOT EXISTS phrases (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL,
+    phrase_id TEXT,
+    phrase TEXT NOT NULL,
+    ignored INTEGER NOT NULL,
+    time_offset REAL,
+    timestamp REAL,
+    scope_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS phrases_session ON phrases (session_id);
+CREATE INDEX IF NOT EXISTS phrases_timestamp ON phrases (timestamp);
+CREATE INDEX IF NOT EXISTS phrases_scope ON phrases (scope_id);
+CREATE TABLE IF NOT EXISTS commands (
+    phrase_rowid INTEGER NOT NULL,
+    file TEXT,
+    grammar TEXT,
+    rule_line INTEGER,
+    rule TEXT
+);
+CREATE INDEX IF NOT EXISTS commands_phrase ON commands (phrase_rowid);
+CREATE INDEX IF NOT EXISTS commands_file ON commands (file, phrase_rowid);
+CREATE INDEX IF NOT EXISTS commands_grammar ON commands (grammar, phrase_rowid);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS phrases_fts USING fts5 (
+    phrase, content='phrases', content_rowid='id'
+);
+"""
+
+
+def has_fts5(connection: sqlite3.Connection) -> bool:
+    try:
+        connection.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5 (x)")
+    except sqlite3.OperationalError:
+        return False
+
+    connection.execute("DROP TABLE temp.fts5_probe")
+    return True
+
+
+def parse_timestamp(iso: str) -> float:
+    """Returns the unix time of a `startTimestampISO`, which is in UTC"""
+    return datetime.fromisoformat(iso).replace(tzinfo=timezone.utc).timestamp()
+
+
+class Catalog:
+    def __init__(self, path: Union[str, Path]):
+        # NB: Connections may only be used on the thread that opened them, so
+        # open a catalog per thread
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode = WAL")
+
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in [0, SCHEMA_VERSION]:
+            raise ValueError(
+                f"Catalog {path} has schema version {version}; expected {SCHEMA_VERSION}"
+            )
+
+        self.connection.executescript(SCHEMA)
+        self.use_fts = has_fts5(self.connection)
+        if self.use_fts:
+            self.connection.executescript(FTS_SCHEMA)
+        self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, root: Union[str, Path]) -> int:
+        """Indexes every new or changed recording in `root`, and forgets those
+        that no longer exist.  Returns the number of recordings indexed."""
+        root = Path(root)
+        directories = [
+            directory
+            for directory in sorted(root.iterdir())
+            if directory.is_dir() and not directory.name.startswith(".")
+        ]
+
+        count = sum(self.index_session(directory) for directory in directories)
+
+        existing = {str(directory.resolve()) for directory in directories}
+        for row in self.connection.execute(
+            "SELECT id, directory FROM sessions"
+        ).fetchall():
+            if row["directory"] not in existing:
+                with self.connection:
+                    self.delete_session(row["id"])
+
+        return count
+
+    def index_session(self, directory: Union[str, Path]) -> bool:
+        """Indexes a recording unless it is already up to date, returning
+        whether it was indexed"""
+        directory = Path(directory).resolve()
+
+        try:
+            log_path = find_log(directory)
+            stat = log_path.stat()
+        except FileNotFoundError:
+            return False
+
+        row = self.connection.execute(
+            "SELECT id, log_mtime_ns, log_size FROM sessions WHERE directory = ?",
+            (str(directory),),
+        ).fetchone()
+        if (
+            row is not None
+            and row["log_mtime_ns"] == stat.st_mtime_ns
+            and row["log_size"] == stat.st_size
+        ):
+            return False
+
+        with self.connection:
+            if row is not None:
+                self.delete_session(row["id"])
+
+            session_id = self.connection.execute(
+                "INSERT INTO sessions (directory, log_path, log_mtime_ns, log_size) VALUES (?, ?, ?, ?)",
+                (str(directory), str(log_path), stat.st_mtime_ns, stat.st_size),
+            ).lastrowid
+            self.insert_records(session_id, expand_scope(iter_records(log_path)))
+
+        return True
+
+    def insert_records(self, session_id: int, records: Iterable[dict]):
+        execute = self.connection.execute
+        start_timestamp: Optional[float] = None
+        scope_ids: dict[str, int] = {}
+        commands = []
+
+        for record in records:
+            record_type = record.get("type")
+
+            if record_type == "initialTiming":
+                start_timestamp = parse_timestamp(record["startTimestampISO"])
+                execute(
+                    "UPDATE sessions SET start_timestamp = ? WHERE id = ?",
+                    (start_timestamp, session_id),
+                )
+                continue
+
+            if record_type not in ["talonCommandPhrase", "talonIgnoredPhrase"]:
+                continue
+
+            ignored = record_type == "talonIgnoredPhrase"
+            text = record.get("phrase") or " ".join(
+                word["text"] for word in record.get("raw_words") or []
+            )
+            time_offset = phrase_time(record) if "timeOffsets" in record else None
+            timestamp = (
+                start_timestamp + time_offset
+                if start_timestamp is not None and time_offset is not None
+                else None
+            )
+            scope_id = (
+                self.get_scope_id(record["tags"], scope_ids)
+                if "tags" in record
+                else None
+            )
+
+            phrase_rowid = execute(
+                "INSERT INTO phrases (session_id, phrase_id, phrase, ignored, time_offset, timestamp, scope_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    session_id,
+                    record.get("id"),
+                    text,
+                    ignored,
+                    time_offset,
+                    timestamp,
+                    scope_id,
+                ),
+            ).lastrowid
+            if self.use_fts:
+                execute(
+                    "INSERT INTO phrases_fts (rowid, phrase) VALUES (?, ?)",
+                    (phrase_rowid, text),
+                )
+
+            for command in record.get("commands") or []:
+                user_rule = command.get("user_rule") or {}
+                commands.append(
+                    (
+                        phrase_rowid,
+                        command.get("file"),
+                        command.get("grammar"),
+                        user_rule.get("line"),
+                        user_rule.get("rule"),
+                    )
+                )
+
+        self.connection.executemany(
+            "INSERT INTO commands (phrase_rowid, file, grammar, rule_line, rule) VALUES (?, ?, ?, ?, ?)",
+            commands,
+        )
+
+    def get_scope_id(self, tags: list[str], cache: dict[str, int]) -> int:
+        key = json.dumps(sorted(tags))
+
+        scope_id = cache.get(key)
+        if scope_id is not None:
+            return scope_id
+
+        row = self.connection.execute(
+            "SELECT id FROM scopes WHERE tags = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            scope_id = row["id"]
+        else:
+            scope_id = self.connection.execute(
+                "INSERT INTO scopes (tags) VALUES (?)", (key,)
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT INTO scope_tags (scope_id, tag) VALUES (?, ?)",
+                [(scope_id, tag) for tag in set(tags)],
+            )
+
+        cache[key] = scope_id
+        return scope_id
+
+    def delete_session(self, session_id: int):
+        execute = self.connection.execute
+        if self.use_fts:
+            execute(
+                "INSERT INTO phrases_fts (phrases_fts, rowid, phrase) SELECT 'delete', id, phrase FROM phrases WHERE session_id = ?",
+                (session_id,),
+            )
+        execute(
+            "DELETE FROM commands WHERE phrase_rowid IN (SELECT id FROM phrases WHERE session_id = ?)",
+            (session_id,),
+        )
+        execute("DELETE FROM phrases WHERE session_id = ?", (session_id,))
+        execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def build_query(
+        self,
+        select: str,
+        text: Optional[str],
+        rule_file: Optional[str],
+        grammar: Optional[str],
+        tag: Optional[str],
+        start: Optional[datetime],
+        end: Optional[datetime],
+    ) -> tuple[str, list[Any]]:
+        conditions = []
+        parameters: list[Any] = []
+
+        if text is not None:
+            if self.use_fts:
+                conditions.append(
+                    "phrases.id IN (SELECT rowid FROM phrases_fts WHERE phrases_fts MATCH ?)"
+                )
+                # Search for the text as a phrase, rather than FTS syntax
+                parameters.append('"' + text.replace('"', '""') + '"')
+            else:
+                conditions.append("phrases.phrase LIKE ?")
+                parameters.append(f"%{text}%")
+        if rule_file is not None:
+            conditions.append(
+                "phrases.id IN (SELECT phrase_rowid FROM commands WHERE file = ?)"
+            )
+            parameters.append(rule_file)
+        if grammar is not None:
+            conditions.append(
+                "phrases.id IN (SELECT phrase_rowid FROM commands WHERE grammar = ?)"
+            )
+            parameters.append(grammar)
+        if tag is not None:
+            conditions.append(
+                "phrases.scope_id IN (SELECT scope_id FROM scope_tags WHERE tag = ?)"
+            )
+            parameters.append(tag)
+        if start is not None:
+            conditions.append("phrases.timestamp >= ?")
+            parameters.append(start.timestamp())
+        if end is not None:
+            conditions.append("phrases.timestamp < ?")
+            parameters.append(end.timestamp())
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return (
+            f"{select} FROM phrases JOIN sessions ON sessions.id = phrases.session_id {where}",
+            parameters,
+        )
+
+    def find_phrases(
+        self,
+        text: Optional[str] = None,
+        rule_file: Optional[str] = None,
+        grammar: Optional[str] = None,
+        tag: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        limit: Optional[int] = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Returns the phrases matching all of the given filters, in the order
+        they were spoken.  `text` matches whole words of the phrase (or any
+        substring, without FTS5), `rule_file` is relative to the Talon home
+        directory as in the log, eg `user/pokey_talon/misc/a.talon`, and
+        `start` / `end` are compared with the time the phrase was spoken.
+        """
+        query, parameters = self.build_query(
+            "SELECT sessions.directory, phrases.phrase_id, phrases.phrase, phrases.ignored, phrases.time_offset, phrases.timestamp",
+            text,
+            rule_file,
+            grammar,
+            tag,
+            start,
+            end,
+        )
+        query += " ORDER BY phrases.timestamp, phrases.id"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+
+        return [
+            {
+                "directory": row["directory"],
+                "phraseId": row["phrase_id"],
+                "phrase": row["phrase"],
+                "ignored": bool(row["ignored"]),
+                "timeOffset": row["time_offset"],
+                "timestamp": row["timestamp"],
+            }
+            for row in self.connection.execute(query, parameters)
+        ]
+
+    def find_sessions(
+        self,
+        text: Optional[str] = None,
+        rule_file: Optional[str] = None,
+        grammar: Optional[str] = None,
+        tag: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> list[str]:
+        """Returns the directories of the recordings with any phrase matching
+        all of the given filters; see `find_phrases`"""
+        query, parameters = self.build_query(
+            "SELECT DISTINCT sessions.directory",
+            text,
+            rule_file,
+            grammar,
+            tag,
+            start,
+            end,
+        )
+        query += " ORDER BY sessions.directory"
+
+        return [row["directory"] for row in self.connection.execute(query, parameters)]
+
+
+def default_root() -> Path:
+    return Path.home() / "talon-recording-logs"
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="waxlog catalog",
+        description="Index recordings in a SQLite catalog and search their phrases",
+    )
+    parser.add_argument(
+        "--root",
+        type=Path,
+        default=default_root(),
+        help="Directory containing the recordings. Defaults to ~/talon-recording-logs",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("update", help="Index new or changed recordings")
+    query_parser = subparsers.add_parser(
+        "query", help="Print matching phrases as JSON lines"
+    )
+    query_parser.add_argument("--text", help="Words of the phrase")
+    query_parser.add_argument(
+        "--rule-file", help="File of a command, eg user/pokey_talon/misc/a.talon"
+    )
+    query_parser.add_argument("--grammar", help="Grammar of a command")
+    query_parser.add_argument("--tag", help="Tag active when the phrase was spoken")
+    query_parser.add_argument(
+        "--start",
+        type=datetime.fromisoformat,
+        help="Only phrases spoken at or after this time, eg 2022-09-06T13:00",
+    )
+    query_parser.add_argument(
+        "--end",
+        type=datetime.fromisoformat,
+        help="Only phrases spoken before this time",
+    )
+    query_parser.add_argument("--limit", type=int)
+    query_parser.add_argument(
+        "--sessions",
+        action="store_true",
+        help="Print the matching recording directories instead",
+    )
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(args.root / CATALOG_FILENAME)
+
+    if args.command == "update":
+        count = catalog.update(args.root)
+        print(f"Indexed {count} recordings", file=sys.stderr)
+        return
+
+    filters = {
+        "text": args.text,
+        "rule_file": args.rule_file,
+        "grammar": args.grammar,
+        "tag": args.tag,
+        "start": args.start,
+        "end": args.end,
+    }
+    if args.sessions:
+        for directory in catalog.find_sessions(**filters):
+            print(directory)
+        return
+
+    for phrase in catalog.find_phrases(**filters, limit=args.limit):
+        sys.stdout.write(json.dumps(phrase) + "\n")
@@ -0,0 +1,27 @@
+"""
+Defers importing modules that are slow to import, or only needed by some
+commands, until they are first used.  See the note in `waxlog/__init__.py`.
+"""
+
+import importlib
+from typing import Any
+
+
+class LazyModule:
+    """Stands in for a module, importing it the first time one of its
+    attributes is used"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute: str) -> Any:
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+
+def lazy_import(name: str) -> Any:
+    """Returns a stand-in for the module `name`, which is imported the first
+    time one of its attributes is used, eg `np = lazy_import("numpy")`"""
+    return LazyModule(name)
@@ -0,0 +1,387 @@
+"""
+Streams the records of a wax `talon-log.jsonl` (or binary `talon-log.wax`, or
+segmented `talon-log.manifest.json`), joining each `talonCommandPhrase` record with the `commandCompleted` record
+written for the same phrase after the command ran.
+"""
+
+import argparse
+import bisect
+import json
+import os
+import sys
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+
+from .lazy import lazy_import
+from .scope import ScopeTracker, expand_scope, is_keyframe
+from .segments import MANIFEST_FILENAME, iter_segment_lines, iter_segmented_records
+
+hashlib = lazy_import("hashlib")
+
+# Maximum number of phrases held waiting for their `commandCompleted` record
+DEFAULT_MAX_PENDING = 64
+
+LOG_FILENAMES = ["talon-log.jsonl", "talon-log.wax", MANIFEST_FILENAME]
+
+INDEX_VERSION = 3
+INDEX_SUFFIX = ".index.json"
+# Number of bytes at the start and end of the indexed part of a log that are
+# hashed, to detect a log that has been rewritten rather than appended to
+INDEX_FINGERPRINT_BYTES = 4096
+
+
+def iter_lines(path: Union[str, Path], start: int = 0) -> Iterator[tuple[int, bytes]]:
+    """
+    Yields each line of the log along with its byte offset, starting from
+    byte offset `start`.  A trailing line that hasn't been completely written
+    yet is skipped.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            yield offset, line
+            offset += len(line)
+
+
+def find_log(path: Union[str, Path]) -> Path:
+    """Returns the log of a recording directory, or `path` if it is a log"""
+    path = Path(path)
+
+    if not path.is_dir():
+        return path
+
+    for filename in LOG_FILENAMES:
+        if (path / filename).exists():
+            return path / filename
+
+    raise FileNotFoundError(f"Couldn't find a wax log in {path}")
+
+
+def is_manifest(path: Union[str, Path]) -> bool:
+    path = Path(path)
+    return path.name == MANIFEST_FILENAME or (path / MANIFEST_FILENAME).exists()
+
+
+def iter_records(path: Union[str, Path]) -> Iterator[dict]:
+    path = Path(path)
+
+    if path.suffix == ".wax":
+        from .binary import iter_records as iter_binary_records
+
+        yield from iter_binary_records(path)
+        return
+
+    if is_manifest(path):
+        if path.name != MANIFEST_FILENAME:
+            path = path / MANIFEST_FILENAME
+        yield from iter_segmented_records(path)
+        return
+
+    if path.suffix in [".gz", ".zst"]:
+        lines = iter_segment_lines(path)
+    else:
+        lines = (line for _, line in iter_lines(path))
+
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def is_completion(record: dict) -> bool:
+    return record.get("commandCompleted", False) and "type" not in record
+
+
+def merge_completion(phrase: dict, completion: dict) -> dict:
+    """Merges a `commandCompleted` record into the record for its phrase"""
+    merged = dict(phrase)
+
+    for key, value in completion.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_completion(merged[key], value)
+        else:
+            merged[key] = value
+
+    return merged
+
+
+def iter_phrases(
+    records: Iterable[dict], max_pending: int = DEFAULT_MAX_PENDING
+) -> Iterator[dict]:
+    """
+    Yields each `talonCommandPhrase` record, in order, merged with its
+    `commandCompleted` record.  At most `max_pending` phrases are held
+    waiting for their completion; beyond that, the oldest phrase is yielded
+    without it.  Phrases whose command never completed, such as the one that
+    stopped the recording, are yielded without `commandCompleted`.
+    """
+    # Maps phrase id to [record, whether it has been completed]
+    pending: OrderedDict[str, list] = OrderedDict()
+
+    for record in records:
+        if record.get("type") == "talonCommandPhrase":
+            pending[record["id"]] = [record, False]
+        elif is_completion(record):
+            entry = pending.get(record["id"])
+            if entry is None:
+                continue
+            entry[0] = merge_completion(entry[0], record)
+            entry[1] = True
+        else:
+            continue
+
+        while pending:
+            phrase, is_completed = next(iter(pending.values()))
+            if not is_completed and len(pending) <= max_pending:
+                break
+            pending.popitem(last=False)
+            yield phrase
+
+    for phrase, _ in pending.values():
+        yield phrase
+
+
+def phrase_time(record: dict) -> float:
+    time_offsets = record["timeOffsets"]
+    speech_start = time_offsets.get("speechStart")
+    return (
+        speech_start
+        if speech_start is not None
+        else time_offsets["prePhraseCallbackStart"]
+    )
+
+
+def log_fingerprint(path: Path, size: int) -> str:
+    """Returns a hash of the start and end of the first `size` bytes of a log"""
+    with open(path, "rb") as f:
+        head = f.read(min(size, INDEX_FINGERPRINT_BYTES))
+        f.seek(max(0, size - INDEX_FINGERPRINT_BYTES))
+        tail = f.read(size - f.tell())
+
+    return hashlib.sha256(head + tail).hexdigest()
+
+
+class SessionIndex:
+    """
+    An index from phrase id and time offset to the byte offsets of a phrase's
+    records in a log, stored in a sidecar file next to the log.  The index is
+    extended incrementally when the log grows, and rebuilt if the part of the
+    log that was indexed has changed.
+    """
+
+    def __init__(self, log_path: Union[str, Path]):
+        self.log_path = Path(log_path)
+        self.index_path = self.log_path.with_name(self.log_path.name + INDEX_SUFFIX)
+        # Number of bytes of the log that have been indexed
+        self.log_size = 0
+        # Maps phrase id to [offset, completion offset or None, time]
+        self.phrases: dict[str, list] = {}
+        # Offsets of the phrases that carry their full scope, in order
+        self.keyframes: list[int] = []
+        self.sorted_times: list[float] = []
+        self.sorted_ids: list[str] = []
+
+    @classmethod
+    def open(cls, log_path: Union[str, Path]) -> "SessionIndex":
+        """Loads the index for a log, building or extending it as necessary"""
+        index = cls(log_path)
+
+        if index.log_path.suffix == ".wax":
+            raise ValueError(
+                "Binary logs can't be indexed; convert them with `waxlog to-jsonl` first"
+            )
+        if is_manifest(index.log_path) or index.log_path.suffix in [".gz", ".zst"]:
+            raise ValueError(
+                "Segmented logs can't be indexed; use `iter_records` on the manifest instead"
+            )
+
+        try:
+            with open(index.index_path) as f:
+                data = json.load(f)
+            if (
+                data["version"] == INDEX_VERSION
+                and data["logSize"] <= os.path.getsize(index.log_path)
+                and data["logFingerprint"]
+                == log_fingerprint(index.log_path, data["logSize"])
+            ):
+                index.log_size = data["logSize"]
+                index.phrases = {
+                    phrase_id: [offset, completion_offset, time]
+                    for phrase_id, offset, completion_offset, time in data["phrases"]
+                }
+                index.keyframes = data["keyframes"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index.update()
+
+        return index
+
+    def update(self):
+        """Indexes any records appended to the log since the last update, and
+        saves the index if anything changed"""
+        if os.path.getsize(self.log_path) == self.log_size:
+            self.sort()
+            return
+
+        for offset, line in iter_lines(self.log_path, self.log_size):
+            self.log_size = offset + len(line)
+
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            if record.get("type") == "talonCommandPhrase":
+                self.phrases[record["id"]] = [offset, None, phrase_time(record)]
+                if is_keyframe(record):
+                    self.keyframes.append(offset)
+            elif is_completion(record):
+                entry = self.phrases.get(record["id"])
+                if entry is not None:
+                    entry[1] = offset
+
+        self.sort()
+        self.save()
+
+    def sort(self):
+        entries = sorted(
+            (entry[2], phrase_id) for phrase_id, entry in self.phrases.items()
+        )
+        self.sorted_times = [time for time, _ in entries]
+        self.sorted_ids = [phrase_id for _, phrase_id in entries]
+
+    def save(self):
+        temporary_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        with open(temporary_path, "w") as f:
+            json.dump(
+                {
+                    "version": INDEX_VERSION,
+                    "logSize": self.log_size,
+                    "logFingerprint": log_fingerprint(self.log_path, self.log_size),
+                    "phrases": [
+                        [phrase_id, *entry] for phrase_id, entry in self.phrases.items()
+                    ],
+                    "keyframes": self.keyframes,
+                },
+                f,
+            )
+        os.replace(temporary_path, self.index_path)
+
+    def read_record(self, f, offset: int) -> dict:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+    def rebuild_scope(self, phrase: dict, offset: int) -> dict:
+        """Rebuilds the full scope of a phrase logged with a scope delta by
+        replaying the phrases since the preceding keyframe"""
+        idx = bisect.bisect_right(self.keyframes, offset)
+        if idx == 0:
+            return phrase
+
+        tracker = ScopeTracker()
+        for _, line in iter_lines(self.log_path, self.keyframes[idx - 1]):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("type") != "talonCommandPhrase":
+                continue
+            if record["id"] == phrase["id"]:
+                return tracker.expand(record)
+            tracker.update(record)
+
+        return phrase
+
+    def get_phrase(self, phrase_id: str) -> dict:
+        """Returns the record for a phrase, with its full scope, merged with
+        its completion"""
+        offset, completion_offset, _ = self.phrases[phrase_id]
+
+        with open(self.log_path, "rb") as f:
+            phrase = self.read_record(f, offset)
+            if not is_keyframe(phrase):
+                phrase = self.rebuild_scope(phrase, offset)
+            if completion_offset is not None:
+                phrase = merge_completion(
+                    phrase, self.read_record(f, completion_offset)
+                )
+
+        return phrase
+
+    def phrase_ids_between(self, start: float, end: float) -> list[str]:
+        """Returns the ids of phrases whose speech started in `[start, end)`,
+        in order of time"""
+        return self.sorted_ids[
+            bisect.bisect_left(self.sorted_times, start) : bisect.bisect_left(
+                self.sorted_times, end
+            )
+        ]
+
+    def phrases_between(self, start: float, end: float) -> Iterator[dict]:
+        for phrase_id in self.phrase_ids_between(start, end):
+            yield self.get_phrase(phrase_id)
+
+    def phrase_at(self, time: float) -> Optional[str]:
+        """Returns the id of the last phrase whose speech started at or before `time`"""
+        idx = bisect.bisect_right(self.sorted_times, time)
+        return self.sorted_ids[idx - 1] if idx else None
+
+
+def segmented_phrases_between(
+    path: Union[str, Path], start: float, end: float
+) -> Iterator[dict]:
+    """
+    Yields the phrases of a segmented log starting between `start` and `end`,
+    skipping segments that end before `start` and stopping at `end`.  Each
+    segment header carries the scope, so deltas can be expanded regardless of
+    where reading starts.
+    """
+    path = Path(path)
+    if path.name != MANIFEST_FILENAME:
+        path = path / MANIFEST_FILENAME
+
+    for phrase in iter_phrases(expand_scope(iter_segmented_records(path, start))):
+        time = phrase_time(phrase)
+        if time >= end:
+            break
+        if time >= start:
+            yield phrase
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="waxlog phrases",
+        description="Print the phrases of a wax log, merged with their completion records, as JSON lines",
+    )
+    parser.add_argument(
+        "log",
+        type=Path,
+        help="Path to talon-log.jsonl, talon-log.wax or talon-log.manifest.json",
+    )
+    parser.add_argument(
+        "--start", type=float, help="Only phrases starting at or after this offset"
+    )
+    parser.add_argument(
+        "--end", type=float, help="Only phrases starting before this offset"
+    )
+    args = parser.parse_args(argv)
+
+    if args.start is None and args.end is None:
+        phrases = iter_phrases(expand_scope(iter_records(args.log)))
+    elif is_manifest(args.log):
+        phrases = segmented_phrases_between(
+            args.log,
+            args.start if args.start is not None else float("-inf"),
+            args.end if args.end is not None else float("inf"),
+        )
+    else:
+        index = SessionIndex.open(args.log)
+        phrases = index.phrases_between(
+            args.start if args.start is not None else float("-inf"),
+            args.end if args.end is not None else float("inf"),
+        )
+
+    for phrase in phrases:
+        sys.stdout.write(json.dumps(phrase) + "\n")
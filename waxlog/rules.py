@@ -0,0 +1,70 @@
+"""
+Finding the rule in a `.talon` file that a phrase matched, given the grammar
+reported by `sim()`.  Used both live, by wax's `parse_sim`, and offline, by
+`waxlog annotate`.
+"""
+
+import re
+from typing import Optional
+
+# Captures the grammar of a rule line, ie everything before the first `:`,
+# minus the optional anchoring characters
+RULE_RE = re.compile(r"\s*\^?\s*([^:]*?)\s*\$?\s*:")
+
+
+def normalize_grammar(grammar: str) -> str:
+    return " ".join(grammar.split())
+
+
+def index_rules(lines: list[str]) -> dict[str, Optional[dict]]:
+    """Maps the normalized grammar of each rule in a `.talon` file to its line
+    number and contents.  If the same grammar appears more than once, the
+    first occurrence wins.
+    """
+    rules = {}
+    for i, line in enumerate(lines):
+        match = RULE_RE.match(line)
+        if match is None:
+            continue
+
+        rules.setdefault(
+            normalize_grammar(match.group(1)), {"line": i + 1, "rule": line.strip()}
+        )
+
+    return rules
+
+
+def scan_for_rule(lines: list[str], grammar: str) -> Optional[dict]:
+    # The grammar from sim() has most of it; we need to match the optional white space,
+    # anchoring characters, and the :.
+    regex = re.compile(rf"\s*\^?\s*{re.escape(grammar)}\s*\$?\s*:")
+    for i in range(len(lines)):
+        line = lines[i]
+
+        if not regex.match(line):
+            continue
+
+        return {"line": i + 1, "rule": line.strip()}
+
+    return None
+
+
+def lookup_rule(
+    lines: list[str], rules: dict[str, Optional[dict]], grammar: str
+) -> Optional[dict]:
+    """
+    Finds the rule for `grammar` in a file with the given lines and
+    `index_rules` output.  Rules that couldn't be indexed (eg their grammar
+    contains a `:`) are found by scanning the file, and the answer is added
+    to `rules`.
+    """
+    key = normalize_grammar(grammar)
+
+    try:
+        return rules[key]
+    except KeyError:
+        pass
+
+    match = scan_for_rule(lines, grammar)
+    rules[key] = match
+    return match
@@ -0,0 +1,116 @@
+"""
+Delta encoding of the Talon modes and tags logged with each phrase.  When
+enabled with `user.wax_log_scope_deltas`, a `talonCommandPhrase` record
+either carries the full `modes` and `tags` (a keyframe) or, in their place, a
+`scopeDelta` such as
+
+    {"tags": {"added": ["user.foo"], "removed": ["user.bar"]}}
+
+relative to the previous command phrase.  Keys with no changes are omitted.
+Keyframes are written periodically so that the full scope can be rebuilt from
+any keyframe onwards without reading the whole log.  Rebuilt lists have the
+same members as the originals, but not necessarily the same order.
+"""
+
+from typing import Iterable, Iterator, Optional
+
+SCOPE_KEYS = ["modes", "tags"]
+
+
+def is_keyframe(record: dict) -> bool:
+    return "scopeDelta" not in record
+
+
+class ScopeDeltaEncoder:
+    """Replaces the scope of each phrase record with a delta from the previous
+    phrase, writing a keyframe every `keyframe_interval` phrases"""
+
+    def __init__(self, keyframe_interval: int):
+        self.keyframe_interval = keyframe_interval
+        self.phrases_since_keyframe: Optional[int] = None
+        self.previous: dict[str, set[str]] = {}
+
+    def encode(self, record: dict):
+        current = {key: set(record[key]) for key in SCOPE_KEYS}
+
+        if (
+            self.phrases_since_keyframe is None
+            or self.phrases_since_keyframe + 1 >= self.keyframe_interval
+        ):
+            self.phrases_since_keyframe = 0
+        else:
+            self.phrases_since_keyframe += 1
+
+            delta = {}
+            for key in SCOPE_KEYS:
+                changes = {}
+                added = current[key] - self.previous[key]
+                removed = self.previous[key] - current[key]
+                if added:
+                    changes["added"] = sorted(added)
+                if removed:
+                    changes["removed"] = sorted(removed)
+                if changes:
+                    delta[key] = changes
+
+            for key in SCOPE_KEYS:
+                del record[key]
+            record["scopeDelta"] = delta
+
+        self.previous = current
+
+
+class ScopeTracker:
+    """Rebuilds the full scope of phrase records written with scope deltas"""
+
+    def __init__(self):
+        self.scope: Optional[dict[str, list[str]]] = None
+
+    def update(self, record: dict) -> Optional[dict[str, list[str]]]:
+        """
+        Applies a `talonCommandPhrase` record, returning the full scope at
+        that phrase, or `None` if no keyframe has been seen yet
+        """
+        if is_keyframe(record):
+            self.scope = {key: list(record[key]) for key in SCOPE_KEYS}
+            return self.scope
+
+        if self.scope is None:
+            return None
+
+        scope = {}
+        for key in SCOPE_KEYS:
+            changes = record["scopeDelta"].get(key, {})
+            removed = set(changes.get("removed", []))
+            scope[key] = [
+                value for value in self.scope[key] if value not in removed
+            ] + changes.get("added", [])
+        self.scope = scope
+
+        return scope
+
+    def expand(self, record: dict) -> dict:
+        """Returns a copy of a phrase record with its full `modes` and `tags`
+        in place of its `scopeDelta`"""
+        scope = self.update(record)
+
+        if is_keyframe(record) or scope is None:
+            return record
+
+        expanded = {key: value for key, value in record.items() if key != "scopeDelta"}
+        expanded.update(scope)
+
+        return expanded
+
+
+def expand_scope(records: Iterable[dict]) -> Iterator[dict]:
+    """Yields the records of a log, with the full scope of every phrase"""
+    tracker = ScopeTracker()
+
+    for record in records:
+        if record.get("type") == "talonCommandPhrase":
+            record = tracker.expand(record)
+        elif record.get("type") == "segmentHeader" and tracker.scope is None:
+            # Reading starts partway through a segmented log
+            tracker.scope = record["scope"]
+        yield record
@@ -0,0 +1,91 @@
+"""
+Stores a screenshot as the tiles that changed relative to an earlier
+screenshot of the same region, and reconstructs the full screenshot from
+them.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Union
+
+from .lazy import lazy_import
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    np = lazy_import("numpy")
+
+DEFAULT_TILE_SIZE = 64
+
+
+def to_tiles(pixels: np.ndarray, tile_size: int) -> np.ndarray:
+    """Pads `pixels` to a whole number of tiles and returns an array indexed
+    by tile row, tile column, then pixel row, pixel column and channel"""
+    height, width, channels = pixels.shape
+    padded = np.pad(pixels, ((0, -height % tile_size), (0, -width % tile_size), (0, 0)))
+    rows = padded.shape[0] // tile_size
+    columns = padded.shape[1] // tile_size
+
+    return padded.reshape(rows, tile_size, columns, tile_size, channels).swapaxes(1, 2)
+
+
+def compute_delta(
+    base: np.ndarray, frame: np.ndarray, tile_size: int = DEFAULT_TILE_SIZE
+) -> dict[str, np.ndarray]:
+    """Returns the tiles of `frame` that differ from `base`, along with their
+    positions.  `base` and `frame` must have the same shape"""
+    if base.shape != frame.shape:
+        raise ValueError(f"Can't diff frames of shape {base.shape} and {frame.shape}")
+
+    base_tiles = to_tiles(base, tile_size)
+    frame_tiles = to_tiles(frame, tile_size)
+    changed = (base_tiles != frame_tiles).any(axis=(2, 3, 4))
+
+    return {
+        "shape": np.array(frame.shape),
+        "tileSize": np.array(tile_size),
+        "positions": np.argwhere(changed).astype(np.int32),
+        "tiles": frame_tiles[changed],
+    }
+
+
+def save_delta(path: Union[str, Path], delta: dict[str, np.ndarray]):
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **delta)
+
+
+def load_delta(path: Union[str, Path]) -> dict[str, np.ndarray]:
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def apply_delta(base: np.ndarray, delta: dict[str, np.ndarray]) -> np.ndarray:
+    """Returns the frame that `delta` was computed from, given its base frame"""
+    height, width, channels = (int(size) for size in delta["shape"])
+    tile_size = int(delta["tileSize"])
+
+    tiles = to_tiles(base, tile_size).copy()
+    for (row, column), tile in zip(delta["positions"], delta["tiles"]):
+        tiles[row, column] = tile
+
+    rows, columns = tiles.shape[:2]
+    frame = tiles.swapaxes(1, 2).reshape(
+        rows * tile_size, columns * tile_size, channels
+    )
+
+    return frame[:height, :width]
+
+
+def reconstruct_screenshot(
+    base_pixels: np.ndarray, delta_path: Union[str, Path]
+) -> np.ndarray:
+    """
+    Reconstructs a screenshot stored as a delta, eg the `postCommand`
+    screenshot of a phrase, whose log entry has a `baseFilename` naming the
+    screenshot it was diffed against.  `base_pixels` should be the decoded
+    pixels of that screenshot, eg `numpy.asarray(PIL.Image.open(path))`.
+    The reconstruction is only exact if the base screenshot was stored
+    losslessly, ie as `png`.
+    """
+    return apply_delta(base_pixels, load_delta(delta_path))
@@ -0,0 +1,119 @@
+"""
+Reading logs that were split into segments with `user.wax_log_segment_bytes`
+or `user.wax_log_segment_minutes`.  Such a recording has
+`talon-log.000.jsonl`, `talon-log.001.jsonl`, ..., each starting with a
+`segmentHeader` record, eg
+
+    {"type": "segmentHeader", "index": 1, "startOffset": 1048721, "scope": {"modes": [...], "tags": [...]}}
+
+where `startOffset` is the number of bytes of log before the segment and
+`scope` is the full scope as of the end of the previous segment (or `null`),
+so that phrases logged with scope deltas can be read starting from any
+segment.  `talon-log.manifest.json` lists the segments along with the range
+of time offsets they cover.  Closed segments may have been compressed to
+`.jsonl.gz` or `.jsonl.zst`.
+"""
+
+import io
+import json
+import os
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Union
+
+from .lazy import lazy_import
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+gzip = lazy_import("gzip")
+
+MANIFEST_FILENAME = "talon-log.manifest.json"
+MANIFEST_VERSION = 1
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def segment_filename(index: int) -> str:
+    return f"talon-log.{index:03}.jsonl"
+
+
+def load_manifest(path: Union[str, Path]) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(path: Path, manifest: dict):
+    temporary_path = path.with_name(path.name + ".tmp")
+    with open(temporary_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary_path, path)
+
+
+def open_segment(path: Union[str, Path]) -> BinaryIO:
+    """Opens a segment for reading, decompressing it if necessary"""
+    path = Path(path)
+
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    if path.suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError(f"Reading {path.name} requires the zstandard package")
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        )
+
+    return open(path, "rb")
+
+
+def find_segment(directory: Path, filename: str) -> Path:
+    """Returns the path of a segment, which may have been compressed since the
+    manifest was read"""
+    name = filename
+    for suffix in COMPRESSION_SUFFIXES.values():
+        name = name.removesuffix(suffix)
+
+    for candidate in [
+        filename,
+        name,
+        *(name + s for s in COMPRESSION_SUFFIXES.values()),
+    ]:
+        if (directory / candidate).exists():
+            return directory / candidate
+
+    raise FileNotFoundError(f"Couldn't find log segment {filename} in {directory}")
+
+
+def iter_segment_lines(path: Union[str, Path]) -> Iterator[bytes]:
+    """Yields the complete lines of a segment"""
+    with open_segment(path) as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            yield line
+
+
+def iter_segmented_records(
+    manifest_path: Union[str, Path], start: Optional[float] = None
+) -> Iterator[dict]:
+    """
+    Yields the records of every segment listed in a manifest, in order.  If
+    `start` is given, segments whose records all end before that time offset
+    are skipped.
+    """
+    manifest_path = Path(manifest_path)
+    manifest = load_manifest(manifest_path)
+
+    for segment in manifest["segments"]:
+        end_time_offset = segment.get("endTimeOffset")
+        if (
+            start is not None
+            and end_time_offset is not None
+            and end_time_offset < start
+        ):
+            continue
+
+        path = find_segment(manifest_path.parent, segment["filename"])
+        for line in iter_segment_lines(path):
+            if line.strip():
+                yield json.loads(line)
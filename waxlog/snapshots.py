@@ -0,0 +1,246 @@
+"""
+Compaction of the Cursorless snapshots in a recording's `snapshots`
+directory.  A compacted snapshot has its `documentContents` block replaced by
+a reference to a blob in `snapshots/blobs`, eg
+
+    documentContents: {waxBlob: 3a7bd3e2360a3d29eea436fcfb7e44c735d117c42d1c1835420b6b9942dd4f1b}
+
+where the blob, named by the SHA-256 of the exact bytes it replaced, is stored
+either in full (`<hash>.full`) or as a line diff from the previous snapshot's
+blob (`<hash>.diff.json`).  Identical documents share a single blob.
+`load_snapshot` returns the original bytes of a snapshot, and
+`rehydrate_snapshots` restores a whole directory.
+"""
+
+import argparse
+import json
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Union
+
+from .lazy import lazy_import
+
+difflib = lazy_import("difflib")
+hashlib = lazy_import("hashlib")
+
+BLOBS_DIRECTORY_NAME = "blobs"
+DOCUMENT_CONTENTS_PREFIX = b"documentContents:"
+BLOB_REFERENCE_RE = re.compile(
+    rb"^documentContents: \{waxBlob: ([0-9a-f]{64})\}(\r?\n)?$"
+)
+
+# Blocks smaller than this are left in place
+MIN_BLOB_SIZE = 256
+# Maximum number of diffs that must be applied to rebuild a blob
+MAX_DIFF_CHAIN = 20
+
+
+def find_document_contents(lines: list[bytes]) -> Optional[tuple[int, int]]:
+    """
+    Returns the range of lines holding the `documentContents` key and its
+    value, ie the key's line and any indented or blank lines after it
+    """
+    for start, line in enumerate(lines):
+        if line.startswith(DOCUMENT_CONTENTS_PREFIX):
+            end = start + 1
+            while end < len(lines) and (
+                lines[end].startswith(b" ") or not lines[end].strip()
+            ):
+                end += 1
+            return start, end
+
+    return None
+
+
+def blob_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def decode_lines(data: bytes) -> list[str]:
+    # NB: surrogateescape so that arbitrary bytes survive the trip through JSON
+    return data.decode("utf-8", "surrogateescape").splitlines(keepends=True)
+
+
+def encode_lines(lines: list[str]) -> bytes:
+    return "".join(lines).encode("utf-8", "surrogateescape")
+
+
+def compute_diff(base: bytes, data: bytes) -> list:
+    """Returns a list of operations that turn the lines of `base` into the
+    lines of `data`: `["=", start, end]` copies lines of `base`, and
+    `["+", lines]` inserts new lines"""
+    base_lines = decode_lines(base)
+    lines = decode_lines(data)
+    operations = []
+
+    matcher = difflib.SequenceMatcher(None, base_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            operations.append(["=", i1, i2])
+        elif j2 > j1:
+            operations.append(["+", lines[j1:j2]])
+
+    return operations
+
+
+def apply_diff(base: bytes, operations: list) -> bytes:
+    base_lines = decode_lines(base)
+    lines = []
+
+    for operation in operations:
+        if operation[0] == "=":
+            lines.extend(base_lines[operation[1] : operation[2]])
+        else:
+            lines.extend(operation[1])
+
+    return encode_lines(lines)
+
+
+class SnapshotStore:
+    """
+    Compacts snapshots in a directory into its blob store.  Snapshots should
+    be compacted in the order they were taken, so that consecutive documents
+    are stored as diffs.
+    """
+
+    def __init__(self, snapshots_directory: Path):
+        self.blobs_directory = snapshots_directory / BLOBS_DIRECTORY_NAME
+        self.blobs_directory.mkdir(exist_ok=True)
+        # Key and contents of the last blob stored
+        self.previous_key: Optional[str] = None
+        self.previous_data: Optional[bytes] = None
+        # Maps the key of each blob to the number of diffs needed to rebuild it
+        self.chain_lengths: dict[str, int] = {}
+
+    def compact(self, path: Path) -> bool:
+        """Rewrites a snapshot to refer to a blob, returning whether it did so"""
+        data = path.read_bytes()
+        lines = data.splitlines(keepends=True)
+
+        block_range = find_document_contents(lines)
+        if block_range is None:
+            return False
+
+        start, end = block_range
+        block = b"".join(lines[start:end])
+        if len(block) < MIN_BLOB_SIZE or BLOB_REFERENCE_RE.match(lines[start]):
+            return False
+
+        key = blob_key(block)
+        if key not in self.chain_lengths:
+            self.store_blob(key, block)
+        self.previous_key = key
+        self.previous_data = block
+
+        line_ending = b"\r\n" if lines[start].endswith(b"\r\n") else b"\n"
+        reference = b"documentContents: {waxBlob: %s}%s" % (
+            key.encode(),
+            line_ending,
+        )
+
+        temporary_path = path.with_name(path.name + ".tmp")
+        temporary_path.write_bytes(b"".join([*lines[:start], reference, *lines[end:]]))
+        os.replace(temporary_path, path)
+
+        return True
+
+    def store_blob(self, key: str, data: bytes):
+        chain_length = 0
+        contents = data
+        suffix = ".full"
+
+        if (
+            self.previous_key is not None
+            and self.chain_lengths[self.previous_key] < MAX_DIFF_CHAIN
+        ):
+            diff = json.dumps(
+                {
+                    "base": self.previous_key,
+                    "operations": compute_diff(self.previous_data, data),
+                }
+            ).encode()
+            if len(diff) < len(data):
+                chain_length = self.chain_lengths[self.previous_key] + 1
+                contents = diff
+                suffix = ".diff.json"
+
+        # Blob is written before any snapshot refers to it
+        temporary_path = self.blobs_directory / f"{key}{suffix}.tmp"
+        temporary_path.write_bytes(contents)
+        os.replace(temporary_path, self.blobs_directory / f"{key}{suffix}")
+
+        self.chain_lengths[key] = chain_length
+
+
+@lru_cache(maxsize=2 * MAX_DIFF_CHAIN)
+def read_blob(blobs_directory: Path, key: str) -> bytes:
+    full_path = blobs_directory / f"{key}.full"
+
+    if full_path.exists():
+        data = full_path.read_bytes()
+    else:
+        diff = json.loads((blobs_directory / f"{key}.diff.json").read_bytes())
+        data = apply_diff(read_blob(blobs_directory, diff["base"]), diff["operations"])
+
+    if blob_key(data) != key:
+        raise ValueError(f"Snapshot blob {key} is corrupt")
+
+    return data
+
+
+def load_snapshot(path: Union[str, Path]) -> bytes:
+    """Returns the original bytes of a snapshot, whether or not it has been
+    compacted"""
+    path = Path(path)
+    data = path.read_bytes()
+    lines = data.splitlines(keepends=True)
+
+    for idx, line in enumerate(lines):
+        match = BLOB_REFERENCE_RE.match(line)
+        if match is not None:
+            lines[idx] = read_blob(
+                path.parent / BLOBS_DIRECTORY_NAME, match.group(1).decode()
+            )
+            return b"".join(lines)
+
+    return data
+
+
+def rehydrate_snapshots(
+    snapshots_directory: Union[str, Path],
+    output_directory: Optional[Union[str, Path]] = None,
+):
+    """Writes the original version of every snapshot in a directory to
+    `output_directory`, or back in place if not given"""
+    snapshots_directory = Path(snapshots_directory)
+    output_directory = (
+        Path(output_directory) if output_directory is not None else snapshots_directory
+    )
+    output_directory.mkdir(parents=True, exist_ok=True)
+
+    for path in sorted(snapshots_directory.glob("*.yaml")):
+        output_path = output_directory / path.name
+        temporary_path = output_path.with_name(output_path.name + ".tmp")
+        temporary_path.write_bytes(load_snapshot(path))
+        os.replace(temporary_path, output_path)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="waxlog rehydrate-snapshots",
+        description="Restore the original Cursorless snapshots of a recording compacted with user.wax_cursorless_snapshot_compaction",
+    )
+    parser.add_argument(
+        "snapshots", type=Path, help="Path to the recording's snapshots directory"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="Directory to write the snapshots to; defaults to rewriting them in place",
+    )
+    args = parser.parse_args(argv)
+
+    rehydrate_snapshots(args.snapshots, args.output)
@@ -0,0 +1,308 @@
+"""
+Summary statistics of a recording, computed incrementally from its records
+in constant memory, so that `summary.json` can be written when recording
+stops without reading the log again.  `SessionStats.add` takes each record
+as it is logged; `summary` returns eg
+
+    {
+      "version": 1,
+      "durationSeconds": 3600.2,
+      "phrases": {"total": 1800, "command": 1650, "ignored": 150, "ignoredRate": 0.083, "perMinute": 30.0},
+      "words": 5400,
+      "recognitionLatency": {"count": 1650, "mean": 0.31, "min": 0.12, "max": 1.4, "p50": 0.29, "p90": 0.45, "p99": 0.8},
+      "commandDuration": {...},
+      "topPhrases": [{"value": "pre harp", "count": 40, "error": 0}, ...],
+      "topCommands": [...],
+      "topRules": [{"value": "user/pokey_talon/misc/a.talon:3", "rule": "foo bar: key(a)", "count": 12, "error": 0}, ...],
+      "topFiles": [...]
+    }
+
+Latencies are in seconds.  `recognitionLatency` is the time from the end of
+the last word of a phrase to its pre-phrase callback, and `commandDuration`
+the time from the end of the pre-phrase callback to the start of the
+post-phrase callback.  Percentiles come from a histogram with logarithmic
+buckets, so are accurate to within `RELATIVE_ACCURACY`.  The top lists are
+approximate heavy hitters: an item's true count is between `count - error`
+and `count`.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Hashable, Optional
+
+from .reader import find_log, iter_records
+
+SUMMARY_FILENAME = "summary.json"
+SUMMARY_VERSION = 1
+
+RELATIVE_ACCURACY = 0.02
+# Latencies outside this range, in seconds, are counted in the first or last
+# bucket
+MIN_LATENCY = 1e-6
+MAX_LATENCY = 1e3
+SUMMARY_PERCENTILES = [50, 90, 99]
+
+# Number of items tracked by each top list, of which the top `TOP_COUNT` are
+# reported
+TOP_CAPACITY = 200
+TOP_COUNT = 20
+
+# Maximum number of phrases whose pre-phrase callback end is remembered while
+# waiting for their `commandCompleted` record
+MAX_PENDING_PHRASES = 64
+
+
+class LatencyHistogram:
+    """
+    Counts values in buckets whose bounds grow geometrically, so quantiles are
+    accurate to within a fixed relative error, using a fixed amount of memory
+    """
+
+    def __init__(self):
+        self.gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = [0] * (
+            math.ceil(math.log(MAX_LATENCY / MIN_LATENCY) / self.log_gamma) + 1
+        )
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float):
+        if math.isnan(value):
+            return
+
+        idx = (
+            0
+            if value <= MIN_LATENCY
+            else min(
+                math.ceil(math.log(value / MIN_LATENCY) / self.log_gamma),
+                len(self.buckets) - 1,
+            )
+        )
+        self.buckets[idx] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+
+        rank = nearest_rank(self.count, q)
+        seen = 0
+        for idx, count in enumerate(self.buckets):
+            seen += count
+            if seen > rank:
+                break
+
+        # The value with the least relative error from any in the bucket
+        estimate = MIN_LATENCY * self.gamma**idx * 2 / (1 + self.gamma)
+        return min(max(estimate, self.min), self.max)
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            **{f"p{p}": self.quantile(p / 100) for p in SUMMARY_PERCENTILES},
+        }
+
+
+def nearest_rank(count: int, q: float) -> int:
+    """Returns the index, in sorted order, of the `q` quantile of `count`
+    values by the nearest-rank method, ie the smallest value that at least a
+    fraction `q` of the values are less than or equal to.  Used for every
+    percentile wax reports, so that they agree"""
+    return max(0, math.ceil(count * q) - 1)
+
+
+class TopK:
+    """
+    Approximates the most frequent items with the Space-Saving algorithm:
+    at most `capacity` items are counted, and a new item replaces the least
+    frequent one, inheriting its count as its possible error.  Each item can
+    carry details, such as the text of a rule, which are reported with it.
+    """
+
+    def __init__(self, capacity: int = TOP_CAPACITY):
+        self.capacity = capacity
+        # Maps item to [count, error, details]
+        self.counters: dict[Hashable, list] = {}
+
+    def add(self, item: Hashable, details: Optional[dict] = None):
+        counter = self.counters.get(item)
+
+        if counter is None:
+            if len(self.counters) < self.capacity:
+                counter = self.counters[item] = [0, 0, None]
+            else:
+                evicted = min(self.counters, key=lambda key: self.counters[key][0])
+                count = self.counters.pop(evicted)[0]
+                counter = self.counters[item] = [count, count, None]
+
+        counter[0] += 1
+        if details is not None:
+            counter[2] = details
+
+    def top(self, count: int = TOP_COUNT) -> list[dict[str, Any]]:
+        items = sorted(
+            self.counters.items(), key=lambda item: item[1][0], reverse=True
+        )[:count]
+        return [
+            {"value": item, **(details or {}), "count": count, "error": error}
+            for item, (count, error, details) in items
+        ]
+
+
+class SessionStats:
+    """Aggregates the records of a recording as they are logged.  Thread safe,
+    so that the summary can be read while records are being added."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.command_phrases = 0
+        self.ignored_phrases = 0
+        self.words = 0
+        self.first_time: Optional[float] = None
+        self.last_time: Optional[float] = None
+        self.recognition_latency = LatencyHistogram()
+        self.command_duration = LatencyHistogram()
+        self.top_phrases = TopK()
+        self.top_commands = TopK()
+        self.top_rules = TopK()
+        self.top_files = TopK()
+        # Maps phrase id to the end of its pre-phrase callback
+        self.pending: OrderedDict[str, float] = OrderedDict()
+
+    def add(self, record: dict):
+        record_type = record.get("type")
+
+        if record_type in ["talonCommandPhrase", "talonIgnoredPhrase"]:
+            with self.lock:
+                self.add_phrase(record, record_type == "talonCommandPhrase")
+        elif record.get("commandCompleted") and record_type is None:
+            with self.lock:
+                self.add_completion(record)
+
+    def add_phrase(self, record: dict, is_command: bool):
+        time_offsets = record.get("timeOffsets") or {}
+        pre_phrase_start = time_offsets.get("prePhraseCallbackStart")
+        start = time_offsets.get("speechStart")
+        if start is None:
+            start = pre_phrase_start
+        self.add_time(start)
+        self.add_time(pre_phrase_start)
+
+        words = record.get("raw_words") or []
+        self.words += len(words)
+
+        if not is_command:
+            self.ignored_phrases += 1
+            return
+
+        self.command_phrases += 1
+
+        last_word_end = words[-1].get("end") if words else None
+        if last_word_end is not None and pre_phrase_start is not None:
+            self.recognition_latency.add(pre_phrase_start - last_word_end)
+
+        pre_phrase_end = time_offsets.get("prePhraseCallbackEnd")
+        if pre_phrase_end is not None and "id" in record:
+            self.pending[record["id"]] = pre_phrase_end
+            while len(self.pending) > MAX_PENDING_PHRASES:
+                self.pending.popitem(last=False)
+
+        if record.get("phrase"):
+            self.top_phrases.add(record["phrase"])
+
+        for command in record.get("commands") or []:
+            self.top_commands.add(command.get("grammar"))
+            self.top_files.add(command.get("file"))
+
+            user_rule = command.get("user_rule")
+            if user_rule is not None:
+                self.top_rules.add(
+                    f"{command.get('file')}:{user_rule['line']}",
+                    {"rule": user_rule["rule"]},
+                )
+
+    def add_completion(self, record: dict):
+        time_offsets = record.get("timeOffsets") or {}
+        self.add_time(time_offsets.get("postPhraseCallbackEnd"))
+
+        pre_phrase_end = self.pending.pop(record.get("id"), None)
+        post_phrase_start = time_offsets.get("postPhraseCallbackStart")
+        if pre_phrase_end is not None and post_phrase_start is not None:
+            self.command_duration.add(post_phrase_start - pre_phrase_end)
+
+    def add_time(self, time: Optional[float]):
+        if time is None:
+            return
+        if self.first_time is None or time < self.first_time:
+            self.first_time = time
+        if self.last_time is None or time > self.last_time:
+            self.last_time = time
+
+    def summary(self) -> dict[str, Any]:
+        with self.lock:
+            phrases = self.command_phrases + self.ignored_phrases
+            duration = (
+                self.last_time - self.first_time
+                if self.first_time is not None
+                else None
+            )
+
+            return {
+                "version": SUMMARY_VERSION,
+                "durationSeconds": duration,
+                "phrases": {
+                    "total": phrases,
+                    "command": self.command_phrases,
+                    "ignored": self.ignored_phrases,
+                    "ignoredRate": self.ignored_phrases / phrases if phrases else None,
+                    "perMinute": phrases / (duration / 60) if duration else None,
+                },
+                "words": self.words,
+                "recognitionLatency": self.recognition_latency.summary(),
+                "commandDuration": self.command_duration.summary(),
+                "topPhrases": self.top_phrases.top(),
+                "topCommands": self.top_commands.top(),
+                "topRules": self.top_rules.top(),
+                "topFiles": self.top_files.top(),
+            }
+
+    def save(self, directory: Path):
+        """Writes the summary to `summary.json` in `directory`"""
+        path = directory / SUMMARY_FILENAME
+        temporary_path = path.with_name(path.name + ".tmp")
+        with open(temporary_path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        os.replace(temporary_path, path)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="waxlog stats",
+        description="Print the summary statistics of a recording, as written to summary.json when recording stops",
+    )
+    parser.add_argument(
+        "recording", type=Path, help="Path to the recording directory or its log"
+    )
+    args = parser.parse_args(argv)
+
+    stats = SessionStats()
+    for record in iter_records(find_log(args.recording)):
+        stats.add(record)
+
+    json.dump(stats.summary(), sys.stdout, indent=2)
+    sys.stdout.write("\n")
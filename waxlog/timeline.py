@@ -0,0 +1,223 @@
+"""
+Exports the timing of a recording as columnar NumPy arrays, for video
+postprocessing such as cutting at phrase boundaries or extracting frames.
+`load_timeline` returns two tables, each a dict of equal length arrays:
+
+- `phrases`, one row per command phrase: `id`, `phrase`, every
+  `timeOffsets` key (eg `speechStart`, `prePhraseCallbackStart`,
+  `postPhraseCallbackEnd`), `<name>Screenshot` for the `timeOffset` of every
+  screenshot (eg `preCommandScreenshot`), `commandCompleted`, and
+  `wordOffset` / `wordCount`, the phrase's rows in `words`.
+- `words`, one row per word: `phraseIndex`, `start`, `end` and `text`.
+
+Times are float64 seconds relative to the purple flash at the start of the
+recording, with NaN where unknown.  `add_derived_metrics` adds
+`recognitionLatency` (from the end of the last word to the phrase callback)
+and `commandDuration` (from the end of the pre-phrase callback to the start
+of the post-phrase callback), and `add_frame_indices` adds a `<column>Frame`
+index for every time column, given the frame rate of the video and the time
+in the video at which the flash appears.
+
+`save_timeline` writes `timeline.phrases.npz` and `timeline.words.npz`, which
+load without pickling, eg `pandas.DataFrame(dict(numpy.load(path)))`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Union
+
+from .reader import find_log, iter_phrases, iter_records
+from .lazy import lazy_import
+from .scope import expand_scope
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    np = lazy_import("numpy")
+
+PHRASES_FILENAME = "timeline.phrases.npz"
+WORDS_FILENAME = "timeline.words.npz"
+
+# Columns of `phrases` that aren't points in time
+PHRASE_NON_TIME_COLUMNS = {
+    "id",
+    "phrase",
+    "commandCompleted",
+    "wordOffset",
+    "wordCount",
+    "recognitionLatency",
+    "commandDuration",
+}
+WORD_TIME_COLUMNS = ["start", "end"]
+
+
+@dataclass
+class Timeline:
+    phrases: dict[str, np.ndarray]
+    words: dict[str, np.ndarray]
+
+
+def time_or_nan(value: Optional[float]) -> float:
+    return math.nan if value is None else value
+
+
+def load_timeline(path: Union[str, Path]) -> Timeline:
+    """Reads the timeline of a recording directory or log"""
+    phrase_count = 0
+    ids: list[str] = []
+    texts: list[str] = []
+    completed: list[bool] = []
+    word_offsets: list[int] = []
+    word_counts: list[int] = []
+    # Time columns appear as their keys are first seen, so earlier rows are
+    # padded with NaN
+    times: dict[str, list[float]] = {}
+
+    phrase_indices: list[int] = []
+    word_starts: list[float] = []
+    word_ends: list[float] = []
+    word_texts: list[str] = []
+
+    def set_time(column: str, value: Optional[float]):
+        values = times.get(column)
+        if values is None:
+            values = times[column] = [math.nan] * phrase_count
+        values.append(time_or_nan(value))
+
+    for phrase in iter_phrases(expand_scope(iter_records(find_log(path)))):
+        ids.append(phrase["id"])
+        texts.append(phrase.get("phrase") or "")
+        completed.append(phrase.get("commandCompleted", False))
+
+        for key, value in phrase["timeOffsets"].items():
+            set_time(key, value)
+        for name, screenshot in (phrase.get("screenshots") or {}).items():
+            set_time(f"{name}Screenshot", screenshot.get("timeOffset"))
+
+        words = phrase.get("raw_words") or []
+        word_offsets.append(len(word_texts))
+        word_counts.append(len(words))
+        for word in words:
+            phrase_indices.append(phrase_count)
+            word_starts.append(time_or_nan(word["start"]))
+            word_ends.append(time_or_nan(word["end"]))
+            word_texts.append(word["text"])
+
+        phrase_count += 1
+        for values in times.values():
+            if len(values) < phrase_count:
+                values.append(math.nan)
+
+    return Timeline(
+        phrases={
+            "id": np.array(ids, dtype=str),
+            "phrase": np.array(texts, dtype=str),
+            "commandCompleted": np.array(completed, dtype=bool),
+            "wordOffset": np.array(word_offsets, dtype=np.int64),
+            "wordCount": np.array(word_counts, dtype=np.int64),
+            **{
+                column: np.array(values, dtype=np.float64)
+                for column, values in times.items()
+            },
+        },
+        words={
+            "phraseIndex": np.array(phrase_indices, dtype=np.int64),
+            "start": np.array(word_starts, dtype=np.float64),
+            "end": np.array(word_ends, dtype=np.float64),
+            "text": np.array(word_texts, dtype=str),
+        },
+    )
+
+
+def column_or_nan(table: dict[str, np.ndarray], column: str) -> np.ndarray:
+    row_count = len(next(iter(table.values())))
+    return table.get(column, np.full(row_count, np.nan))
+
+
+def add_derived_metrics(timeline: Timeline):
+    phrases = timeline.phrases
+    word_counts = phrases["wordCount"]
+
+    # End of the last word of each phrase, or NaN if it has no words
+    has_words = word_counts > 0
+    last_word_end = np.full(len(word_counts), np.nan)
+    last_word_end[has_words] = timeline.words["end"][
+        phrases["wordOffset"][has_words] + word_counts[has_words] - 1
+    ]
+
+    phrases["recognitionLatency"] = (
+        column_or_nan(phrases, "prePhraseCallbackStart") - last_word_end
+    )
+    phrases["commandDuration"] = column_or_nan(
+        phrases, "postPhraseCallbackStart"
+    ) - column_or_nan(phrases, "prePhraseCallbackEnd")
+
+
+def frame_indices(
+    times: np.ndarray, fps: float, video_offset: float = 0.0
+) -> np.ndarray:
+    """
+    Returns the index of the video frame showing each time, given the time
+    in the video at which the recording's purple flash appears.  Unknown
+    times map to -1.
+    """
+    frames = np.floor((times + video_offset) * fps)
+    return np.where(np.isnan(frames), -1, frames).astype(np.int64)
+
+
+def add_frame_indices(timeline: Timeline, fps: float, video_offset: float = 0.0):
+    phrases = timeline.phrases
+    for column in [
+        column
+        for column in phrases
+        if column not in PHRASE_NON_TIME_COLUMNS and not column.endswith("Frame")
+    ]:
+        phrases[f"{column}Frame"] = frame_indices(phrases[column], fps, video_offset)
+
+    for column in WORD_TIME_COLUMNS:
+        timeline.words[f"{column}Frame"] = frame_indices(
+            timeline.words[column], fps, video_offset
+        )
+
+
+def save_timeline(timeline: Timeline, directory: Path):
+    np.savez(directory / PHRASES_FILENAME, **timeline.phrases)
+    np.savez(directory / WORDS_FILENAME, **timeline.words)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="waxlog timeline",
+        description="Export the phrase and word timings of a recording as NumPy arrays",
+    )
+    parser.add_argument(
+        "recording", type=Path, help="Path to the recording directory or its log"
+    )
+    parser.add_argument(
+        "--fps", type=float, help="Also add the video frame index of every time"
+    )
+    parser.add_argument(
+        "--video-offset",
+        type=float,
+        default=0.0,
+        help="Time in seconds at which the purple flash appears in the video. Defaults to 0",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="Directory to write the arrays to; defaults to the recording directory",
+    )
+    args = parser.parse_args(argv)
+
+    timeline = load_timeline(args.recording)
+    add_derived_metrics(timeline)
+    if args.fps is not None:
+        add_frame_indices(timeline, args.fps, args.video_offset)
+
+    log_path = find_log(args.recording)
+    save_timeline(timeline, args.output or log_path.parent)
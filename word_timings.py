@@ -0,0 +1,119 @@
+import math
+import threading
+from array import array
+from typing import Any, Optional, Sequence
+
+# Span of a phrase's words in `WordTimings`, as (index of first word, count)
+WordSpan = tuple[int, int]
+
+# Number of expanded words to accumulate before discarding them
+DISCARD_WORD_COUNT = 4096
+
+
+class WordTimings:
+    """
+    The timing of every word recognized during a recording, relative to the
+    start of the recording.  Phrase callbacks append their words here, which
+    is much cheaper than building a dict per word, and the words are expanded
+    to the `raw_words` of the log when the record is serialized.  Records are
+    serialized in the order their words were appended, so once enough words
+    have been expanded they are discarded, keeping the buffers bounded
+    however long the recording, or flight recording, runs.
+
+    NB: Words are only appended, and discarded, on Talon's main thread, and
+    spans are only read after they have been appended, on the log writer
+    thread, so the lock only guards discarding against reading.
+    """
+
+    __slots__ = (
+        "recording_start_time",
+        "lock",
+        "base",
+        "expanded_end",
+        "times",
+        "word_ids",
+        "words",
+        "word_table",
+    )
+
+    def __init__(self, recording_start_time: float):
+        self.recording_start_time = recording_start_time
+        self.lock = threading.Lock()
+        # Index of the first word still held, as spans index every word ever
+        # appended
+        self.base = 0
+        # Index just after the last word expanded
+        self.expanded_end = 0
+        # Start and end time of each word; NaN if unknown
+        self.times = array("d")
+        # Index into `words` of the text of each word
+        self.word_ids = array("I")
+        # Each distinct word text, and a map from text to index in `words`
+        self.words: list[str] = []
+        self.word_table: dict[str, int] = {}
+
+    def append(self, words: Sequence[Any]) -> WordSpan:
+        """Appends the words of a phrase, as passed to the phrase callbacks"""
+        if self.expanded_end - self.base >= DISCARD_WORD_COUNT:
+            self.discard_expanded()
+
+        offset = self.base + len(self.word_ids)
+        recording_start_time = self.recording_start_time
+        times = self.times
+        word_ids = self.word_ids
+
+        for word in words:
+            start = word.start
+            end = word.end
+            times.append(math.nan if start is None else start - recording_start_time)
+            times.append(math.nan if end is None else end - recording_start_time)
+            word_ids.append(self.intern(str(word)))
+
+        return offset, len(words)
+
+    def intern(self, text: str) -> int:
+        word_id = self.word_table.get(text)
+        if word_id is None:
+            word_id = len(self.words)
+            self.word_table[text] = word_id
+            self.words.append(text)
+        return word_id
+
+    def expand(self, span: WordSpan) -> list[dict[str, Any]]:
+        """Returns the words in `span` in the `raw_words` format of the log"""
+        with self.lock:
+            offset, count = span
+            self.expanded_end = max(self.expanded_end, offset + count)
+            offset -= self.base
+            times = self.times[2 * offset : 2 * (offset + count)]
+            word_ids = self.word_ids[offset : offset + count]
+            words = self.words
+
+        return [
+            {
+                "start": time_or_none(times[2 * idx]),
+                "end": time_or_none(times[2 * idx + 1]),
+                "text": words[word_id],
+            }
+            for idx, word_id in enumerate(word_ids)
+        ]
+
+    def discard_expanded(self):
+        """Discards the words that have been expanded, along with any word
+        texts that only they used"""
+        with self.lock:
+            count = self.expanded_end - self.base
+            del self.times[: 2 * count]
+            del self.word_ids[:count]
+            self.base = self.expanded_end
+
+            words = self.words
+            self.words = []
+            self.word_table = {}
+            self.word_ids = array(
+                "I", [self.intern(words[word_id]) for word_id in self.word_ids]
+            )
+
+
+def time_or_none(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value